@@ -0,0 +1,79 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted"""
+
+    def __init__(self, message, status_code, retry_after=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounds in-flight work and the queue in front of it
+
+    Up to max_concurrent requests run at once; up to max_queue more wait for a slot.
+    Beyond that requests are rejected immediately (429), and queued requests that
+    wait longer than queue_timeout give up (503).
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=16, queue_timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0}
+
+    def acquire(self):
+        """Wait for a slot or raise Overloaded"""
+        # Fast path when a slot is free
+        if self._slots.acquire(blocking=False):
+            self._admitted()
+            return
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise Overloaded("Too many requests in progress, please retry", 429)
+            self._waiting += 1
+
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+        if not acquired:
+            with self._lock:
+                self._stats["timed_out"] += 1
+            raise Overloaded("Server is busy, please retry", 503, retry_after=int(self.queue_timeout))
+        self._admitted()
+
+    def release(self):
+        """Return a slot taken by acquire()"""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        """Queue depth and counters for health reporting"""
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "queued": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+            }
+
+    def _admitted(self):
+        with self._lock:
+            self._in_flight += 1
+            self._stats["admitted"] += 1
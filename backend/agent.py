@@ -1,18 +1,28 @@
-import openai
 import os
-import tempfile
-import io
-from elevenlabs import ElevenLabs, VoiceSettings
-from gtts import gTTS
-from pinecone import Pinecone, ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain.tools import Tool
-from langchain.agents import initialize_agent, AgentType
+import time
+import queue
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from streaming import iter_sentences, stream_speech
+from tts_cache import TTSCache, tts_cache_key
+from speech import AUDIO_FORMATS, STT_BACKENDS, TTS_BACKENDS, AudioBuffer, BackendChain, build_backends
+from sessions import SessionStore, SharedSessionStore
+from local_index import LocalVectorStore
+from answer_engine import ANSWER_MODES, AgentEngine, DirectRAGEngine
+from answer_cache import AnswerCache
+from patients import DEFAULT_DIRECTORY_PATH, PatientDirectory
+from patient_facts import DEFAULT_FACTS_PATH, FactStore, refers_to_patient
+from audio_preprocess import OUTPUT_FORMATS, ffmpeg_available, finalize_wav, preprocess_audio, transcode_stream
+from startup import RefreshingValue, Startup
+from keyword_index import DEFAULT_KEYWORD_INDEX_PATH, KeywordIndex
+from retrieval import HybridRetriever
+from context import ContextAssembler
+from metrics import observe, span
+from live_query import LiveQueryStore, VoiceActivityDetector
+from http_clients import WARMUP_URLS, HTTPClients
+from shared_state import state_from_env
 
 # Load environment variables
 load_dotenv()
@@ -21,61 +31,322 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_LOCAL_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "vector_index")
+DEFAULT_EMBEDDING_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "embedding_cache")
+
+# Fact answers synthesized ahead of time, most frequently asked first
+PRESYNTHESIZED_INTENTS = ["medications", "blood_pressure", "vitals", "last_visit", "plan", "assessment"]
+
+# Instructions placed ahead of the tool descriptions when running in agent mode
+AGENT_PREFIX = """You are a professional medical assistant. Provide direct, accurate medical information without conversational filler words or phrases.
+
+Instructions:
+- Be direct and professional
+- Never use acknowledgment phrases, filler words, or conversational starters
+- Never mention remembering previous conversations
+- Provide clear, factual medical information only
+- If information is unavailable, state this directly
+- Answer only what is asked
+- Use the medical_records_search tool to find relevant patient information
+- Important - Do not hallucinate or make up information. Only use the information provided by the medical_records_search tool.
+
+You have access to the following tools:"""
+
 class MedicalAssistant:
     def __init__(self):
-        # Initialize OpenAI client
-        self.client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        # Only cheap configuration happens here; clients, models and indexes are built by
+        # self.startup on background threads, concurrently, the first time they are needed
+        self.startup = Startup()
+        self.startup.add("http", self.setup_http)
+        self.startup.add("http_warmup", self.warm_connections)
+        self.startup.add("openai_client", self.setup_openai_client)
+        self.startup.add("stt", self.setup_stt)
+        self.startup.add("tts", self.setup_tts)
+        self.startup.add("embeddings", self.setup_embeddings)
+        self.startup.add("vectorstore", self.setup_vectorstore)
+        self.startup.add("retriever", self.setup_retriever)
+        self.startup.add("llm", self.setup_llm)
+        self.startup.add("answer_engine", self.setup_agent)
+        self.startup.add("fact_audio", self.presynthesize_facts)
         
-        # Initialize ElevenLabs client (optional)
-        try:
-            if os.getenv('ELEVENLABS_API_KEY'):
-                self.elevenlabs_client = ElevenLabs(api_key=os.getenv('ELEVENLABS_API_KEY'))
-                logger.info("ElevenLabs client initialized")
-            else:
-                self.elevenlabs_client = None
-                logger.info("No ElevenLabs API key found, will use Google TTS")
-        except Exception as e:
-            logger.warning(f"Failed to initialize ElevenLabs client: {e}")
-            self.elevenlabs_client = None
+        # Sessions and caches are also kept in a backend shared by every worker when one is configured
+        self.state = state_from_env()
+        shared = self.state if self.state.shared else None
         
-        # Initialize Pinecone with new API
-        self.pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+        # Synthesized audio cache shared by every request in this process
+        self.tts_cache = TTSCache(
+            max_bytes=int(os.getenv('TTS_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+            disk_dir=os.getenv('TTS_CACHE_DIR') or None,
+            shared=shared
+        )
+        
+        # Default delivery format for synthesized answers when the client does not ask for one
+        self.audio_format = os.getenv('TTS_AUDIO_FORMAT', 'mp3').lower()
+        if self.audio_format not in AUDIO_FORMATS:
+            logger.warning(f"Unknown TTS_AUDIO_FORMAT '{self.audio_format}', using mp3")
+            self.audio_format = 'mp3'
+        
+        # Uploads are transcribed from memory; Whisper itself rejects files over 25 MB
+        self.max_upload_bytes = int(os.getenv('MAX_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+        self.audio_preprocess = os.getenv('AUDIO_PREPROCESS', 'off').lower()
+        self.trim_silence = os.getenv('AUDIO_TRIM_SILENCE', 'true').lower() == 'true'
         
-        # Initialize embeddings and vector store
-        self.embeddings = OpenAIEmbeddings()
+        self.vector_store_backend = os.getenv('VECTOR_STORE', 'pinecone').lower()
         self.index_name = os.getenv('PINECONE_INDEX_NAME', 'medical-assistant')
+        self.pc = None
+        self.index_metadata = None
+        self.rag_tool = None
+        self.agent = None
+        
+        # Per-client conversation memory, bounded per session and in total
+        if shared is not None:
+            self.sessions = SharedSessionStore(
+                shared,
+                max_turns=int(os.getenv('SESSION_MAX_TURNS', '10')),
+                ttl_seconds=int(os.getenv('SESSION_TTL_SECONDS', '1800')),
+                max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', '1000'))
+            )
+        else:
+            self.sessions = SessionStore(
+                max_turns=int(os.getenv('SESSION_MAX_TURNS', '10')),
+                ttl_seconds=int(os.getenv('SESSION_TTL_SECONDS', '1800')),
+                max_sessions=int(os.getenv('SESSION_MAX_SESSIONS', '1000')),
+                max_bytes=int(os.getenv('SESSION_MAX_BYTES', str(16 * 1024 * 1024)))
+            )
+        self.history_token_budget = int(os.getenv('HISTORY_TOKEN_BUDGET', '1000'))
+        
+        # Per-request prompt budget shared by the template, history and retrieved records
+        self.prompt_token_budget = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+        self.context_assembler = ContextAssembler(max_tokens=int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500')))
+        
+        # Answers to repeated (or near-identical) questions, invalidated when records are re-ingested
+        self.patient_directory = PatientDirectory(os.getenv('PATIENT_DIRECTORY_PATH') or DEFAULT_DIRECTORY_PATH)
+        self.answer_cache = AnswerCache(
+            self.patient_directory,
+            embed=self.embed_query,
+            max_entries=int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000')),
+            ttl_seconds=int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600')),
+            similarity_threshold=float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.95')),
+            shared=shared
+        )
+        
+        # Simple field lookups answered from facts extracted at ingestion, without retrieval or the LLM
+        self.fast_path = os.getenv('FAST_PATH', 'true').lower() == 'true'
+        self.patient_facts = FactStore(os.getenv('PATIENT_FACTS_PATH') or DEFAULT_FACTS_PATH)
+        self.presynthesize_max = int(os.getenv('FAST_PATH_PRESYNTHESIZE_MAX', '200'))
+        
+        # Pre-rounds batches: LLM calls (and per-patient retrievals) in flight per batch
+        self.batch_max_concurrency = int(os.getenv('BATCH_MAX_CONCURRENCY', '4'))
+        
+        # Voice queries uploaded in frames while the clinician speaks, with speculative retrieval
+        self.live_queries = LiveQueryStore(
+            ttl_seconds=int(os.getenv('LIVE_QUERY_TTL_SECONDS', '60')),
+            max_queries=int(os.getenv('LIVE_MAX_QUERIES', '64')),
+            max_workers=int(os.getenv('LIVE_MAX_WORKERS', '4'))
+        )
+        self.live_partial_interval = float(os.getenv('LIVE_PARTIAL_INTERVAL_MS', '800')) / 1000
+        self.vad_threshold_db = float(os.getenv('LIVE_VAD_THRESHOLD_DB', '-45'))
+        self.vad_end_silence_ms = int(os.getenv('LIVE_VAD_END_SILENCE_MS', '700'))
+        
+        # "direct" answers with one retrieval and one LLM call; "agent" uses the ReAct agent
+        self.answer_mode = os.getenv('ANSWER_MODE', 'direct').lower()
+        if self.answer_mode not in ANSWER_MODES:
+            logger.warning(f"Unknown ANSWER_MODE '{self.answer_mode}', using direct")
+            self.answer_mode = 'direct'
+    
+    def start(self):
+        """Warm up every subsystem in the background instead of on first use"""
+        self.startup.start()
+    
+    def preload(self):
+        """Load indexes (and optionally local speech models) before gunicorn forks its workers
+
+        Workers then share their memory copy-on-write instead of each loading a
+        copy. Only subsystems that open no connections and start no threads are
+        loaded here; everything else starts in each worker via start().
+        """
+        names = ["http"]
+        if self.vector_store_backend == 'local':
+            names += ["embeddings", "vectorstore", "retriever"]
+        if os.getenv('PREFORK_PRELOAD_SPEECH', 'false').lower() == 'true':
+            names += ["openai_client", "stt", "tts"]
+        self.startup.preload(names)
+        logger.info(f"Preloaded {names} before forking workers")
+    
+    @property
+    def http(self):
+        return self.startup.get("http")
+    
+    @property
+    def client(self):
+        return self.startup.get("openai_client")
+    
+    @property
+    def stt(self):
+        return self.startup.get("stt")
+    
+    @property
+    def tts(self):
+        return self.startup.get("tts")
+    
+    @property
+    def embeddings(self):
+        return self.startup.get("embeddings")
+    
+    @property
+    def vectorstore(self):
+        return self.startup.get("vectorstore")
+    
+    @property
+    def retriever(self):
+        return self.startup.get("retriever")
+    
+    @property
+    def llm(self):
+        return self.startup.get("llm")
+    
+    @property
+    def answer_engine(self):
+        return self.startup.get("answer_engine")
+    
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+    
+    def setup_http(self):
+        """Keep-alive connection pools, timeouts and DNS cache shared by every vendor client"""
+        return HTTPClients.from_env()
+    
+    def warm_connections(self):
+        """Open connections to the configured vendors before the first query needs them"""
+        vendors = {}
+        if os.getenv('OPENAI_API_KEY'):
+            vendors["openai"] = (os.getenv('OPENAI_BASE_URL') or "https://api.openai.com/v1").rstrip("/") + "/models"
+        if "elevenlabs" in os.getenv('TTS_BACKENDS', 'elevenlabs,gtts').lower() and os.getenv('ELEVENLABS_API_KEY'):
+            vendors["elevenlabs"] = WARMUP_URLS["elevenlabs"]
+        warmed = self.http.warm(vendors)
+        self.http.keep_warm(vendors, float(os.getenv('HTTP_KEEP_WARM_SECONDS', '45')))
+        
+        # Pinecone keeps its own connection pool; a stats call opens a connection to the index host
+        if self.vector_store_backend == 'pinecone' and self.vectorstore is not None:
+            started = time.perf_counter()
+            try:
+                self.index.describe_index_stats()
+                warmed["pinecone"] = round((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                logger.warning(f"Failed to warm Pinecone connection: {e}")
+                warmed["pinecone"] = str(e)
+        return warmed
+    
+    def setup_openai_client(self):
+        import openai
+        return openai.OpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=self.http.client,
+            timeout=self.http.httpx_timeout
+        )
+    
+    def setup_stt(self):
+        """Speech-to-text backends, tried in configured order with timeouts and circuit breakers"""
+        backends = build_backends(os.getenv('STT_BACKENDS', 'openai'), STT_BACKENDS, openai_client=self.client, http=self.http)
+        logger.info(f"STT backends: {[backend.name for backend in backends]}")
+        return BackendChain.from_env("stt", backends)
+    
+    def setup_tts(self):
+        """Text-to-speech backends, tried in configured order with timeouts, circuit breakers and optional hedging"""
+        backends = build_backends(os.getenv('TTS_BACKENDS', 'elevenlabs,gtts'), TTS_BACKENDS, http=self.http)
+        logger.info(f"TTS backends: {[backend.name for backend in backends]}")
+        return BackendChain.from_env("tts", backends)
+    
+    def setup_embeddings(self):
+        """Embeddings cached on disk, with concurrent query embeddings sharing one API call"""
+        from langchain_openai import OpenAIEmbeddings
+        from embedding_cache import CachedEmbeddings
+        return CachedEmbeddings(
+            OpenAIEmbeddings(http_client=self.http.client, request_timeout=self.http.httpx_timeout),
+            cache_dir=os.getenv('EMBEDDING_CACHE_DIR') or DEFAULT_EMBEDDING_CACHE_DIR,
+            max_batch=int(os.getenv('EMBEDDING_MAX_BATCH', '64')),
+            max_wait=float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '10')) / 1000,
+            shared=self.state if self.state.shared else None
+        )
+    
+    def setup_llm(self):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.3,
+            openai_api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=self.http.client,
+            request_timeout=self.http.httpx_timeout
+        )
+    
+    def setup_vectorstore(self):
+        """Connect to the configured vector store backend (Pinecone or a local index)"""
+        if self.vector_store_backend == 'local':
+            index_dir = os.getenv('LOCAL_INDEX_DIR') or DEFAULT_LOCAL_INDEX_DIR
+            try:
+                vectorstore = LocalVectorStore.load(
+                    index_dir,
+                    self.embeddings,
+                    nprobe=int(os.getenv('LOCAL_INDEX_NPROBE', '8'))
+                )
+                logger.info(f"Loaded local vector index from {index_dir}")
+                return vectorstore
+            except FileNotFoundError:
+                logger.warning(f"Local vector index not found at {index_dir}. Please run the upload script with --vector-store local first.")
+            except Exception as e:
+                logger.error(f"Failed to load local vector index: {e}")
+            return None
+        
+        from pinecone import Pinecone
+        from langchain_pinecone import PineconeVectorStore
+        
+        # Initialize Pinecone with new API
+        self.pc = Pinecone(api_key=os.getenv('PINECONE_API_KEY'))
+        # Index names are fetched once here and then refreshed in the background, never by health probes
+        self.index_metadata = RefreshingValue(
+            lambda: [index.name for index in self.pc.list_indexes()],
+            refresh_interval=float(os.getenv('INDEX_METADATA_REFRESH_SECONDS', '300'))
+        )
         
         try:
             # Check if index exists and connect to it
-            if self.index_name in [index.name for index in self.pc.list_indexes()]:
+            if self.index_name in (self.index_metadata.get() or []):
                 self.index = self.pc.Index(self.index_name)
-                self.vectorstore = PineconeVectorStore(
+                vectorstore = PineconeVectorStore(
                     index=self.index,
                     embedding=self.embeddings
                 )
                 logger.info(f"Connected to existing Pinecone index: {self.index_name}")
-            else:
-                logger.warning(f"Pinecone index '{self.index_name}' not found. Please run the upload script first.")
-                self.vectorstore = None
+                return vectorstore
+            logger.warning(f"Pinecone index '{self.index_name}' not found. Please run the upload script first.")
         except Exception as e:
             logger.error(f"Failed to connect to Pinecone index: {e}")
-            self.vectorstore = None
-        
-        # Conversation memory storage (in production, use proper session management)
-        self.conversation_history = []
-        
-        # Initialize LLM
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.3,
-            openai_api_key=os.getenv('OPENAI_API_KEY')
+        return None
+    
+    def setup_retriever(self):
+        """Patient-scoped hybrid (dense + BM25) retrieval over the vector store"""
+        if not self.vectorstore:
+            return None
+        keyword_index = None
+        if os.getenv('RETRIEVAL_HYBRID', 'true').lower() == 'true':
+            keyword_index = KeywordIndex(os.getenv('KEYWORD_INDEX_PATH') or DEFAULT_KEYWORD_INDEX_PATH)
+            if not len(keyword_index):
+                logger.warning("Keyword index is empty; re-run the upload script to enable hybrid retrieval")
+        return HybridRetriever(
+            self.vectorstore,
+            self.patient_directory,
+            keyword_index,
+            k_min=int(os.getenv('RETRIEVAL_K_MIN', '2')),
+            k_max=int(os.getenv('RETRIEVAL_K_MAX', '8')),
+            token_budget=int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '1500')),
+            patient_token_budget=int(os.getenv('RETRIEVAL_PATIENT_TOKEN_BUDGET', '800')),
+            min_relative_score=float(os.getenv('RETRIEVAL_MIN_RELATIVE_SCORE', '0.5')),
+            embed=self.embed_query
         )
-        
-        # Initialize RAG tool
-        self.setup_rag_tool()
-        
-        # Initialize agent with RAG tool
-        self.setup_agent()
+    
+    def retrieve_documents(self, query, patient_ids=None):
+        """Fetch the records most relevant to a query, optionally only from the given patients"""
+        return self.retriever.retrieve(query, patient_ids)
     
     def setup_rag_tool(self):
         """Setup RAG tool for medical knowledge retrieval"""
@@ -83,11 +354,14 @@ class MedicalAssistant:
             self.rag_tool = None
             return
         
+        from langchain.tools import Tool
+        
         def search_medical_records(query):
             """Search medical records using RAG"""
             try:
-                docs = self.vectorstore.similarity_search(query, k=3)
-                return "\n\n".join([doc.page_content for doc in docs])
+                docs = self.retrieve_documents(query)
+                context, _ = self.context_assembler.assemble(docs, query)
+                return context
             except Exception as e:
                 logger.error(f"Error searching medical records: {e}")
                 return "Error searching medical records"
@@ -99,19 +373,25 @@ class MedicalAssistant:
         )
     
     def setup_agent(self):
-        """Setup the agent with RAG tool"""
-        if not self.rag_tool:
-            self.agent = None
-            return
+        """Build the answer engine: direct retrieve-then-generate, or the ReAct agent with RAG tool"""
+        from langchain.prompts import PromptTemplate
+        
+        self.agent = None
+        self.setup_rag_tool()
+        if not self.rag_tool or not self.retriever:
+            return None
         
-        # Custom prompt for medical assistant
+        # Custom prompt for medical assistant, with the retrieved records inlined
         medical_prompt = PromptTemplate(
-            input_variables=["input", "agent_scratchpad"],
+            input_variables=["conversation_history", "context", "input"],
             template="""You are a professional medical assistant. Provide direct, accurate medical information without conversational filler words or phrases.
 
 Previous Conversation Context:
 {conversation_history}
 
+Medical Records:
+{context}
+
 Current Question: {input}
 
 Instructions:
@@ -122,115 +402,317 @@ Instructions:
 - Reference previous conversation context when relevant but don't explicitly state it
 - If information is unavailable, state this directly
 - Answer only what is asked
-- Use the medical_records_search tool to find relevant patient information
-- Important - Do not hallucinate or make up information. Only use the information provided by the medical_records_search tool. Only Answer the question asked do not answer something which was not asked.
-
-{agent_scratchpad}"""
+- Important - Do not hallucinate or make up information. Only use the information in the medical records above. Only Answer the question asked do not answer something which was not asked."""
         )
         
-        # Initialize agent
+        if self.answer_mode != 'agent':
+            return DirectRAGEngine(
+                self.llm,
+                self.retrieve_documents,
+                medical_prompt,
+                self.context_assembler,
+                max_prompt_tokens=self.prompt_token_budget
+            )
+        
+        from langchain.agents import initialize_agent, AgentType
+        
+        # Initialize agent, with the medical instructions ahead of the tool descriptions
         self.agent = initialize_agent(
             tools=[self.rag_tool],
             llm=self.llm,
             agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-            verbose=True,
-            handle_parsing_errors=True
+            # The ReAct trace goes to stdout; keep it for local debugging only
+            verbose=os.getenv('AGENT_VERBOSE', 'false').lower() == 'true',
+            handle_parsing_errors=True,
+            # Each iteration appends a tool result to the scratchpad, so cap them to bound the prompt
+            max_iterations=int(os.getenv('AGENT_MAX_ITERATIONS', '3')),
+            early_stopping_method="generate",
+            agent_kwargs={"prefix": AGENT_PREFIX}
         )
+        return AgentEngine(self.agent, model=self.llm.model_name)
+    
+    def presynthesize_facts(self):
+        """Synthesize fact answers into the TTS cache at startup, so fast-path answers skip TTS as well"""
+        if not self.fast_path or self.presynthesize_max <= 0:
+            return 0
+        # With a shared cache one worker synthesizes for all of them, once per facts file
+        if self.state.shared and self.tts_cache.shared is not None:
+            try:
+                facts_version = int(os.path.getmtime(self.patient_facts.path))
+            except OSError:
+                facts_version = 0
+            if self.state.incr(f"presynthesized:{facts_version}", ttl=24 * 3600) not in (1, None):
+                logger.info("Fact answers already pre-synthesized by another worker")
+                return 0
+        texts = self.patient_facts.answers(PRESYNTHESIZED_INTENTS)[:self.presynthesize_max]
+        synthesized = sum(self.text_to_speech(text) is not None for text in texts)
+        logger.info(f"Pre-synthesized {synthesized} of {len(texts)} fact answers")
+        return synthesized
     
     def transcribe_audio(self, audio_file):
-        """Convert audio to text using OpenAI Whisper"""
+        """Convert audio to text with the configured STT backends, without touching the disk"""
         try:
-            # Save uploaded file temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-                audio_file.save(temp_file.name)
-                
-            # Transcribe using OpenAI Whisper
-            with open(temp_file.name, "rb") as audio:
-                transcript = self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio
-                )
-            
-            # Clean up temp file
-            os.unlink(temp_file.name)
+            # Read at most one byte past the limit so oversized uploads are never fully buffered
+            with span("upload_read"):
+                data = audio_file.read(self.max_upload_bytes + 1)
+            if len(data) > self.max_upload_bytes:
+                logger.warning(f"Rejecting audio upload larger than {self.max_upload_bytes} bytes")
+                return None
+            if not data:
+                logger.warning("Empty audio upload")
+                return None
             
-            return transcript.text
+            # Whisper detects the format from the file name, so keep the client's extension
+            return self.transcribe(data, audio_file.filename or "audio.webm", audio_file.mimetype or "application/octet-stream")
         except Exception as e:
             logger.error(f"Error transcribing audio: {e}")
             return None
     
-    def text_to_speech(self, text):
-        """Convert text to speech using ElevenLabs with gTTS fallback"""
-        # Try ElevenLabs first
+    def transcribe(self, data, filename, mimetype, partial=False):
+        """Transcribe audio bytes; partial transcripts of a recording in progress skip preprocessing"""
         try:
-            logger.info("Trying ElevenLabs TTS...")
-            # Use a professional, clear voice for medical context
-            voice_id = "21m00Tcm4TlvDq8ikWAM"  # Rachel - professional female voice
-            
-            # Generate speech with natural settings
-            response = self.elevenlabs_client.text_to_speech.convert(
-                voice_id=voice_id,
-                optimize_streaming_latency="0",
-                output_format="mp3_22050_32",
-                text=text,
-                voice_settings=VoiceSettings(
-                    stability=0.5,
-                    similarity_boost=0.8,
-                    style=0.2,
-                    use_speaker_boost=True,
-                ),
-            )
-            
-            # Create audio buffer
-            audio_buffer = io.BytesIO()
-            for chunk in response:
-                audio_buffer.write(chunk)
-            audio_buffer.seek(0)
-            
-            logger.info("ElevenLabs TTS successful")
-            return audio_buffer
+            if self.audio_preprocess in OUTPUT_FORMATS and not partial:
+                with span("audio_preprocess", self.audio_preprocess):
+                    processed = preprocess_audio(data, self.audio_preprocess, self.trim_silence)
+                if processed:
+                    data, filename, mimetype = processed
             
+            # Local engines yield segments as they decode; hosted ones yield the whole transcript
+            segments = []
+            with span("partial_transcription" if partial else "transcription") as labels:
+                for backend, segment in self.stt.stream(lambda backend: backend.transcribe_stream(data, filename, mimetype)):
+                    labels["backend"] = backend.name
+                    segments.append(segment)
+            return "".join(segments).strip()
         except Exception as e:
-            logger.warning(f"ElevenLabs TTS failed: {e}")
-            logger.info("Falling back to Google TTS...")
-            
-            # Fallback to Google TTS
+            logger.error(f"Error transcribing {'partial ' if partial else ''}audio: {e}")
+            return None
+    
+    def _delivered_format(self, backend, audio_format):
+        """Format a backend's audio reaches the client in: as requested when it or ffmpeg can produce it"""
+        native = backend.output_format(audio_format)
+        return audio_format if native == audio_format or ffmpeg_available() else native
+    
+    def _synthesize(self, backend, text, latency, audio_format):
+        """Audio chunks from one backend, transcoded on the fly if it cannot produce audio_format itself"""
+        native = backend.output_format(audio_format)
+        chunks = backend.stream(text, latency, native)
+        if self._delivered_format(backend, audio_format) != native:
+            chunks = transcode_stream(chunks, audio_format)
+        return chunks
+    
+    def _tts_cache_key(self, text, backend, latency="0", audio_format="mp3"):
+        """Cache key for audio synthesized by a given backend and delivered in a given format"""
+        voice, output_format, settings = backend.cache_params(latency, backend.output_format(audio_format))
+        delivered = self._delivered_format(backend, audio_format)
+        return tts_cache_key(text, voice, output_format, {**settings, "delivered_format": delivered}, backend.name)
+    
+    def _cached_speech(self, text, latency="0", audio_format="mp3"):
+        """Return (audio bytes, backend) from the cache, preferring the backends tried first"""
+        for backend in self.tts.ordered():
+            data = self.tts_cache.get(self._tts_cache_key(text, backend, latency, audio_format))
+            if data is not None:
+                return data, backend
+        return None, None
+    
+    def _speech(self, text, latency, audio_format):
+        """Yield (delivered format, chunk) from the cache or the first TTS backend that succeeds
+
+        Backends are only switched before the first chunk; the complete audio is cached.
+        """
+        started = time.perf_counter()
+        cached, backend = self._cached_speech(text, latency, audio_format)
+        if cached is not None:
+            observe("tts_total", time.perf_counter() - started, "cache")
+            yield self._delivered_format(backend, audio_format), cached
+            return
+        
+        chunks = []
+        with span("tts_total") as labels:
+            started = time.perf_counter()
+            for backend, chunk in self.tts.stream(lambda backend: self._synthesize(backend, text, latency, audio_format)):
+                if not chunks:
+                    observe("tts_first_byte", time.perf_counter() - started, backend.name)
+                    labels["backend"] = backend.name
+                    delivered = self._delivered_format(backend, audio_format)
+                chunks.append(chunk)
+                yield delivered, chunk
+        audio = b"".join(chunks)
+        # Streamed WAV headers carry placeholder sizes; fix them for the cached copy
+        self.tts_cache.put(self._tts_cache_key(text, backend, latency, audio_format),
+                           finalize_wav(audio) if delivered == "wav" else audio)
+        logger.info(f"TTS successful ({backend.name}, {delivered})")
+    
+    def text_to_speech(self, text, audio_format=None):
+        """Convert text to speech with the first TTS backend that succeeds"""
+        try:
+            chunks = []
+            delivered = None
+            for delivered, chunk in self._speech(text, "0", audio_format or self.audio_format):
+                chunks.append(chunk)
+            audio = b"".join(chunks)
+            return AudioBuffer(finalize_wav(audio) if delivered == "wav" else audio, AUDIO_FORMATS[delivered])
+        except Exception as e:
+            logger.error(f"Text-to-speech failed: {e}")
+            return None
+    
+    def open_speech_stream(self, text, audio_format=None):
+        """Start synthesizing text and return (mimetype, chunk iterator) once the first chunk is ready
+
+        Returns None if no backend produced any audio. Later chunks are passed
+        through as they arrive, so nothing is buffered for the response.
+        """
+        speech = self._speech(text, "0", audio_format or self.audio_format)
+        try:
+            delivered, first = next(speech)
+        except Exception as e:
+            logger.error(f"Text-to-speech failed: {e}")
+            return None
+        
+        def chunks():
+            yield first
             try:
-                tts = gTTS(text=text, lang='en', slow=False)
-                audio_buffer = io.BytesIO()
-                tts.write_to_fp(audio_buffer)
-                audio_buffer.seek(0)
-                
-                logger.info("Google TTS successful")
-                return audio_buffer
-                
-            except Exception as gtt_error:
-                logger.error(f"Both ElevenLabs and Google TTS failed: {gtt_error}")
-                return None
+                for _, chunk in speech:
+                    yield chunk
+            except Exception as e:
+                logger.error(f"TTS stream failed mid-response: {e}")
+        return AUDIO_FORMATS[delivered], chunks()
+    
+    def text_to_speech_stream(self, text, audio_format=None):
+        """Yield audio chunks for text as they arrive, falling back to the next backend before the first chunk"""
+        # Favour time-to-first-byte over quality for streamed sentences
+        streamed = False
+        try:
+            for _, chunk in self._speech(text, "3", audio_format or self.audio_format):
+                streamed = True
+                yield chunk
+        except Exception as e:
+            if streamed:
+                logger.error(f"TTS stream failed mid-sentence: {e}")
+            else:
+                logger.error(f"Text-to-speech failed: {e}")
+    
+    def format_history(self, session_id):
+        """Format a session's recent exchanges within the history token budget"""
+        return self.sessions.format_history(session_id, max_tokens=self.history_token_budget)
     
-    def get_medical_response(self, question):
-        """Get response from the medical knowledge base using agent with RAG tool"""
-        if not self.agent:
+    def cacheable(self, scope, session_id):
+        """Only self-contained questions are cached: they name a patient or start a conversation"""
+        return bool(scope) or not self.sessions.get_turns(session_id)
+    
+    def session_patient(self, session_id):
+        """Patient the conversation was last about, if its latest question naming a patient named only one"""
+        for turn in reversed(self.sessions.get_turns(session_id)):
+            patient_ids = self.patient_directory.find(turn["question"])
+            if patient_ids:
+                return patient_ids if len(patient_ids) == 1 else None
+        return None
+    
+    def fact_answer(self, question, session_id=None, usage=None, patient_ids=None):
+        """Pre-rendered answer for a lookup of one field of one patient's record, or None
+        
+        The patient is the one the question names (or patient_ids), or for "her",
+        "his" and the like, the one the conversation was last about.
+        """
+        if not self.fast_path:
+            return None
+        with span("fact_lookup"):
+            if patient_ids is None:
+                patient_ids = self.patient_directory.find(question)
+                if not patient_ids and refers_to_patient(question):
+                    patient_ids = self.session_patient(session_id)
+            answer = self.patient_facts.answer(question, patient_ids)
+        if answer is not None:
+            logger.info("Answered from patient facts")
+            if usage is not None:
+                usage.update(fast_path=True, prompt_tokens=0, completion_tokens=0)
+            self.sessions.add_turn(session_id, question, answer)
+        return answer
+    
+    def stream_medical_response(self, question, session_id=None, usage=None):
+        """Yield answer tokens as the answer engine produces them; token counts are added to usage"""
+        answer = self.fact_answer(question, session_id, usage)
+        if answer is not None:
+            yield answer
+            return
+        
+        if not self.answer_engine:
+            yield "The medical knowledge base is not available. Please ensure the Pinecone index has been set up and contains patient data."
+            return
+        
+        scope = self.answer_cache.scope(question)
+        use_cache = self.cacheable(scope, session_id)
+        vector = None
+        if use_cache:
+            cached, vector = self.answer_cache.lookup(question, scope)
+            if cached is not None:
+                if usage is not None:
+                    usage.update(cached=True, prompt_tokens=0, completion_tokens=0)
+                self.sessions.add_turn(session_id, question, cached)
+                yield cached
+                return
+        
+        answer_parts = []
+        sources = []
+        try:
+            for token in self.answer_engine.stream(question, self.format_history(session_id), sources, usage):
+                answer_parts.append(token)
+                yield token
+        except Exception as e:
+            logger.error(f"Error streaming medical response: {e}")
+            if not answer_parts:
+                yield "I encountered an error while searching the medical records."
+            return
+        
+        answer = "".join(answer_parts)
+        if usage is not None:
+            logger.info(f"Token usage: {usage}")
+        if use_cache:
+            self.answer_cache.store(question, answer, sources, vector, scope)
+        self.sessions.add_turn(session_id, question, answer)
+    
+    def get_medical_response(self, question, session_id=None, usage=None, patient_ids=None, docs=None):
+        """Get response from the medical knowledge base using the configured answer engine
+
+        Lookups of a single field ("current medications?") are answered from the
+        patient facts without the LLM. Prompt/completion token counts for the
+        request are added to usage, if given. patient_ids scopes the cached
+        answer to those patients instead of the ones the question names, and
+        docs (records already retrieved for them) skip retrieval in direct mode.
+        """
+        # Field lookups need neither the answer engine nor the vector store
+        answer = self.fact_answer(question, session_id, usage, patient_ids)
+        if answer is not None:
+            return answer
+        
+        if not self.answer_engine:
             return "The medical knowledge base is not available. Please ensure the Pinecone index has been set up and contains patient data."
         
         try:
-            # Format conversation history for context
-            history_text = ""
-            if self.conversation_history:
-                history_text = "\n".join([
-                    f"Q: {item['question']}\nA: {item['answer']}" 
-                    for item in self.conversation_history[-3:]  # Keep last 3 exchanges
-                ])
+            # Repeated questions are answered from the cache without retrieval or an LLM call
+            scope = frozenset(patient_ids) if patient_ids else self.answer_cache.scope(question)
+            use_cache = self.cacheable(scope, session_id)
+            vector = None
+            if use_cache:
+                cached, vector = self.answer_cache.lookup(question, scope)
+                if cached is not None:
+                    logger.info("Answer cache hit")
+                    if usage is not None:
+                        usage.update(cached=True, prompt_tokens=0, completion_tokens=0)
+                    self.sessions.add_turn(session_id, question, cached)
+                    return cached
+            
+            # Get response with recent conversation history as context
+            sources = []
+            answer = self.answer_engine.answer(question, self.format_history(session_id), sources, usage, docs)
+            if usage is not None:
+                logger.info(f"Token usage: {usage}")
             
-            # Get response from agent
-            response = self.agent.run(question)
-            answer = response if isinstance(response, str) else str(response)
+            if use_cache:
+                self.answer_cache.store(question, answer, sources, vector, scope)
             
             # Add to conversation history
-            self.conversation_history.append({
-                "question": question,
-                "answer": answer
-            })
+            self.sessions.add_turn(session_id, question, answer)
             
             return answer
             
@@ -238,7 +720,104 @@ Instructions:
             logger.error(f"Error getting medical response: {e}")
             return "I encountered an error while searching the medical records."
     
-    def process_audio_query(self, audio_file):
+    def answer_batch(self, items, synthesize=False, audio_format=None):
+        """Answer (patient_id, question) pairs, yielding result events as each completes
+
+        Each patient's records are retrieved once, for all of their questions
+        together, and the answers are generated with at most
+        batch_max_concurrency calls in flight. Events are {"type": "answer"} or
+        {"type": "error"} per item (with its index in items) and, with synthesize,
+        one {"type": "audio"} per patient reading all of their answers in order.
+        """
+        by_patient = {}
+        for index, (patient_id, question) in enumerate(items):
+            by_patient.setdefault(patient_id, []).append((index, question))
+        
+        events = queue.Queue()
+        done = object()
+        cancelled = threading.Event()
+        lock = threading.Lock()
+        outstanding = [0]
+        executor = ThreadPoolExecutor(max_workers=self.batch_max_concurrency, thread_name_prefix="batch")
+        
+        def submit(fn, *args):
+            with lock:
+                outstanding[0] += 1
+            executor.submit(run, fn, *args)
+        
+        def run(fn, *args):
+            try:
+                if not cancelled.is_set():
+                    fn(*args)
+            except Exception as e:
+                logger.error(f"Batch task failed: {e}")
+            finally:
+                with lock:
+                    outstanding[0] -= 1
+                    finished = outstanding[0] == 0
+                if finished:
+                    events.put(done)
+        
+        def fail(patient_id, questions, error):
+            for index, question in questions:
+                events.put({"type": "error", "index": index, "patient_id": patient_id, "question": question, "error": error})
+        
+        def retrieve(patient_id, questions):
+            if patient_id not in self.patient_directory:
+                fail(patient_id, questions, "Unknown patient")
+                return
+            name = self.patient_directory.name(patient_id)
+            docs = None
+            if self.answer_mode == 'direct' and self.retriever:
+                try:
+                    docs = self.retrieve_documents(" ".join(question for _, question in questions), {patient_id})
+                except Exception as e:
+                    logger.error(f"Error retrieving records for {patient_id}: {e}")
+                    fail(patient_id, questions, "Failed to search the medical records")
+                    return
+            answers = {}
+            for index, question in questions:
+                submit(answer, patient_id, name, index, question, docs, answers, len(questions))
+        
+        def answer(patient_id, name, index, question, docs, answers, expected):
+            started = time.perf_counter()
+            usage = {}
+            # Questions usually omit the name ("Current medications?"); the prompt needs it
+            prompt = question if not name or name.lower() in question.lower() else f"{name}: {question}"
+            text = self.get_medical_response(prompt, usage=usage, patient_ids={patient_id}, docs=docs)
+            events.put({
+                "type": "answer", "index": index, "patient_id": patient_id, "question": question,
+                "answer": text, "usage": usage, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+            with lock:
+                answers[index] = text
+                complete = len(answers) == expected
+            if complete and synthesize:
+                submit(speak, patient_id, [answers[i] for i in sorted(answers)])
+        
+        def speak(patient_id, answers):
+            audio = self.text_to_speech("\n\n".join(answers), audio_format)
+            if audio is None:
+                events.put({"type": "error", "patient_id": patient_id, "error": "Failed to generate audio"})
+            else:
+                events.put({"type": "audio", "patient_id": patient_id, "audio": audio})
+        
+        try:
+            if not by_patient:
+                return
+            for patient_id, questions in by_patient.items():
+                submit(retrieve, patient_id, questions)
+            while True:
+                event = events.get()
+                if event is done:
+                    return
+                yield event
+        finally:
+            # Stop queued work if the client went away mid-batch
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def process_audio_query(self, audio_file, session_id=None, usage=None, audio_format=None):
         """Process audio query and return both text and audio response"""
         # Step 1: Transcribe audio to text
         transcribed_text = self.transcribe_audio(audio_file)
@@ -248,25 +827,110 @@ Instructions:
         logger.info(f"Transcribed text: {transcribed_text}")
         
         # Step 2: Get response from medical knowledge base
-        medical_response = self.get_medical_response(transcribed_text)
+        medical_response = self.get_medical_response(transcribed_text, session_id, usage)
         logger.info(f"Medical response: {medical_response}")
         
         # Step 3: Convert response to speech
-        audio_response = self.text_to_speech(medical_response)
+        audio_response = self.text_to_speech(medical_response, audio_format)
         if not audio_response:
             return transcribed_text, medical_response, "Failed to generate audio response"
         
         return transcribed_text, medical_response, audio_response
     
+    def open_live_query(self, mimetype):
+        """Start a voice query whose audio arrives in frames while the clinician is still speaking
+        
+        Records are only retrieved speculatively in direct mode, where the
+        answer engine can use them; the agent runs its own searches.
+        """
+        return self.live_queries.open(
+            mimetype,
+            self.transcribe,
+            self.patient_directory.find,
+            retrieve=self.retrieve_documents if self.answer_mode == 'direct' else None,
+            vad=VoiceActivityDetector(threshold_db=self.vad_threshold_db, end_silence_ms=self.vad_end_silence_ms),
+            partial_interval=self.live_partial_interval,
+            max_bytes=self.max_upload_bytes
+        )
+    
+    def get_live_query(self, live_id):
+        return self.live_queries.get(live_id)
+    
+    def process_live_query(self, live, session_id=None, usage=None, audio_format=None):
+        """Finish a live query and answer it like process_audio_query
+        
+        Records retrieved speculatively for the patients the final transcript
+        names are used instead of retrieving them again.
+        """
+        try:
+            transcribed_text, patient_ids, docs = live.finish()
+        finally:
+            self.live_queries.close(live)
+        if not transcribed_text:
+            return None, None, "Failed to transcribe audio"
+        
+        logger.info(f"Transcribed text: {transcribed_text} (partial reused: {live.reused_partial}, "
+                    f"speculative records used: {live.speculation_hit})")
+        
+        medical_response = self.get_medical_response(
+            transcribed_text, session_id, usage, patient_ids if docs is not None else None, docs
+        )
+        logger.info(f"Medical response: {medical_response}")
+        
+        audio_response = self.text_to_speech(medical_response, audio_format)
+        if not audio_response:
+            return transcribed_text, medical_response, "Failed to generate audio response"
+        
+        return transcribed_text, medical_response, audio_response
+    
+    def process_audio_query_stream(self, transcribed_text, session_id=None, usage=None, audio_format=None):
+        """Stream sentence and audio events for an already transcribed question"""
+        sentences = iter_sentences(self.stream_medical_response(transcribed_text, session_id, usage))
+        return stream_speech(sentences, lambda sentence: self.text_to_speech_stream(sentence, audio_format))
+    
     def test_tts(self, text):
         """Test text-to-speech functionality"""
         return self.text_to_speech(text)
     
+    def readiness(self):
+        """Whether the assistant can answer voice queries, and the state of each subsystem
+
+        Never waits for or starts initialization, so it is safe to call from health probes.
+        """
+        stt = self.startup.peek("stt")
+        tts = self.startup.peek("tts")
+        ready = (
+            self.startup.peek("answer_engine") is not None
+            and stt is not None and bool(stt.backends)
+            and tts is not None and bool(tts.backends)
+        )
+        return ready, self.startup.status()
+    
     def get_health_status(self):
-        """Get health status of the assistant"""
+        """Get health status of the assistant from cached state, without network calls"""
+        vectorstore = self.startup.peek("vectorstore")
+        stt = self.startup.peek("stt")
+        tts = self.startup.peek("tts")
+        embeddings = self.startup.peek("embeddings")
+        http = self.startup.peek("http")
         return {
-            "pinecone_connected": self.vectorstore is not None,
+            "vector_store": self.vector_store_backend,
+            "pinecone_connected": self.pc is not None and vectorstore is not None,
+            "vector_store_ready": vectorstore is not None,
             "rag_tool_ready": self.rag_tool is not None,
-            "agent_ready": self.agent is not None,
-            "available_indexes": [index.name for index in self.pc.list_indexes()] if self.pc else []
-        } 
\ No newline at end of file
+            "answer_mode": self.answer_mode,
+            "agent_ready": self.startup.peek("answer_engine") is not None,
+            "startup": self.startup.status(),
+            "stt": stt.stats() if stt is not None else None,
+            "tts": tts.stats() if tts is not None else None,
+            "tts_cache": self.tts_cache.stats(),
+            "sessions": self.sessions.stats(),
+            "embedding_cache": embeddings.stats() if embeddings is not None else None,
+            "answer_cache": self.answer_cache.stats(),
+            "patient_facts": self.patient_facts.stats(),
+            "live_queries": self.live_queries.stats(),
+            "state": self.state.stats(),
+            "http": {**http.stats(), "warmup": self.startup.peek("http_warmup")} if http is not None else None,
+            "available_indexes": (self.index_metadata.peek() or []) if self.index_metadata else [],
+            "index_metadata": self.index_metadata.stats() if self.index_metadata else None
+        }
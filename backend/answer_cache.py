@@ -0,0 +1,174 @@
+import hashlib
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from patients import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Caches answers by normalized question, with semantic near-duplicate lookup
+
+    Entries are scoped to the patients a question names (or that the caller
+    scoped it to explicitly); even an exact match must have the same scope,
+    and a semantic match must name the same patients. An entry is dropped as
+    soon as the record version of any patient it drew on changes (i.e. after
+    re-ingestion).
+
+    With a shared StateBackend, exact-match entries are also kept there so
+    other workers can reuse them; semantic lookups only search this process.
+    """
+
+    def __init__(self, directory, embed=None, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.95, shared=None):
+        self.directory = directory
+        self.embed = embed
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # max_entries=0 turns the cache off, the shared tier included
+        self.shared = shared if max_entries > 0 else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"exact_hits": 0, "shared_hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def scope(self, question):
+        """Patient IDs named in a question"""
+        return frozenset(self.directory.find(question))
+
+    def _embed(self, question):
+        if not self.embed:
+            return None
+        try:
+            vector = np.asarray(self.embed(question), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm else None
+        except Exception as e:
+            logger.warning(f"Answer cache could not embed question: {e}")
+            return None
+
+    def _valid(self, key, entry, now):
+        """Drop the entry if it expired or its patients' records changed (caller holds the lock)"""
+        if entry["expires_at"] <= now:
+            del self._entries[key]
+            self._stats["evictions"] += 1
+            return False
+        if self.directory.versions(entry["patients"]) != entry["versions"]:
+            del self._entries[key]
+            self._stats["invalidations"] += 1
+            return False
+        return True
+
+    @staticmethod
+    def _shared_key(key):
+        question, scope = key
+        return "answer:" + hashlib.sha256(json.dumps([question, sorted(scope)]).encode("utf-8")).hexdigest()
+
+    def _lookup_shared(self, key, now):
+        """An answer another worker cached for this exact question, if its records are unchanged"""
+        data = self.shared.get(self._shared_key(key))
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            return None
+        patients = frozenset(entry["patients"])
+        if self.directory.versions(patients) != entry["versions"]:
+            return None
+        with self._lock:
+            self._entries[key] = {
+                "answer": entry["answer"],
+                "vector": None,
+                "scope": key[1],
+                "patients": patients,
+                "versions": entry["versions"],
+                "expires_at": now + self.ttl_seconds,
+            }
+            self._evict_overflow()
+            self._stats["shared_hits"] += 1
+        return entry["answer"]
+
+    def _evict_overflow(self):
+        """Drop least recently used entries beyond max_entries (caller holds the lock)"""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def lookup(self, question, scope=None):
+        """Return (answer, vector) on a hit, or (None, vector) where vector can be passed to store()"""
+        scope = self.scope(question) if scope is None else scope
+        key = (normalize_text(question), scope)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._valid(key, entry, now):
+                self._entries.move_to_end(key)
+                self._stats["exact_hits"] += 1
+                return entry["answer"], entry["vector"]
+
+        if self.shared is not None:
+            answer = self._lookup_shared(key, now)
+            if answer is not None:
+                return answer, None
+
+        vector = self._embed(question)
+        if vector is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None, None
+
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for candidate_key, candidate in list(self._entries.items()):
+                if candidate["scope"] != scope or candidate["vector"] is None:
+                    continue
+                if not self._valid(candidate_key, candidate, now):
+                    continue
+                score = float(candidate["vector"] @ vector)
+                if score >= best_score:
+                    best_key, best_score = candidate_key, score
+
+            if best_key is None:
+                self._stats["misses"] += 1
+                return None, vector
+
+            self._entries.move_to_end(best_key)
+            self._stats["semantic_hits"] += 1
+            logger.info(f"Answer cache semantic hit (similarity {best_score:.3f})")
+            return self._entries[best_key]["answer"], vector
+
+    def store(self, question, answer, source_patients=(), vector=None, scope=None):
+        """Cache an answer along with the versions of the patient records it was based on"""
+        scope = self.scope(question) if scope is None else scope
+        key = (normalize_text(question), scope)
+        patients = frozenset(scope) | frozenset(source_patients)
+        if vector is None:
+            vector = self._embed(question)
+
+        versions = self.directory.versions(patients)
+        with self._lock:
+            self._entries[key] = {
+                "answer": answer,
+                "vector": vector,
+                "scope": scope,
+                "patients": patients,
+                "versions": versions,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._entries.move_to_end(key)
+            self._evict_overflow()
+        if self.shared is not None:
+            entry = {"answer": answer, "patients": sorted(patients), "versions": versions}
+            self.shared.set(self._shared_key(key), json.dumps(entry).encode("utf-8"), ttl=self.ttl_seconds)
+
+    def stats(self):
+        """Hit metrics for health reporting"""
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
@@ -0,0 +1,152 @@
+import time
+import logging
+
+from metrics import observe, span
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+ANSWER_MODES = ("direct", "agent")
+
+
+def message_text(message):
+    """Text of a chat message chunk or a plain LLM string"""
+    return getattr(message, "content", message)
+
+
+def record_completion(usage, text, message=None):
+    """Fill completion token counts, preferring the provider's usage report over a local count"""
+    if usage is None:
+        return
+    reported = getattr(message, "usage_metadata", None)
+    if reported:
+        usage["prompt_tokens"] = reported.get("input_tokens", usage.get("prompt_tokens"))
+        usage["completion_tokens"] = reported.get("output_tokens")
+    else:
+        usage["completion_tokens"] = count_tokens(text)
+
+
+class DirectRAGEngine:
+    """Retrieve once, then answer with a single LLM call
+
+    Every question costs exactly one LLM round trip, and the answer can be
+    streamed token by token. The retrieved records are fitted into whatever
+    part of max_prompt_tokens the template, history and question leave over.
+    """
+
+    mode = "direct"
+
+    def __init__(self, llm, retrieve, prompt, assembler, max_prompt_tokens=3000, min_context_tokens=300):
+        self.llm = llm
+        self.retrieve = retrieve
+        self.prompt = prompt
+        self.assembler = assembler
+        self.max_prompt_tokens = max_prompt_tokens
+        self.min_context_tokens = min_context_tokens
+
+    def build_prompt(self, question, history="", sources=None, usage=None, docs=None):
+        """Retrieve records for the question unless docs are given; their patient IDs are appended to sources"""
+        if docs is None:
+            docs = self.retrieve(question)
+        if sources is not None:
+            sources.extend(doc.metadata["patient_id"] for doc in docs if doc.metadata.get("patient_id"))
+
+        fixed_tokens = count_tokens(self.prompt.format(conversation_history=history, context="", input=question))
+        context_budget = max(self.min_context_tokens, self.max_prompt_tokens - fixed_tokens)
+        context, stats = self.assembler.assemble(docs, question, context_budget)
+
+        prompt = self.prompt.format(conversation_history=history, context=context, input=question)
+        if usage is not None:
+            usage.update(
+                prompt_tokens=count_tokens(prompt),
+                context_tokens=stats["tokens"],
+                history_tokens=count_tokens(history),
+                chunks=stats["chunks"],
+                records_trimmed=stats["trimmed"]
+            )
+        return prompt
+
+    @property
+    def model(self):
+        return getattr(self.llm, "model_name", "") or ""
+
+    def answer(self, question, history="", sources=None, usage=None, docs=None):
+        prompt = self.build_prompt(question, history, sources, usage, docs)
+        with span("llm", self.model):
+            message = self.llm.invoke(prompt)
+        text = message_text(message)
+        record_completion(usage, text, message)
+        return text
+
+    def stream(self, question, history="", sources=None, usage=None):
+        prompt = self.build_prompt(question, history, sources, usage)
+        parts = []
+        last = None
+        with span("llm", self.model):
+            started = time.perf_counter()
+            for chunk in self.llm.stream(prompt):
+                if not parts:
+                    observe("llm_first_token", time.perf_counter() - started, self.model)
+                parts.append(message_text(chunk))
+                if getattr(chunk, "usage_metadata", None):
+                    last = chunk
+                yield parts[-1]
+        record_completion(usage, "".join(parts), last)
+
+
+def agent_callback(usage=None, model=""):
+    """LangChain callback that times every LLM call an agent makes and adds up its token usage"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class AgentHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.started = {}
+
+        def on_llm_start(self, serialized, prompts, run_id=None, **kwargs):
+            self.started[run_id] = time.perf_counter()
+
+        def on_chat_model_start(self, serialized, messages, run_id=None, **kwargs):
+            self.started[run_id] = time.perf_counter()
+
+        def on_llm_error(self, error, run_id=None, **kwargs):
+            self.started.pop(run_id, None)
+
+        def on_llm_end(self, response, run_id=None, **kwargs):
+            started = self.started.pop(run_id, None)
+            if started is not None:
+                observe("llm", time.perf_counter() - started, model)
+            if usage is None:
+                return
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            usage["llm_calls"] = usage.get("llm_calls", 0) + 1
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + token_usage.get("prompt_tokens", 0)
+            usage["completion_tokens"] = usage.get("completion_tokens", 0) + token_usage.get("completion_tokens", 0)
+
+    return AgentHandler()
+
+
+class AgentEngine:
+    """ReAct agent that decides when to call the records search tool
+
+    Costs at least two LLM round trips per question and cannot stream.
+    """
+
+    mode = "agent"
+
+    def __init__(self, agent, model=""):
+        self.agent = agent
+        self.model = model
+
+    def answer(self, question, history="", sources=None, usage=None, docs=None):
+        # The agent searches the records itself, so pre-retrieved docs are not used
+        agent_input = question
+        if history:
+            agent_input = f"Previous Conversation Context:\n{history}\n\nCurrent Question: {question}"
+        response = self.agent.run(agent_input, callbacks=[agent_callback(usage, self.model)])
+        if usage is not None:
+            usage["history_tokens"] = count_tokens(history)
+        return response if isinstance(response, str) else str(response)
+
+    def stream(self, question, history="", sources=None, usage=None):
+        # The ReAct loop only produces its final answer at the end
+        yield self.answer(question, history, sources, usage)
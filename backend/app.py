@@ -1,7 +1,21 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, url_for, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+import base64
+import functools
+import io
+import json
+import os
+import time
+import uuid
 import logging
 from agent import MedicalAssistant
+from audio_store import AudioStore
+from admission import AdmissionController, Overloaded
+from speech import AUDIO_EXTENSIONS, AUDIO_FORMATS
+from metrics import METRICS, observe, track_request
+from live_query import LiveQueryRejected
+from shared_state import RateLimiter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -10,8 +24,114 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Initialize the medical assistant
+# Reject oversized uploads before they are buffered; the multipart envelope gets a little headroom
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+
+# Initialize the medical assistant; construction is cheap and its clients, models and
+# indexes are built on background threads so the server can answer probes right away.
+# In pre-fork mode this module is imported by the gunicorn master: indexes are loaded
+# here, once, and each worker starts the rest after the fork (see gunicorn.conf.py)
 medical_assistant = MedicalAssistant()
+if os.getenv('PREFORK', 'false').lower() == 'true':
+    medical_assistant.preload()
+elif os.getenv('EAGER_STARTUP', 'true').lower() == 'true':
+    medical_assistant.start()
+
+shared_state = medical_assistant.state if medical_assistant.state.shared else None
+
+# Short-lived store for synthesized answers so /api/ask can hand back audio without a second TTS call
+audio_store = AudioStore(ttl_seconds=int(os.getenv('AUDIO_STORE_TTL_SECONDS', '300')), shared=shared_state)
+
+# Per-client request limit, counted across workers when the state backend is shared
+rate_limiter = RateLimiter(
+    medical_assistant.state,
+    limit=int(os.getenv('RATE_LIMIT_PER_MINUTE', '0')),
+    window_seconds=60
+)
+
+# Backpressure for the expensive endpoints: bounded concurrency plus a bounded wait queue
+admission = AdmissionController(
+    max_concurrent=int(os.getenv('MAX_CONCURRENT_REQUESTS', '8')),
+    max_queue=int(os.getenv('MAX_QUEUED_REQUESTS', '16')),
+    queue_timeout=float(os.getenv('QUEUE_TIMEOUT_SECONDS', '10'))
+)
+
+def limited(view):
+    """Run a view once the client is within its rate limit and the admission controller grants a slot"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        retry_after = rate_limiter.check(request.remote_addr or "unknown")
+        if retry_after:
+            logger.warning(f"Rate limiting {request.remote_addr} on {request.path}")
+            response = jsonify({"error": "Rate limit exceeded, please retry later"})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        
+        started = time.perf_counter()
+        try:
+            admission.acquire()
+        except Overloaded as e:
+            logger.warning(f"Rejecting {request.path}: {e}")
+            response = jsonify({"error": str(e)})
+            response.status_code = e.status_code
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        observe("queue_wait", time.perf_counter() - started)
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            admission.release()
+            raise
+        
+        # Streamed bodies keep working after the view returns, so hold the slot until they close
+        if response.is_streamed:
+            response.call_on_close(admission.release)
+        else:
+            admission.release()
+        return response
+    return wrapper
+
+@app.before_request
+def reject_oversized_upload():
+    """Fail fast on a declared Content-Length, before taking an admission slot"""
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        raise RequestEntityTooLarge()
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({"error": f"Audio upload exceeds {MAX_UPLOAD_BYTES} bytes"}), 413
+
+# Audio types a client may list in Accept, and the synthesized format each one selects
+ACCEPTED_AUDIO_TYPES = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+}
+
+def negotiate_audio_format(requested=None):
+    """Synthesized audio format from an explicit audio_format value or the Accept header
+
+    None (no preference, or only wildcards) leaves the choice to TTS_AUDIO_FORMAT.
+    """
+    requested = (requested or request.values.get('audio_format') or '').lower()
+    if requested in AUDIO_FORMATS:
+        return requested
+    listed = [value for value, _ in request.accept_mimetypes if value in ACCEPTED_AUDIO_TYPES]
+    if not listed:
+        return None
+    return ACCEPTED_AUDIO_TYPES[request.accept_mimetypes.best_match(listed)]
+
+def get_session_id():
+    """Client session ID from the X-Session-ID header or form field, or a new one"""
+    session_id = request.headers.get('X-Session-ID') or request.form.get('session_id')
+    return session_id[:128] if session_id else uuid.uuid4().hex
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -19,10 +139,35 @@ def health_check():
     health_status = medical_assistant.get_health_status()
     return jsonify({
         "status": "healthy",
-        **health_status
+        **health_status,
+        "admission": admission.stats(),
+        "rate_limit": rate_limiter.stats()
     })
 
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once the assistant can answer voice queries, 503 until then"""
+    ready, subsystems = medical_assistant.readiness()
+    if ready:
+        status = "ready"
+    elif any(subsystem["state"] == "pending" for subsystem in subsystems.values()):
+        status = "starting"
+    else:
+        status = "unavailable"
+    return jsonify({"status": status, "subsystems": subsystems}), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency summaries (p50/p95/p99 per backend) in Prometheus text format"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/transcribe', methods=['POST'])
+@limited
 def transcribe_audio():
     """Endpoint to transcribe audio to text"""
     try:
@@ -50,7 +195,40 @@ def transcribe_audio():
         logger.error(f"Error transcribing audio: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+def audio_result(transcribed_text, medical_response, audio_response, session_id, usage, timings, **extra):
+    """/api/ask-style JSON for an answered voice query, with the synthesized audio kept in the audio store"""
+    if not transcribed_text:
+        return jsonify({"error": "Failed to transcribe audio"}), 500
+    
+    if not medical_response:
+        return jsonify({"error": "Failed to get medical response"}), 500
+    
+    if not audio_response:
+        return jsonify({"error": "Failed to generate audio response"}), 500
+    
+    result = {
+        "transcribed_text": transcribed_text,
+        "medical_response": medical_response,
+        "session_id": session_id,
+        "usage": usage,
+        **extra
+    }
+    # Per-stage durations in milliseconds, on request (?timings=true)
+    if request.args.get('timings', 'false').lower() in ('1', 'true'):
+        result["timings"] = timings.as_dict()
+    
+    # Keep the synthesized audio so the client can fetch it without re-running TTS
+    if isinstance(audio_response, io.BytesIO):
+        audio_id = audio_store.put(audio_response, getattr(audio_response, 'mimetype', 'audio/mpeg'))
+        result["audio_id"] = audio_id
+        result["audio_url"] = url_for('get_audio', audio_id=audio_id)
+    else:
+        logger.warning(f"No audio for response: {audio_response}")
+    
+    return jsonify(result)
+
 @app.route('/api/ask', methods=['POST'])
+@limited
 def ask_medical_question():
     """Main endpoint for voice medical queries"""
     try:
@@ -65,45 +243,206 @@ def ask_medical_question():
         logger.info("Received audio file for processing")
         
         # Process the audio query using the medical assistant
-        transcribed_text, medical_response, audio_response = medical_assistant.process_audio_query(audio_file)
-        
-        if not transcribed_text:
-            return jsonify({"error": "Failed to transcribe audio"}), 500
-        
-        if not medical_response:
-            return jsonify({"error": "Failed to get medical response"}), 500
-        
-        if not audio_response:
-            return jsonify({"error": "Failed to generate audio response"}), 500
+        session_id = get_session_id()
+        usage = {}
+        audio_format = negotiate_audio_format()
+        with track_request() as timings:
+            transcribed_text, medical_response, audio_response = medical_assistant.process_audio_query(
+                audio_file, session_id, usage, audio_format
+            )
+        logger.info(f"Stage timings (ms): {timings.as_dict()}")
         
         # Return both text and audio response
-        return jsonify({
-            "transcribed_text": transcribed_text,
-            "medical_response": medical_response
-        })
+        return audio_result(transcribed_text, medical_response, audio_response, session_id, usage, timings)
         
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/api/ask/live', methods=['POST'])
+@app.route('/api/ask/live/<live_id>', methods=['POST'])
+@limited
+def ask_live(live_id=None):
+    """Voice query uploaded in frames while the clinician speaks
+    
+    Each request body is the next raw audio frame (16 kHz mono 16-bit PCM as
+    audio/pcm, or a chunk of a webm/ogg recording). The first request, without
+    an ID, opens the query. Until end of speech is detected, or the client
+    sends ?final=true, the reply is the live query's status with the latest
+    partial transcript; the request that ends it gets the /api/ask response.
+    """
+    try:
+        if live_id is None:
+            live = medical_assistant.open_live_query(request.mimetype)
+        else:
+            live = medical_assistant.get_live_query(live_id)
+            if live is None:
+                return jsonify({"error": "Live query not found or expired"}), 404
+        
+        frame = request.get_data()
+        ended = live.append(frame) if frame else False
+        if not ended and request.args.get('final', 'false').lower() not in ('1', 'true'):
+            return jsonify({**live.status(), "state": "listening"})
+        
+        logger.info(f"Live query {live.live_id} finished ({'end of speech' if ended else 'client'})")
+        session_id = get_session_id()
+        usage = {}
+        with track_request() as timings:
+            transcribed_text, medical_response, audio_response = medical_assistant.process_live_query(
+                live, session_id, usage, negotiate_audio_format()
+            )
+        logger.info(f"Stage timings (ms): {timings.as_dict()}")
+        return audio_result(transcribed_text, medical_response, audio_response, session_id, usage, timings,
+                            live_id=live.live_id, reused_partial=live.reused_partial,
+                            speculative_retrieval=live.speculation_hit)
+    
+    except LiveQueryRejected as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Error processing live query: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+# Pre-rounds batches: at most this many (patient_id, question) pairs per request
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '200'))
+
+@app.route('/api/batch', methods=['POST'])
+@limited
+def batch_questions():
+    """Answer many (patient_id, question) pairs, streaming one NDJSON line per result as it completes
+
+    Body: {"items": [{"patient_id": ..., "question": ...}, ...], "tts": false}. With
+    "tts", each patient also gets one audio file reading all of their answers.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list of {patient_id, question}"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {BATCH_MAX_ITEMS} items per batch"}), 400
+    pairs = []
+    for item in items:
+        patient_id = item.get('patient_id') if isinstance(item, dict) else None
+        question = item.get('question') if isinstance(item, dict) else None
+        if not isinstance(patient_id, str) or not isinstance(question, str) or not question.strip():
+            return jsonify({"error": "Each item needs a patient_id and a question"}), 400
+        pairs.append((patient_id, question.strip()))
+    synthesize = bool(data.get('tts'))
+    audio_format = negotiate_audio_format(data.get('audio_format'))
+    
+    logger.info(f"Received batch of {len(pairs)} questions")
+    
+    def generate():
+        started = time.perf_counter()
+        counts = {"answer": 0, "error": 0, "audio": 0}
+        for event in medical_assistant.answer_batch(pairs, synthesize, audio_format):
+            if event["type"] == "audio":
+                audio = event.pop("audio")
+                audio_id = audio_store.put(audio, getattr(audio, 'mimetype', 'audio/mpeg'))
+                event.update(audio_id=audio_id, audio_url=url_for('get_audio', audio_id=audio_id))
+            counts[event["type"]] += 1
+            yield json.dumps(event) + "\n"
+        yield json.dumps({
+            "type": "done",
+            "answered": counts["answer"],
+            "failed": counts["error"],
+            "audio_files": counts["audio"],
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def sse_event(event, data):
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+@app.route('/api/ask/stream', methods=['POST'])
+@limited
+def ask_medical_question_stream():
+    """Voice query endpoint that streams sentences and audio chunks as server-sent events"""
+    if 'audio' not in request.files:
+        return jsonify({"error": "No audio file provided"}), 400
+    
+    audio_file = request.files['audio']
+    if audio_file.filename == '':
+        return jsonify({"error": "No audio file selected"}), 400
+    
+    logger.info("Received audio file for streamed processing")
+    
+    session_id = get_session_id()
+    audio_format = negotiate_audio_format()
+    
+    # Transcription needs the whole recording, so it happens before the stream opens
+    transcribed_text = medical_assistant.transcribe_audio(audio_file)
+    if not transcribed_text:
+        return jsonify({"error": "Failed to transcribe audio"}), 500
+    
+    def generate():
+        yield sse_event("transcript", {"transcribed_text": transcribed_text, "session_id": session_id})
+        usage = {}
+        try:
+            for event in medical_assistant.process_audio_query_stream(transcribed_text, session_id, usage, audio_format):
+                if event["type"] == "audio":
+                    yield sse_event("audio", {
+                        "index": event["index"],
+                        "data": base64.b64encode(event["data"]).decode("ascii")
+                    })
+                else:
+                    yield sse_event("sentence", {"index": event["index"], "text": event["text"]})
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield sse_event("error", {"error": "Failed to stream medical response"})
+            return
+        yield sse_event("done", {"usage": usage})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """Serve audio synthesized by a previous /api/ask call, with Range and If-None-Match support"""
+    entry = audio_store.get(audio_id)
+    if not entry:
+        return jsonify({"error": "Audio not found or expired"}), 404
+    
+    data, mimetype = entry
+    extension = AUDIO_EXTENSIONS.get(mimetype, '.mp3')
+    # The ID is a hash of the bytes, so it doubles as a strong ETag
+    response = send_file(
+        io.BytesIO(data),
+        mimetype=mimetype,
+        download_name=f'{audio_id}{extension}',
+        conditional=True,
+        etag=audio_id
+    )
+    # Content-addressed, so the browser may cache it for as long as the store keeps it
+    response.headers['Cache-Control'] = f'private, max-age={audio_store.ttl_seconds}'
+    return response
 
 @app.route('/api/test-tts', methods=['POST'])
+@limited
 def test_tts():
-    """Test endpoint for text-to-speech"""
-    data = request.get_json()
+    """Test endpoint for text-to-speech; audio is streamed in chunks as it is synthesized"""
+    data = request.get_json(silent=True) or {}
     text = data.get('text', 'Hello, this is a test of the text-to-speech system.')
     
-    audio_response = medical_assistant.test_tts(text)
-    if not audio_response:
+    speech = medical_assistant.open_speech_stream(text, negotiate_audio_format(data.get('audio_format')))
+    if not speech:
         return jsonify({"error": "Failed to generate audio"}), 500
     
-    return send_file(
-        audio_response,
-        mimetype='audio/mpeg',
-        as_attachment=True,
-        download_name='test.mp3'
-    )
+    mimetype, chunks = speech
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename=test{AUDIO_EXTENSIONS.get(mimetype, '.mp3')}",
+        'Vary': 'Accept',
+        'X-Accel-Buffering': 'no'
+    })
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
+    # Development server; for production use gunicorn with gunicorn.conf.py
+    app.run(debug=True, host='0.0.0.0', port=5001, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,196 @@
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Trim leading and trailing silence (the filter only trims the start, so reverse around it)
+TRIM_SILENCE = (
+    "silenceremove=start_periods=1:start_threshold=-45dB:start_silence=0.1,"
+    "areverse,"
+    "silenceremove=start_periods=1:start_threshold=-45dB:start_silence=0.1,"
+    "areverse"
+)
+
+OUTPUT_FORMATS = {
+    # 16 kHz mono PCM: what Whisper resamples to anyway, cheap to decode
+    "wav": (["-c:a", "pcm_s16le", "-f", "wav"], "audio.wav", "audio/wav"),
+    # Low-bitrate Opus: smallest upload for speech
+    "opus": (["-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"], "audio.ogg", "audio/ogg"),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3"], "audio.mp3", "audio/mpeg"),
+}
+
+# Size fields of a streamed WAV header, unknown until the last chunk
+STREAMING_WAV_SIZE = 0xFFFFFFFF
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def wav_header(sample_rate=16000, channels=1, sample_width=2):
+    """RIFF header for raw PCM that is still being streamed"""
+    byte_rate = sample_rate * channels * sample_width
+    return (
+        b"RIFF" + struct.pack("<I", STREAMING_WAV_SIZE) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8)
+        + b"data" + struct.pack("<I", STREAMING_WAV_SIZE)
+    )
+
+
+def finalize_wav(data):
+    """Fill in the RIFF and data sizes of a WAV file that was written as a stream"""
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return data
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        if chunk_id == b"data":
+            data_size = len(data) - position - 8
+            return (
+                data[:4] + struct.pack("<I", len(data) - 8) + data[8:position + 4]
+                + struct.pack("<I", data_size) + data[position + 8:]
+            )
+        size = struct.unpack("<I", data[position + 4:position + 8])[0]
+        position += 8 + size + (size & 1)
+    return data
+
+
+def transcode_stream(chunks, output_format, timeout=30, read_size=4096):
+    """Re-encode an audio chunk stream with ffmpeg, yielding output as soon as it is encoded
+
+    The input is fed to ffmpeg from a background thread while output is read,
+    so the first encoded bytes go out before the input has finished.
+    """
+    codec_args, _, _ = OUTPUT_FORMATS[output_format]
+    command = [shutil.which("ffmpeg"), "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", "16000"]
+    process = subprocess.Popen(command + codec_args + ["pipe:1"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    failure = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+                process.stdin.flush()
+        except Exception as e:
+            failure.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name="transcode-feed", daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = process.stdout.read1(read_size)
+            if not data:
+                break
+            yield data
+        if process.wait(timeout) != 0:
+            raise RuntimeError(f"ffmpeg failed: {process.stderr.read().decode(errors='replace').strip()}")
+        feeder.join()
+        if failure:
+            raise failure[0]
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+class PCMDecoder:
+    """One ffmpeg process decoding a container stream (e.g. MediaRecorder webm) to 16-bit mono PCM as it arrives
+
+    write() queues bytes for ffmpeg and read() returns the PCM decoded since
+    the last call; neither waits for ffmpeg, which is fed and drained by two
+    background threads. Each byte is decoded once, however long the
+    recording gets.
+    """
+
+    def __init__(self, sample_rate=16000, read_size=4096):
+        # Minimal probing, so output starts after the first frames rather than after megabytes of input
+        command = [shutil.which("ffmpeg"), "-hide_banner", "-loglevel", "error", "-fflags", "nobuffer",
+                   "-probesize", "4096", "-analyzeduration", "0", "-i", "pipe:0",
+                   "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-flush_packets", "1", "pipe:1"]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.read_size = read_size
+        self._input = queue.Queue()
+        self._output = bytearray()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._feed, name="pcm-decode-feed", daemon=True).start()
+        threading.Thread(target=self._drain, name="pcm-decode-drain", daemon=True).start()
+
+    def _feed(self):
+        try:
+            while True:
+                data = self._input.get()
+                if data is None:
+                    break
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+        except OSError as e:
+            logger.warning(f"Audio decoder stopped accepting input: {e}")
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _drain(self):
+        while True:
+            data = self.process.stdout.read1(self.read_size)
+            if not data:
+                break
+            with self._lock:
+                self._output += data
+
+    def write(self, data):
+        self._input.put(bytes(data))
+
+    def read(self):
+        with self._lock:
+            data = bytes(self._output)
+            self._output.clear()
+        return data
+
+    def close(self):
+        """Stop decoding and end the ffmpeg process"""
+        self._input.put(None)
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+def preprocess_audio(data, output_format="opus", trim_silence=True, timeout=10):
+    """Downmix to 16 kHz mono, optionally trim silence and re-encode, entirely in memory via ffmpeg pipes
+
+    Returns (data, filename, mimetype), or None if ffmpeg is unavailable or fails.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        logger.warning("ffmpeg not found, skipping audio preprocessing")
+        return None
+    codec_args, filename, mimetype = OUTPUT_FORMATS[output_format]
+
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", "16000"]
+    if trim_silence:
+        command += ["-af", TRIM_SILENCE]
+    command += codec_args + ["pipe:1"]
+
+    try:
+        result = subprocess.run(command, input=data, capture_output=True, timeout=timeout, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"Audio preprocessing failed: {e.stderr.decode(errors='replace').strip()}")
+        return None
+    except subprocess.TimeoutExpired:
+        logger.warning("Audio preprocessing timed out")
+        return None
+
+    if not result.stdout:
+        return None
+    logger.info(f"Preprocessed audio {len(data)} -> {len(result.stdout)} bytes ({output_format})")
+    return result.stdout, filename, mimetype
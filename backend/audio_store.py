@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AudioStore:
+    """Short-lived, content-addressed store for synthesized audio responses
+
+    With a shared StateBackend, audio stored by one worker can be fetched from
+    any other (the client's /api/audio request may not reach the same one).
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=256, shared=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def audio_id_for(data):
+        """Derive a stable ID from the audio bytes"""
+        return hashlib.sha256(data).hexdigest()[:32]
+
+    def put(self, audio_buffer, mimetype='audio/mpeg'):
+        """Store an audio buffer (BytesIO or bytes) and return its ID"""
+        data = audio_buffer.getvalue() if hasattr(audio_buffer, 'getvalue') else bytes(audio_buffer)
+        audio_id = self.audio_id_for(data)
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_expired(now)
+            # Drop the oldest entries when the store is full
+            while len(self._entries) >= self.max_entries and audio_id not in self._entries:
+                oldest_id = min(self._entries, key=lambda key: self._entries[key][2])
+                del self._entries[oldest_id]
+            self._entries[audio_id] = (data, mimetype, now + self.ttl_seconds)
+
+        if self.shared is not None:
+            self.shared.set(f"audio:{audio_id}", mimetype.encode("ascii") + b"\n" + data, ttl=self.ttl_seconds)
+        return audio_id
+
+    def get(self, audio_id):
+        """Return (bytes, mimetype) for an ID, or None if missing or expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(audio_id)
+            if entry and entry[2] <= now:
+                del self._entries[audio_id]
+                entry = None
+            if entry:
+                return entry[0], entry[1]
+
+        if self.shared is not None:
+            stored = self.shared.get(f"audio:{audio_id}")
+            if stored is not None:
+                mimetype, _, data = stored.partition(b"\n")
+                return data, mimetype.decode("ascii")
+        return None
+
+    def _evict_expired(self, now):
+        """Remove expired entries (caller holds the lock)"""
+        expired = [key for key, entry in self._entries.items() if entry[2] <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            logger.debug(f"Evicted {len(expired)} expired audio entries")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
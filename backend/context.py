@@ -0,0 +1,116 @@
+import re
+import logging
+
+from keyword_index import tokenize
+from tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Record text is prose and "Field: value" lines; split it into those units
+SEGMENT_BOUNDARY = re.compile(r"(?<=[.;!?])\s+(?=[A-Z0-9])|\n+")
+
+
+def merge_overlapping(docs, min_overlap=20):
+    """Collapse chunks that repeat each other into one text per stretch of a record
+
+    Splitter overlap means neighbouring chunks of a record share a prefix and
+    suffix; those are joined, and chunks contained in another are dropped.
+    Returns texts in the order their first chunk was retrieved.
+    """
+    records = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        patient_id = doc.metadata.get("patient_id")
+        for record in records:
+            if record["patient_id"] != patient_id:
+                continue
+            if text in record["text"]:
+                break
+            if record["text"] in text:
+                record["text"] = text
+                break
+            overlap = _overlap(record["text"], text, min_overlap)
+            if overlap:
+                record["text"] += text[overlap:]
+                break
+            overlap = _overlap(text, record["text"], min_overlap)
+            if overlap:
+                record["text"] = text + record["text"][overlap:]
+                break
+        else:
+            records.append({"patient_id": patient_id, "text": text})
+    return [record["text"] for record in records]
+
+
+def _overlap(first, second, min_overlap):
+    """Length of the longest suffix of first that is a prefix of second, if at least min_overlap"""
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def relevant_segments(text, question, max_tokens):
+    """Keep the segments of a record that mention the question's terms, within max_tokens
+
+    The first segment (which names the patient) is always kept, and the rest
+    keep their original order.
+    """
+    segments = [segment.strip() for segment in SEGMENT_BOUNDARY.split(text) if segment.strip()]
+    if not segments:
+        return ""
+    terms = set(tokenize(question))
+    ranked = sorted(
+        range(1, len(segments)),
+        key=lambda i: -len(terms & set(tokenize(segments[i])))
+    )
+
+    keep = [0]
+    used = count_tokens(segments[0])
+    for i in ranked:
+        if not terms & set(tokenize(segments[i])):
+            break
+        tokens = count_tokens(segments[i])
+        if used + tokens > max_tokens:
+            continue
+        keep.append(i)
+        used += tokens
+    return truncate_tokens(" ".join(segments[i] for i in sorted(keep)), max_tokens)
+
+
+class ContextAssembler:
+    """Builds the records section of a prompt within a token budget
+
+    Overlapping chunks are merged first. If the records still do not fit, each
+    record is cut down to the segments relevant to the question, with the
+    budget shared evenly and any share a small record does not need passed on
+    to the larger ones.
+    """
+
+    def __init__(self, max_tokens=1500, min_overlap=20):
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+
+    def assemble(self, docs, question, max_tokens=None):
+        """Return (context text, stats) for retrieved documents, most relevant first"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        records = merge_overlapping(docs, self.min_overlap)
+        sizes = [count_tokens(record) for record in records]
+        stats = {"chunks": len(docs), "records": len(records), "trimmed": 0}
+
+        if sum(sizes) > budget:
+            # Water-filling: small records keep everything and their unused share goes to larger ones
+            allowance = {}
+            remaining = budget
+            by_size = sorted(range(len(records)), key=lambda i: sizes[i])
+            for position, i in enumerate(by_size):
+                allowance[i] = min(sizes[i], remaining // (len(records) - position))
+                remaining -= allowance[i]
+            for i, record in enumerate(records):
+                if sizes[i] > allowance[i]:
+                    records[i] = relevant_segments(record, question, allowance[i])
+                    stats["trimmed"] += 1
+        context = "\n\n".join(record for record in records if record)
+
+        stats["tokens"] = count_tokens(context)
+        return context, stats
@@ -0,0 +1,264 @@
+import hashlib
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import logging
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# File header: magic, format version, vector dimension
+HEADER = struct.Struct("<4sII")
+MAGIC = b"EMBC"
+VERSION = 1
+
+
+def text_key(text):
+    """32-byte digest identifying a piece of text"""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """Append-only on-disk embedding cache for one model
+
+    Records are fixed-size (32-byte text digest followed by float32 vector) so the
+    file can be memory-mapped as a NumPy structured array. Each batch is appended
+    with a single write, so concurrent writers never interleave partial records.
+    """
+
+    def __init__(self, directory, model):
+        self.path = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model) + ".emb")
+        self.dimension = None
+        self._rows = None
+        self._index = {}
+        self._appended = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _record_dtype(self):
+        return np.dtype([("key", "S32"), ("vector", "<f4", (self.dimension,))])
+
+    def _load(self):
+        """Memory-map existing records and index them by digest"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, dimension = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                logger.warning(f"Ignoring embedding cache with unknown format: {self.path}")
+                return
+            self.dimension = dimension
+            count = (os.path.getsize(self.path) - HEADER.size) // self._record_dtype().itemsize
+            if count:
+                self._rows = np.memmap(self.path, dtype=self._record_dtype(), mode="r", offset=HEADER.size, shape=(count,))
+                self._index = {bytes(key): row for row, key in enumerate(self._rows["key"])}
+            logger.info(f"Loaded {count} cached embeddings from {self.path}")
+        except Exception as e:
+            logger.warning(f"Failed to load embedding cache {self.path}: {e}")
+            self._rows, self._index = None, {}
+
+    def get(self, key):
+        """Return the cached vector for a digest, or None"""
+        with self._lock:
+            vector = self._appended.get(key)
+            if vector is not None:
+                return vector
+            row = self._index.get(key)
+            if row is None:
+                return None
+            return np.array(self._rows[row]["vector"])
+
+    def put_many(self, keys, vectors):
+        """Append vectors for digests that are not cached yet"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            elif vectors.shape[1] != self.dimension:
+                logger.warning(f"Embedding dimension changed ({vectors.shape[1]} != {self.dimension}), not caching")
+                return
+
+            new = list({key: vector for key, vector in zip(keys, vectors)
+                        if key not in self._index and key not in self._appended}.items())
+            if not new:
+                return
+            records = np.zeros(len(new), dtype=self._record_dtype())
+            records["key"] = [key for key, _ in new]
+            records["vector"] = np.stack([vector for _, vector in new])
+            self._appended.update(new)
+
+            try:
+                if not self._create_file():
+                    return
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, records.tobytes())
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.warning(f"Failed to persist embeddings: {e}")
+
+    def _create_file(self):
+        """Make sure the file exists with a header for this dimension (caller holds the lock)
+
+        The header is written to a temporary file that is then linked into
+        place, so a process appending records (e.g. another pre-forked worker)
+        never sees the file without its header, and only one header is written.
+        Returns False if the file was created for another dimension.
+        """
+        if not os.path.exists(self.path):
+            temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, self.dimension))
+            try:
+                os.link(temporary, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temporary)
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER.size)
+        if header != HEADER.pack(MAGIC, VERSION, self.dimension):
+            logger.warning(f"Embedding cache {self.path} was created with another format or dimension, not persisting")
+            return False
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index) + len(self._appended)
+
+
+class MicroBatcher:
+    """Groups concurrent single-item calls into one batched call
+
+    The first request waits up to max_wait seconds for others to join, then one
+    call to batch_fn(items) serves the whole batch. The worker thread starts on
+    first use, and again in a process forked from the one that started it.
+    """
+
+    def __init__(self, batch_fn, max_batch=64, max_wait=0.01):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True).start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def submit(self, item):
+        """Return the result for one item, batched with concurrent callers"""
+        future = Future()
+        self._ensure_worker().put((item, future))
+        return future.result()
+
+    def _run(self, items):
+        while True:
+            batch = [items.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(items.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with a persistent cache and micro-batched queries
+
+    With a shared StateBackend, vectors embedded by any worker are reused by
+    the others (kept for shared_ttl seconds).
+    """
+
+    def __init__(self, base, cache_dir=None, max_batch=64, max_wait=0.01, shared=None, shared_ttl=7 * 24 * 3600):
+        self.base = base
+        self.model = getattr(base, "model", None) or type(base).__name__
+        self.store = EmbeddingStore(cache_dir, self.model) if cache_dir else None
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.batcher = MicroBatcher(self.embed_documents, max_batch=max_batch, max_wait=max_wait)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "api_calls": 0}
+
+    def _embed_uncached(self, texts):
+        """Embed texts in one API call and cache the results"""
+        with self._lock:
+            self._stats["api_calls"] += 1
+            self._stats["misses"] += len(texts)
+        vectors = self.base.embed_documents(texts)
+        if self.store is not None:
+            self.store.put_many([text_key(text) for text in texts], vectors)
+        if self.shared is not None:
+            for text, vector in zip(texts, vectors):
+                self.shared.set(self._shared_key(text_key(text)), np.asarray(vector, dtype="<f4").tobytes(), ttl=self.shared_ttl)
+        return vectors
+
+    def _shared_key(self, key):
+        return f"embedding:{self.model}:{key.hex()}"
+
+    def _cached(self, text):
+        key = text_key(text)
+        vector = self.store.get(key) if self.store is not None else None
+        if vector is None and self.shared is not None:
+            data = self.shared.get(self._shared_key(key))
+            if data is not None:
+                vector = np.frombuffer(data, dtype="<f4")
+                if self.store is not None:
+                    self.store.put_many([key], vector[None, :])
+        if vector is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return [float(x) for x in vector]
+        return None
+
+    def embed_documents(self, texts):
+        """Embed many texts, calling the API only for uncached (and unique) ones"""
+        results = [self._cached(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+        if missing:
+            embedded = dict(zip(missing, self._embed_uncached(missing)))
+            results = [vector if vector is not None else embedded[text] for text, vector in zip(texts, results)]
+        return results
+
+    def embed_query(self, text):
+        """Embed a query, batching concurrent cache misses into one API call"""
+        with span("embedding", "cache") as labels:
+            vector = self._cached(text)
+            if vector is not None:
+                return vector
+            labels["backend"] = "api"
+            return self.batcher.submit(text)
+
+    def stats(self):
+        """Hit/miss counters for health reporting"""
+        with self._lock:
+            return {**self._stats, "cached": len(self.store) if self.store is not None else 0}
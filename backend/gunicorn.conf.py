@@ -0,0 +1,34 @@
+"""
+Gunicorn settings for serving the Flask API in production:
+    pipenv run gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5001')
+
+# Sessions and caches live in-process unless STATE_BACKEND=redis shares them, so only run
+# several workers with a shared backend (live queries still need sticky routing per client)
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+worker_class = 'gthread'
+
+# Pre-fork mode: the master imports the app and loads indexes (and optionally local speech
+# models) once, then forks; workers share those pages copy-on-write instead of each loading a copy
+preload_app = os.getenv('PREFORK', 'false').lower() == 'true'
+
+# Enough threads for every admitted and queued request plus headroom for health checks,
+# so overload is answered by the admission controller instead of piling up in the socket backlog
+threads = int(os.getenv('GUNICORN_THREADS', str(
+    int(os.getenv('MAX_CONCURRENT_REQUESTS', '8')) + int(os.getenv('MAX_QUEUED_REQUESTS', '16')) + 4
+)))
+
+# A voice query chains Whisper, the LLM and TTS
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+keepalive = 5
+
+
+def post_fork(server, worker):
+    """Start each worker's own clients and background threads; threads do not survive the fork"""
+    if preload_app and os.getenv('EAGER_STARTUP', 'true').lower() == 'true':
+        from app import medical_assistant
+        medical_assistant.start()
@@ -0,0 +1,286 @@
+"""
+Shared outbound HTTP connections for every vendor client.
+
+OpenAI (Whisper, chat, embeddings) and ElevenLabs all take an httpx client,
+so one HTTPClients instance gives them a common set of keep-alive pools
+(HTTP/2 when the h2 package is installed), request-level timeouts and a DNS
+cache used by that client's connections only. Connections are opened ahead
+of the first query by warm(), and can be kept from going idle by warming
+them again in the background. Per-host request and new-connection
+counts show how often a connection was reused, and the time spent opening
+connections is recorded as the "http_connect" stage.
+"""
+
+import ipaddress
+import os
+import socket
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# Cheap unauthenticated requests that open a connection (and TLS session) to each vendor
+WARMUP_URLS = {
+    "openai": "https://api.openai.com/v1/models",
+    "elevenlabs": "https://api.elevenlabs.io/v1/models",
+}
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class DNSCache:
+    """Successful address lookups for vendor hosts, reused for ttl_seconds"""
+
+    def __init__(self, ttl_seconds=300.0):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """The address to connect to for host, or None for IP literals"""
+        try:
+            ipaddress.ip_address(host)
+            return None
+        except ValueError:
+            pass
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self.misses += 1
+            self._entries[(host, port)] = (now + self.ttl_seconds, address)
+        return address
+
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class DNSCachingTransport:
+    """httpx transport that connects to the cached address of a request's host
+
+    TLS still verifies (and sends SNI for) the original host name, and the
+    request carries its original URL again by the time it is returned, so
+    only this transport's connections are affected.
+    """
+
+    def __init__(self, transport, dns_cache):
+        self.transport = transport
+        self.dns_cache = dns_cache
+
+    def handle_request(self, request):
+        import httpx
+        url = request.url
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            address = self.dns_cache.resolve(url.host, port)
+        except OSError as e:
+            raise httpx.ConnectError(f"Failed to resolve {url.host}: {e}", request=request)
+        if address is None:
+            return self.transport.handle_request(request)
+        if url.scheme == "https":
+            request.extensions["sni_hostname"] = url.host
+        request.url = url.copy_with(host=address)
+        try:
+            return self.transport.handle_request(request)
+        except httpx.ConnectError:
+            # The host may have moved; resolve it again next time
+            self.dns_cache.forget(url.host, port)
+            raise
+        finally:
+            request.url = url
+
+    def __enter__(self):
+        self.transport.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.transport.__exit__(*exc_info)
+
+    def close(self):
+        self.transport.close()
+
+
+class HTTPClients:
+    """One httpx client shared by every outbound vendor call
+
+    It is created on first use. max_connections bounds the connections open
+    at once, max_keepalive how many idle ones are kept for reuse and
+    keepalive_seconds how long they are kept. timeout applies to each read or
+    write and connect_timeout to opening a connection.
+    """
+
+    def __init__(self, max_connections=32, max_keepalive=16, keepalive_seconds=60.0, timeout=30.0,
+                 connect_timeout=3.0, http2=True, dns_cache=None):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and http2_available()
+        if http2 and not self.http2:
+            logger.info("h2 package not installed, outbound HTTP uses HTTP/1.1")
+        self.dns_cache = dns_cache
+        self._client = None
+        self._hosts = {}
+        self._warmer = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, env=None):
+        """Clients configured by HTTP_* variables, e.g. HTTP_MAX_CONNECTIONS and HTTP_TIMEOUT_SECONDS"""
+        env = os.environ if env is None else env
+        dns_ttl = float(env.get("HTTP_DNS_CACHE_SECONDS") or 300)
+        return cls(
+            max_connections=int(env.get("HTTP_MAX_CONNECTIONS") or 32),
+            max_keepalive=int(env.get("HTTP_MAX_KEEPALIVE") or 16),
+            keepalive_seconds=float(env.get("HTTP_KEEPALIVE_SECONDS") or 60),
+            timeout=float(env.get("HTTP_TIMEOUT_SECONDS") or 30),
+            connect_timeout=float(env.get("HTTP_CONNECT_TIMEOUT_SECONDS") or 3),
+            http2=(env.get("HTTP_HTTP2") or "true").lower() == "true",
+            dns_cache=DNSCache(dns_ttl) if dns_ttl > 0 else None
+        )
+
+    @property
+    def client(self):
+        """The shared httpx.Client, for OpenAI, LangChain's OpenAI wrappers and ElevenLabs"""
+        with self._lock:
+            if self._client is None:
+                import httpx
+                transport = httpx.HTTPTransport(
+                    http2=self.http2,
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_keepalive,
+                        keepalive_expiry=self.keepalive_seconds
+                    )
+                )
+                if self.dns_cache is not None:
+                    transport = DNSCachingTransport(transport, self.dns_cache)
+                self._client = httpx.Client(
+                    transport=transport,
+                    timeout=self.httpx_timeout,
+                    event_hooks={"request": [self._trace_request], "response": [self._count_response]}
+                )
+            return self._client
+
+    @property
+    def httpx_timeout(self):
+        import httpx
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+    def _host(self, host):
+        """Per-host counters (caller holds the lock)"""
+        counts = self._hosts.get(host)
+        if counts is None:
+            counts = self._hosts[host] = {"requests": 0, "connections": 0, "tls_handshakes": 0}
+        return counts
+
+    def _trace_request(self, request):
+        """Have httpcore report connection setup for this request"""
+        if "trace" in request.extensions:
+            return
+        host = request.url.host
+        started = {}
+
+        def trace(event, info):
+            if event == "connection.connect_tcp.started":
+                started["connect"] = time.perf_counter()
+                return
+            if event == "connection.connect_tcp.complete":
+                counter = "connections"
+            elif event == "connection.start_tls.complete":
+                counter = "tls_handshakes"
+            else:
+                return
+            with self._lock:
+                self._host(host)[counter] += 1
+            # Connection setup is timed up to the end of the TLS handshake, if there is one
+            if counter == "tls_handshakes" or request.url.scheme == "http":
+                observe("http_connect", time.perf_counter() - started.pop("connect", time.perf_counter()), host)
+
+        request.extensions["trace"] = trace
+
+    def _count_response(self, response):
+        with self._lock:
+            self._host(response.request.url.host)["requests"] += 1
+
+    def warm(self, vendors, timeout=None):
+        """Open a pooled connection to each vendor's host with a HEAD request
+
+        vendors maps names to URLs (see WARMUP_URLS); any response, even an
+        error status, leaves a connection in the pool. Returns {vendor: ms}, or
+        the error for vendors that could not be reached.
+        """
+        timeout = timeout or self.connect_timeout + 2
+
+        def head(item):
+            vendor, url = item
+            started = time.perf_counter()
+            try:
+                self.client.head(url, timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Failed to warm connection to {urlsplit(url).hostname}: {e}")
+                return vendor, str(e)
+            return vendor, round((time.perf_counter() - started) * 1000)
+
+        if not vendors:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(vendors), thread_name_prefix="http-warm") as executor:
+            warmed = dict(executor.map(head, vendors.items()))
+        logger.info(f"Warmed outbound connections: {warmed}")
+        return warmed
+
+    def keep_warm(self, vendors, interval):
+        """Warm vendors again every interval seconds in the background, so pooled connections never go idle"""
+        if interval <= 0 or self._warmer is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.warm(vendors)
+
+        self._warmer = threading.Thread(target=loop, name="http-keep-warm", daemon=True)
+        self._warmer.start()
+
+    def stats(self):
+        with self._lock:
+            hosts = {host: dict(counts) for host, counts in sorted(self._hosts.items())}
+        for counts in hosts.values():
+            counts["reused"] = max(0, counts["requests"] - counts["connections"])
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "keepalive_seconds": self.keepalive_seconds,
+            "hosts": hosts,
+            "dns_cache": self.dns_cache.stats() if self.dns_cache is not None else None,
+        }
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
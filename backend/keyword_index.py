@@ -0,0 +1,116 @@
+import math
+import os
+import re
+import threading
+import time
+import logging
+from collections import Counter
+
+from patients import iter_patient_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEYWORD_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "keyword_index.jsonl")
+
+KEYWORD_INDEX_VERSION = 2
+
+# Keep dotted/slashed tokens such as "100/65" or "5.2" together
+TOKEN = re.compile(r"[a-z0-9]+(?:[./][a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have he her his how i in is it its of on or "
+    "she that the their them they this to was were what when which who whom why with".split()
+)
+
+
+def tokenize(text):
+    """Lowercase terms for keyword matching, without stopwords"""
+    return [term for term in TOKEN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class KeywordIndex:
+    """BM25 over record chunks, reloaded when ingestion rewrites the file"""
+
+    def __init__(self, path=DEFAULT_KEYWORD_INDEX_PATH, refresh_interval=5.0, k1=1.5, b=0.75):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.k1 = k1
+        self.b = b
+        self.documents = []
+        self._postings = {}
+        self._idf = {}
+        self._lengths = []
+        self._average_length = 0.0
+        self._by_patient = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            patients = dict(iter_patient_file(self.path, KEYWORD_INDEX_VERSION))
+        except Exception as e:
+            logger.warning(f"Failed to load keyword index {self.path}: {e}")
+            return
+
+        documents = [chunk for chunks in patients.values() for chunk in chunks]
+        postings = {}
+        lengths = []
+        by_patient = {}
+        for position, doc in enumerate(documents):
+            terms = Counter(tokenize(doc["text"]))
+            lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                postings.setdefault(term, []).append((position, frequency))
+            by_patient.setdefault(doc["metadata"].get("patient_id"), set()).add(position)
+
+        count = len(documents)
+        self.documents = documents
+        self._postings = postings
+        self._idf = {
+            term: math.log(1 + (count - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in postings.items()
+        }
+        self._lengths = lengths
+        self._average_length = sum(lengths) / count if count else 0.0
+        self._by_patient = by_patient
+        self._mtime = mtime
+        logger.info(f"Loaded keyword index with {count} chunks")
+
+    def search(self, query, k=10, patient_ids=None):
+        """Return up to k (chunk, score) pairs, best first, optionally restricted to some patients"""
+        with self._lock:
+            self._maybe_reload()
+            allowed = None
+            if patient_ids:
+                allowed = set().union(*(self._by_patient.get(patient_id, set()) for patient_id in patient_ids))
+
+            scores = {}
+            for term in set(tokenize(query)):
+                idf = self._idf.get(term)
+                if idf is None:
+                    continue
+                for position, frequency in self._postings[term]:
+                    if allowed is not None and position not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[position] / self._average_length)
+                    scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            top = sorted(scores.items(), key=lambda item: -item[1])[:k]
+            return [(self.documents[position], score) for position, score in top]
+
+    def __len__(self):
+        with self._lock:
+            return len(self.documents)
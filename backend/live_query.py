@@ -0,0 +1,358 @@
+"""
+Voice queries uploaded in frames while the clinician is still speaking.
+
+Frames are appended to the recording so far, which is transcribed in the
+background every partial_interval seconds. As soon as a partial transcript
+names a patient, retrieval for that patient starts speculatively, so by the
+time the clinician stops talking their records have usually been fetched.
+End of speech is detected with an energy-based voice activity detector (or
+signalled by the client), and finish() returns the final transcript along
+with the speculatively retrieved records if they still match it.
+"""
+
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_preprocess import PCMDecoder, ffmpeg_available, finalize_wav, wav_header
+from keyword_index import tokenize
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Raw 16 kHz mono 16-bit PCM frames; anything else is a container stream such as MediaRecorder's webm
+PCM_TYPES = ("audio/pcm", "audio/l16")
+
+# Whisper detects the container from the file name
+CONTAINER_FILENAMES = {
+    "audio/webm": "audio.webm",
+    "audio/ogg": "audio.ogg",
+    "audio/mp4": "audio.mp4",
+    "audio/mpeg": "audio.mp3",
+    "audio/wav": "audio.wav",
+}
+
+
+class LiveQueryRejected(Exception):
+    """Raised when a frame or finish call cannot be accepted"""
+
+    def __init__(self, message, status_code=409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def covers(query, question):
+    """Whether every keyword of question already appears in query"""
+    return set(tokenize(question)) <= set(tokenize(query))
+
+
+class VoiceActivityDetector:
+    """Energy-based end-of-speech detection over 16 kHz mono 16-bit PCM
+
+    Frames at or above threshold_db (dBFS) count as speech. Speech has ended
+    once at least min_speech_ms of it has been heard, followed by
+    end_silence_ms of quiet.
+    """
+
+    def __init__(self, threshold_db=-45.0, end_silence_ms=700, min_speech_ms=150, frame_ms=30, sample_rate=SAMPLE_RATE):
+        self.threshold_db = threshold_db
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.end_silence_frames = max(1, end_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.voiced_frames = 0
+        self.trailing_silence = 0
+        self.consumed = 0
+        self._pending = b""
+
+    def feed(self, pcm):
+        """Measure newly received PCM; returns whether speech has ended"""
+        self.consumed += len(pcm)
+        data = self._pending + pcm
+        usable = len(data) - len(data) % (self.frame_samples * 2)
+        self._pending = data[usable:]
+        if usable:
+            frames = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32).reshape(-1, self.frame_samples)
+            rms = np.sqrt(np.mean(frames ** 2, axis=1))
+            for level in 20 * np.log10(np.maximum(rms, 1.0) / 32768):
+                if level >= self.threshold_db:
+                    self.voiced_frames += 1
+                    self.trailing_silence = 0
+                else:
+                    self.trailing_silence += 1
+        return self.ended
+
+    @property
+    def speaking(self):
+        return self.voiced_frames >= self.min_speech_frames
+
+    @property
+    def ended(self):
+        return self.speaking and self.trailing_silence >= self.end_silence_frames
+
+
+class LiveQuery:
+    """One voice query being uploaded in frames
+
+    transcribe(data, filename, mimetype, partial) returns a transcript or None,
+    and retrieve(query, patient_ids) fetches records; without retrieve there is
+    no speculation. Container streams only get voice activity detection when
+    ffmpeg can decode them, otherwise the client has to signal the end.
+    """
+
+    def __init__(self, live_id, mimetype, transcribe, find_patients, executor, retrieve=None, vad=None,
+                 partial_interval=0.8, max_bytes=25 * 1024 * 1024):
+        content_type = (mimetype or "").split(";")[0].strip().lower()
+        self.live_id = live_id
+        self.pcm = content_type in PCM_TYPES
+        self.filename = "audio.wav" if self.pcm else CONTAINER_FILENAMES.get(content_type, "audio.webm")
+        self.mimetype = "audio/wav" if self.pcm else (content_type or "audio/webm")
+        self.transcribe = transcribe
+        self.find_patients = find_patients
+        self.retrieve = retrieve
+        self.executor = executor
+        self.vad = vad if self.pcm or ffmpeg_available() else None
+        # Container frames are decoded for the detector by one ffmpeg process, started with the first frame
+        self.decoder = None
+        self.partial_interval = partial_interval
+        self.max_bytes = max_bytes
+        self.audio = bytearray()
+        self.updated = time.monotonic()
+        self.finished = False
+        self.partials = 0
+        # Latest partial transcript as (text, bytes it covered, voiced frames at the time)
+        self.partial = None
+        self.speculation = None
+        self.reused_partial = False
+        self.speculation_hit = False
+        self._partial_task = None
+        self._partial_snapshot = None
+        self._partial_started = self.updated
+        self._lock = threading.Lock()
+
+    def _audio_file(self):
+        """(data, filename, mimetype) of the recording so far, as Whisper expects it"""
+        data = bytes(self.audio)
+        if self.pcm:
+            data = finalize_wav(wav_header(SAMPLE_RATE) + data)
+        return data, self.filename, self.mimetype
+
+    def _detect_speech(self, frame):
+        if self.vad is None:
+            return False
+        if self.pcm:
+            return self.vad.feed(frame)
+        # Decoding runs in the background; measure whatever it has produced so far
+        if self.decoder is None:
+            self.decoder = PCMDecoder(SAMPLE_RATE)
+        self.decoder.write(frame)
+        return self.vad.feed(self.decoder.read())
+
+    def _voiced(self):
+        return self.vad.voiced_frames if self.vad is not None else None
+
+    def append(self, frame):
+        """Add a frame of audio; returns whether end of speech has been detected"""
+        with self._lock:
+            if self.finished:
+                raise LiveQueryRejected("Live query already finished")
+            if len(self.audio) + len(frame) > self.max_bytes:
+                raise LiveQueryRejected(f"Audio upload exceeds {self.max_bytes} bytes", 413)
+            self.audio += frame
+            self.updated = time.monotonic()
+            ended = self._detect_speech(frame)
+            self._maybe_transcribe()
+        return ended
+
+    def _maybe_transcribe(self):
+        """Start a partial transcription if none is running and enough time has passed (caller holds the lock)"""
+        now = time.monotonic()
+        if self._partial_task is not None and not self._partial_task.done():
+            return
+        if now - self._partial_started < self.partial_interval:
+            return
+        if self.vad is not None and not self.vad.speaking:
+            return
+        if self.partial is not None and self.partial[1] == len(self.audio):
+            return
+        self._partial_started = now
+        self._partial_snapshot = (len(self.audio), self._voiced())
+        self._partial_task = self.executor.submit(self._transcribe_partial, self._audio_file(), *self._partial_snapshot)
+
+    def _transcribe_partial(self, audio, size, voiced):
+        text = self.transcribe(*audio, True)
+        if not text:
+            return None
+        with self._lock:
+            self.partials += 1
+            self.partial = (text, size, voiced)
+        self._speculate(text)
+        return text
+
+    def _speculate(self, text):
+        """Retrieve records for the patients a partial transcript names, unless that is already under way"""
+        if self.retrieve is None:
+            return
+        patient_ids = self.find_patients(text)
+        if not patient_ids:
+            return
+        with self._lock:
+            current = self.speculation
+            if current is not None:
+                if current["patient_ids"] == patient_ids and covers(current["query"], text):
+                    return
+                if not current["future"].done():
+                    return
+            logger.info(f"Speculatively retrieving records for {sorted(patient_ids)}")
+            self.speculation = {
+                "patient_ids": patient_ids,
+                "query": text,
+                "future": self.executor.submit(self._retrieve, text, patient_ids)
+            }
+
+    def _retrieve(self, query, patient_ids):
+        try:
+            with span("speculative_retrieval"):
+                return self.retrieve(query, patient_ids)
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed: {e}")
+            return None
+
+    def _covers_speech(self, snapshot, size, voiced):
+        """Whether audio transcribed at snapshot holds all the speech heard so far"""
+        covered_size, covered_voiced = snapshot
+        return covered_size == size or (voiced is not None and covered_voiced == voiced)
+
+    def finish(self):
+        """Stop accepting frames and return (transcript, patient_ids, docs)
+
+        The latest partial transcript is reused when no speech was heard after
+        the audio it covered. docs are the speculatively retrieved records when
+        they were fetched for the same patients and for a query containing every
+        keyword of the final transcript, otherwise None.
+        """
+        with self._lock:
+            if self.finished:
+                raise LiveQueryRejected("Live query already finished")
+            self.finished = True
+            self._close_decoder()
+            if not self.audio:
+                return None, set(), None
+            size = len(self.audio)
+            voiced = self._voiced()
+            task, snapshot, partial = self._partial_task, self._partial_snapshot, self.partial
+
+        # A partial transcription that already covers all the speech beats starting a new one
+        transcript = None
+        if task is not None and self._covers_speech(snapshot, size, voiced):
+            transcript = task.result()
+        elif partial is not None and self._covers_speech(partial[1:], size, voiced):
+            transcript = partial[0]
+        self.reused_partial = transcript is not None
+        if transcript is None:
+            with self._lock:
+                audio = self._audio_file()
+            transcript = self.transcribe(*audio, False)
+        if not transcript:
+            return None, set(), None
+
+        patient_ids = self.find_patients(transcript)
+        with self._lock:
+            speculation = self.speculation
+        docs = None
+        if speculation is not None and patient_ids and speculation["patient_ids"] == patient_ids \
+                and covers(speculation["query"], transcript):
+            # Nothing found for the patients: let regular retrieval fall back to all records
+            docs = speculation["future"].result() or None
+        self.speculation_hit = docs is not None
+        return transcript, patient_ids, docs
+
+    def _close_decoder(self):
+        """Stop the container decoder, if one was started (caller holds the lock)"""
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+
+    def abandon(self):
+        """Release resources of a live query that will never be finished"""
+        with self._lock:
+            self.finished = True
+            self._close_decoder()
+
+    def status(self):
+        with self._lock:
+            return {
+                "live_id": self.live_id,
+                "received_bytes": len(self.audio),
+                "partial_transcript": self.partial[0] if self.partial else None,
+                "speculating_for": sorted(self.speculation["patient_ids"]) if self.speculation else [],
+                "voice_activity_detection": self.vad is not None,
+                "speech_ended": self.vad is not None and self.vad.ended
+            }
+
+
+class LiveQueryStore:
+    """Open live queries by ID, dropped after ttl_seconds without a frame
+
+    Partial transcriptions and speculative retrievals of every live query share
+    one bounded thread pool.
+    """
+
+    def __init__(self, ttl_seconds=60, max_queries=64, max_workers=4):
+        self.ttl_seconds = ttl_seconds
+        self.max_queries = max_queries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="live")
+        self._queries = {}
+        self._lock = threading.Lock()
+        self._counts = {
+            "opened": 0, "finished": 0, "expired": 0, "partials": 0,
+            "reused_partials": 0, "speculation_hits": 0, "speculation_misses": 0
+        }
+
+    def open(self, mimetype, transcribe, find_patients, **kwargs):
+        """Create a LiveQuery; raises LiveQueryRejected when too many are open"""
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            if len(self._queries) >= self.max_queries:
+                raise LiveQueryRejected("Too many live queries in progress", 503)
+            live = LiveQuery(uuid.uuid4().hex, mimetype, transcribe, find_patients, self.executor, **kwargs)
+            self._queries[live.live_id] = live
+            self._counts["opened"] += 1
+        return live
+
+    def get(self, live_id):
+        """Return an open live query, or None if unknown or expired"""
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            return self._queries.get(live_id)
+
+    def close(self, live):
+        """Forget a finished live query and count how much of its work was reused"""
+        with self._lock:
+            if self._queries.pop(live.live_id, None) is None:
+                return
+            self._counts["finished"] += 1
+            self._counts["partials"] += live.partials
+            self._counts["reused_partials"] += int(live.reused_partial)
+            if live.speculation is not None:
+                self._counts["speculation_hits" if live.speculation_hit else "speculation_misses"] += 1
+
+    def _evict_expired(self, now):
+        """Remove idle live queries (caller holds the lock)"""
+        expired = [live_id for live_id, live in self._queries.items() if now - live.updated > self.ttl_seconds]
+        for live_id in expired:
+            self._queries.pop(live_id).abandon()
+        self._counts["expired"] += len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._queries), **self._counts}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queries)
@@ -0,0 +1,225 @@
+import json
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+DOCUMENTS_FILE = "documents.json"
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGNMENTS_FILE = "ivf_assignments.npy"
+
+
+def normalize(vectors):
+    """L2-normalize rows so a dot product is cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def matches_filter(metadata, filter):
+    """Evaluate a Pinecone-style metadata filter: plain equality, $eq or $in"""
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if isinstance(condition, dict):
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _atomic_save(path, array):
+    """Write an .npy file via rename so processes that memory-mapped the old file are unaffected"""
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+class LocalVectorIndex:
+    """In-process cosine index over float32 vectors, persisted as memory-mappable .npy files
+
+    Search is exact by default. For larger corpora an IVF (inverted file) index can be
+    trained: vectors are clustered with k-means and only the nprobe clusters closest to
+    the query are scanned.
+    """
+
+    def __init__(self, vectors, documents, centroids=None, assignments=None, nprobe=8):
+        self.vectors = vectors
+        self.documents = documents
+        self.centroids = centroids
+        self.assignments = assignments
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, documents, ann=None, n_lists=None, nprobe=8):
+        """Build an index from embeddings and their documents ({"id", "text", "metadata"})"""
+        index = cls(normalize(vectors), list(documents), nprobe=nprobe)
+        if ann == "ivf":
+            index.train_ivf(n_lists or max(1, int(np.sqrt(len(index.documents)))))
+        return index
+
+    @classmethod
+    def load(cls, directory, mmap=True, nprobe=8):
+        """Load a saved index, memory-mapping the vectors by default"""
+        mmap_mode = "r" if mmap else None
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, DOCUMENTS_FILE), "r") as f:
+            documents = json.load(f)
+
+        centroids = assignments = None
+        if os.path.exists(os.path.join(directory, CENTROIDS_FILE)):
+            centroids = np.load(os.path.join(directory, CENTROIDS_FILE))
+            assignments = np.load(os.path.join(directory, ASSIGNMENTS_FILE), mmap_mode=mmap_mode)
+
+        logger.info(f"Loaded local vector index with {len(documents)} vectors from {directory}")
+        return cls(vectors, documents, centroids, assignments, nprobe=nprobe)
+
+    def save(self, directory):
+        """Persist the index to a directory"""
+        os.makedirs(directory, exist_ok=True)
+        _atomic_save(os.path.join(directory, VECTORS_FILE), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        documents_path = os.path.join(directory, DOCUMENTS_FILE)
+        with open(documents_path + ".tmp", "w") as f:
+            json.dump(self.documents, f)
+        os.replace(documents_path + ".tmp", documents_path)
+
+        centroids_path = os.path.join(directory, CENTROIDS_FILE)
+        assignments_path = os.path.join(directory, ASSIGNMENTS_FILE)
+        if self.centroids is not None:
+            _atomic_save(centroids_path, self.centroids)
+            _atomic_save(assignments_path, self.assignments)
+        else:
+            # Don't leave a stale IVF index next to rebuilt vectors
+            for path in (centroids_path, assignments_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @classmethod
+    def empty(cls, nprobe=8):
+        """An index with no vectors yet"""
+        return cls(np.zeros((0, 0), dtype=np.float32), [], nprobe=nprobe)
+
+    def upsert(self, vectors, documents):
+        """Insert or replace documents by their "id", dropping any trained IVF index"""
+        vectors = normalize(vectors)
+        replaced = {doc["id"] for doc in documents}
+        keep = [i for i, doc in enumerate(self.documents) if doc["id"] not in replaced]
+        existing = np.asarray(self.vectors)[keep] if len(self.documents) else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self.vectors = np.concatenate([existing, vectors])
+        self.documents = [self.documents[i] for i in keep] + list(documents)
+        self.centroids = self.assignments = None
+
+    def delete(self, ids):
+        """Remove documents by "id", dropping any trained IVF index"""
+        ids = set(ids)
+        keep = [i for i, doc in enumerate(self.documents) if doc["id"] not in ids]
+        if len(keep) == len(self.documents):
+            return
+        self.vectors = np.asarray(self.vectors)[keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.centroids = self.assignments = None
+
+    def train_ivf(self, n_lists, iterations=10, seed=0):
+        """Cluster the vectors with spherical k-means for approximate search"""
+        n_lists = min(n_lists, len(self.documents))
+        if n_lists < 2:
+            return
+
+        rng = np.random.default_rng(seed)
+        vectors = np.asarray(self.vectors)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = vectors[assignments == cluster]
+                if len(members):
+                    centroids[cluster] = members.mean(axis=0)
+            centroids = normalize(centroids)
+
+        self.centroids = centroids
+        self.assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+    def search(self, query_vector, k=3, filter=None):
+        """Return up to k (document, score) pairs, best first"""
+        if not self.documents:
+            return []
+        query = normalize(query_vector).reshape(-1)
+
+        candidates = None
+        if filter:
+            # Filtered searches (e.g. one patient) cover few chunks, so scan them all exactly
+            candidates = np.array([
+                i for i, doc in enumerate(self.documents) if matches_filter(doc["metadata"], filter)
+            ], dtype=np.int64)
+        elif self.centroids is not None:
+            closest = np.argsort(-(self.centroids @ query))[:self.nprobe]
+            candidates = np.flatnonzero(np.isin(self.assignments, closest))
+
+        if candidates is None:
+            scores = self.vectors @ query
+            ids = np.arange(len(scores))
+        else:
+            if not len(candidates):
+                return []
+            scores = self.vectors[candidates] @ query
+            ids = candidates
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.documents[int(ids[i])], float(scores[i])) for i in top]
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class LocalVectorStore:
+    """Minimal vector store over a LocalVectorIndex, matching how the agent uses Pinecone"""
+
+    def __init__(self, index, embedding):
+        self.index = index
+        self.embedding = embedding
+
+    @classmethod
+    def load(cls, directory, embedding, nprobe=8):
+        return cls(LocalVectorIndex.load(directory, nprobe=nprobe), embedding)
+
+    @classmethod
+    def from_documents(cls, documents, embedding, directory=None, ann=None, ids=None):
+        """Embed LangChain documents, build an index and optionally save it"""
+        vectors = embedding.embed_documents([doc.page_content for doc in documents])
+        records = [
+            {
+                "id": ids[i] if ids else str(i),
+                "text": doc.page_content,
+                "metadata": dict(doc.metadata),
+            }
+            for i, doc in enumerate(documents)
+        ]
+        index = LocalVectorIndex.build(vectors, records, ann=ann)
+        if directory:
+            index.save(directory)
+        return cls(index, embedding)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        from langchain.docstore.document import Document
+
+        return [
+            (Document(page_content=doc["text"], metadata=doc["metadata"]), score)
+            for doc, score in self.index.search(embedding, k=k, filter=filter)
+        ]
+
+    def similarity_search_with_score(self, query, k=4, filter=None):
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
@@ -0,0 +1,138 @@
+"""
+In-process latency metrics for the voice pipeline.
+
+Code wraps each stage in span("stage"), which feeds a per (stage, backend)
+summary with p50/p95/p99 over a sliding window of recent samples, exposed in
+Prometheus text format. Inside track_request() the same spans are also
+collected into a per-request timings block.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_request = ContextVar("request_timings", default=None)
+
+
+class LatencySummary:
+    """Count and sum of all samples plus quantiles over the most recent ones"""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: ordered[min(len(ordered) - 1, int(len(ordered) * q))] for q in QUANTILES}
+
+
+class Metrics:
+    """Latency summaries keyed by (stage, backend)"""
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, backend=""):
+        key = (stage, backend or "")
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = LatencySummary(self.window)
+            summary.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._summaries = {}
+
+    def snapshot(self):
+        """{stage: {backend: {count, p50_ms, p95_ms, p99_ms}}}"""
+        with self._lock:
+            items = [(key, summary.count, summary.quantiles()) for key, summary in sorted(self._summaries.items())]
+        result = {}
+        for (stage, backend), count, quantiles in items:
+            result.setdefault(stage, {})[backend or "all"] = {
+                "count": count,
+                **{f"p{int(q * 100)}_ms": round(value * 1000, 1) for q, value in quantiles.items()}
+            }
+        return result
+
+    def render(self, prefix="medical_assistant"):
+        """Prometheus text exposition of every stage summary"""
+        name = f"{prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Latency of each voice pipeline stage",
+            f"# TYPE {name} summary",
+        ]
+        with self._lock:
+            items = [(key, summary.count, summary.total, summary.quantiles()) for key, summary in sorted(self._summaries.items())]
+        for (stage, backend), count, total, quantiles in items:
+            labels = f'stage="{stage}",backend="{backend}"'
+            for q, value in quantiles.items():
+                lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    """Stage durations for one request; repeated stages (e.g. several LLM calls) add up"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        timings = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+
+# Process-wide registry served by /api/metrics
+METRICS = Metrics()
+
+
+def observe(stage, seconds, backend=""):
+    """Record a stage duration globally and, inside track_request(), for the current request"""
+    METRICS.observe(stage, seconds, backend)
+    timings = _current_request.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage, backend=""):
+    """Time a block as a pipeline stage; set labels["backend"] inside it once the backend is known"""
+    labels = {"backend": backend}
+    started = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(stage, time.perf_counter() - started, labels["backend"])
+
+
+@contextmanager
+def track_request():
+    """Collect the spans recorded on this thread into a RequestTimings"""
+    timings = RequestTimings()
+    token = _current_request.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_request.reset(token)
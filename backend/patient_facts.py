@@ -0,0 +1,273 @@
+"""
+Structured facts extracted from patient records at ingestion time.
+
+Records are free text made of "Label: value." fields. Ingestion parses them
+into vitals, medications, labs, assessment, plan, last visit and so on, and
+renders a spoken answer for each field. FactStore routes simple field
+lookups ("What's Jacob Reed's blood pressure?", "Current medications?") to
+those answers, so they are served without retrieval or an LLM call. Anything
+that is not a plain lookup of one field for one patient is left to the LLM.
+"""
+
+import os
+import re
+import threading
+import time
+import logging
+
+from patients import extract_patient_name, iter_patient_file, normalize_text, record_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FACTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "patient_facts.jsonl")
+
+PATIENT_FACTS_VERSION = 2
+
+# "Label: value." fields, each starting the record or a new sentence
+FIELD = re.compile(r"(?:^|(?<=\. ))([A-Z][A-Za-z ]+): ")
+DEMOGRAPHICS = re.compile(r",\s*(\d{1,3}) years? old (male|female)\b", re.IGNORECASE)
+FOLLOW_UP = re.compile(r"((?:Next )?follow-up [^.]*)\.", re.IGNORECASE)
+
+# Field labels used in the records, and the fact each one is stored as
+FIELD_NAMES = {
+    "medical history": "medical_history",
+    "past medical history": "medical_history",
+    "last visit": "last_visit",
+    "chief complaint": "chief_complaint",
+    "current medications": "medications",
+    "medications": "medications",
+    "recent labs": "labs",
+    "labs": "labs",
+    "assessment": "assessment",
+    "plan": "plan",
+    "physical exam": "physical_exam",
+    "vitals": "physical_exam",
+}
+
+VITALS = {
+    "blood_pressure": re.compile(r"\b(?:BP|blood pressure)\s*(\d{2,3}/\d{2,3}\s*(?:mmHg)?)", re.IGNORECASE),
+    "pulse": re.compile(r"\b(?:pulse|heart rate|HR)\s*(\d{2,3}\s*(?:bpm)?)", re.IGNORECASE),
+    "weight": re.compile(r"\bweight\s*(\d+(?:\.\d+)?\s*(?:lbs?|kg)(?:\s*\([^)]*\))?)", re.IGNORECASE),
+    "temperature": re.compile(r"\btemperature\s*(\d+(?:\.\d+)?\s*°?\s*[FC]\b)", re.IGNORECASE),
+}
+
+# What a question asks for, matched against normalize_text() output; a lookup matches exactly one
+INTENTS = [
+    ("vitals", re.compile(r"\bvitals?\b|\bvital signs\b")),
+    ("blood_pressure", re.compile(r"\bblood pressure\b|\bbp\b")),
+    ("pulse", re.compile(r"\bpulse\b|\bheart rate\b")),
+    ("weight", re.compile(r"\bweigh(?:t|s)?\b")),
+    ("temperature", re.compile(r"\btemperature\b|\btemp\b")),
+    ("medications", re.compile(r"\bmedications?\b|\bmeds\b|\bmedicines?\b|\bprescriptions?\b|\bwhat (?:\w+ ){1,4}taking\b")),
+    ("labs", re.compile(r"\blabs?\b|\blab results\b")),
+    ("last_visit", re.compile(r"\blast (?:visit|seen|appointment)\b|\bwhen \w+ \w+ (?:\w+ )?(?:last )?seen\b")),
+    ("chief_complaint", re.compile(r"\bchief complaint\b|\bpresenting complaint\b|\bcomplaint\b")),
+    ("assessment", re.compile(r"\bassessment\b|\bdiagnosis\b|\bimpression\b")),
+    ("plan", re.compile(r"\bplan\b|\bnext steps?\b")),
+    ("follow_up", re.compile(r"\bfollow ?up\b")),
+    ("medical_history", re.compile(r"\b(?:medical|past) history\b|\bpmh\b")),
+    ("age", re.compile(r"\bhow old\b|\bage\b")),
+]
+
+# "At the last visit" qualifies a vital sign or finding rather than asking for the visit date
+LATEST_VISIT = re.compile(r"\b(?:at|during|from|on|in) (?:the|her|his|their) (?:last|latest|most recent|recent) (?:visit|appointment)\b")
+
+# Questions that need reasoning, a comparison, an older value, a negation, a status change or a
+# yes/no judgement go to the LLM
+NOT_A_LOOKUP = re.compile(
+    r"\b(?:why|should|could|would|compare|compared|versus|vs|trend|trends|trending|change|changed|changes|previous|prior|"
+    r"before|since|ago|risk|risks|recommend|explain|interact|interaction|interactions|safe|dose|adjust|if|"
+    r"because|and|or|also|all|patients|last (?:week|month|year)|\d{4}|"
+    r"not|no|nt|never|without|stop|stopped|stopping|discontinue|discontinued|held|hold|holding|paused|missed|"
+    r"started|new|working|worked|effective|side effects?)\b"
+)
+YES_NO = re.compile(r"^(?:is|are|does|do|did|has|have|was|were|can|will)\b")
+
+# Words that refer to the patient discussed earlier in the conversation
+PATIENT_REFERENCE = re.compile(r"\b(?:she|her|hers|he|him|his|they|them|their|the patient)\b")
+
+# Words a plain lookup may contain besides its field keyword and the patient's name; any other
+# word ("What was the plan for her diabetes?") narrows the question beyond the stored answer
+LOOKUP_WORDS = frozenset(
+    "what whats which when how is are was were does do has have the a an of for on at in to me us show tell give "
+    "list read please current currently last latest most recent much now today right s patient she her hers he him "
+    "his they them their take takes taking seen old signs results next steps up".split()
+)
+
+MAX_QUESTION_WORDS = 14
+
+
+def _clean(value):
+    return value.strip().rstrip(".").strip()
+
+
+def _lower_first(text):
+    """Lowercase a leading word unless it is an acronym or name-like token (e.g. "BP", "ECG")"""
+    if len(text) > 1 and text[0].isupper() and not text[1].isupper():
+        return text[0].lower() + text[1:]
+    return text
+
+
+def _join(items):
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def extract_facts(patient):
+    """Structured facts and pre-rendered answers for one patient record"""
+    content = patient.get("content", "")
+    name = extract_patient_name(patient)
+    facts = {"name": name, "version": record_version(patient), "fields": {}, "vitals": {}}
+
+    demographics = DEMOGRAPHICS.search(content)
+    if demographics:
+        facts["age"] = int(demographics.group(1))
+        facts["sex"] = demographics.group(2).lower()
+
+    parts = FIELD.split(content)
+    for label, value in zip(parts[1::2], parts[2::2]):
+        field = FIELD_NAMES.get(label.strip().lower())
+        if field and _clean(value):
+            facts["fields"][field] = _clean(value)
+
+    for vital, pattern in VITALS.items():
+        match = pattern.search(facts["fields"].get("physical_exam", content))
+        if match:
+            facts["vitals"][vital] = " ".join(match.group(1).split())
+    if "medications" in facts["fields"]:
+        facts["medications"] = [_clean(item) for item in facts["fields"]["medications"].split(",") if _clean(item)]
+    follow_up = FOLLOW_UP.search(content)
+    if follow_up:
+        facts["fields"]["follow_up"] = _clean(follow_up.group(1))
+
+    facts["answers"] = render_answers(facts) if name else {}
+    return facts
+
+
+def render_answers(facts):
+    """One spoken answer per intent the record can answer"""
+    name = facts["name"]
+    fields = facts["fields"]
+    vitals = facts["vitals"]
+    visit = f"at the last visit on {fields['last_visit']}" if fields.get("last_visit") else "at the last recorded visit"
+    labels = {"blood_pressure": "blood pressure", "pulse": "pulse", "weight": "weight", "temperature": "temperature"}
+    answers = {}
+
+    for vital, label in labels.items():
+        if vital in vitals:
+            answers[vital] = f"{name}'s {label} was {vitals[vital]} {visit}."
+    if vitals:
+        readings = [f"{labels[vital]} {value}" for vital, value in vitals.items()]
+        answers["vitals"] = f"{name}'s vitals {visit}: {_join(readings)}."
+    if facts.get("medications"):
+        answers["medications"] = f"{name}'s current medications are {_join(facts['medications'])}."
+    if fields.get("last_visit"):
+        answers["last_visit"] = f"{name} was last seen on {fields['last_visit']}."
+    if fields.get("chief_complaint"):
+        answers["chief_complaint"] = f"{name}'s chief complaint {visit} was {_lower_first(fields['chief_complaint'])}."
+    for field, label in [("labs", "recent labs"), ("assessment", "assessment"), ("plan", "plan"),
+                         ("medical_history", "medical history")]:
+        if fields.get(field):
+            answers[field] = f"{name}'s {label}: {fields[field]}."
+    if fields.get("follow_up"):
+        answers["follow_up"] = f"For {name}: {_lower_first(fields['follow_up'])}."
+    if facts.get("age"):
+        answers["age"] = f"{name} is {facts['age']} years old."
+    return answers
+
+
+def lookup_intent(question, name=None):
+    """The single field a question asks for, or None if it is not a plain lookup
+
+    Besides the field keyword and the patient's name, the question may only
+    contain filler words (LOOKUP_WORDS).
+    """
+    text = normalize_text(question)
+    if not text or len(text.split()) > MAX_QUESTION_WORDS:
+        return None
+    if YES_NO.match(text) or NOT_A_LOOKUP.search(text):
+        return None
+    text = LATEST_VISIT.sub(" ", text)
+    intents = {intent for intent, pattern in INTENTS if pattern.search(text)}
+    # "Vitals" names several fields at once; a specific vital sign alongside it is still one lookup
+    if "vitals" in intents:
+        intents -= {"blood_pressure", "pulse", "weight", "temperature"}
+    if len(intents) != 1:
+        return None
+    for _, pattern in INTENTS:
+        text = pattern.sub(" ", text)
+    extra = set(text.split()) - LOOKUP_WORDS - set(normalize_text(name or "").split())
+    return None if extra else intents.pop()
+
+
+def refers_to_patient(question):
+    """Whether a question points back at a patient ("her", "his", "the patient") instead of naming one"""
+    return bool(PATIENT_REFERENCE.search(normalize_text(question)))
+
+
+class FactStore:
+    """Pre-rendered answers to field lookups, reloaded when ingestion rewrites the file"""
+
+    def __init__(self, path=DEFAULT_FACTS_PATH, refresh_interval=5.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._patients = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            patients = dict(iter_patient_file(self.path, PATIENT_FACTS_VERSION))
+        except Exception as e:
+            logger.warning(f"Failed to load patient facts {self.path}: {e}")
+            return
+
+        self._patients = patients
+        self._mtime = mtime
+        logger.info(f"Loaded facts for {len(self._patients)} patients")
+
+    def answer(self, question, patient_ids):
+        """Pre-rendered answer when question looks up one field of exactly one of patient_ids' records"""
+        with self._lock:
+            self._maybe_reload()
+            answer = None
+            if patient_ids and len(patient_ids) == 1:
+                facts = self._patients.get(next(iter(patient_ids)), {})
+                intent = lookup_intent(question, facts.get("name"))
+                if intent is not None:
+                    answer = facts.get("answers", {}).get(intent)
+            if answer is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return answer
+
+    def answers(self, intents=None):
+        """Every pre-rendered answer text, optionally only for some intents, in that order"""
+        with self._lock:
+            self._maybe_reload()
+            patients = list(self._patients.values())
+        intents = intents or [intent for intent, _ in INTENTS]
+        return [facts["answers"][intent] for intent in intents for facts in patients if intent in facts.get("answers", {})]
+
+    def stats(self):
+        with self._lock:
+            return {"patients": len(self._patients), "hits": self._hits, "misses": self._misses}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._patients)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "patient_directory.jsonl")
+
+PATIENT_DIRECTORY_VERSION = 2
+
+# Records start with the patient's name, e.g. "Emily Rivera, 29 years old female. ..."
+NAME_PREFIX = re.compile(r"^\s*([A-Z][a-zA-Z'\-]+(?:\s+[A-Z][a-zA-Z'\-]+){1,3})\s*,")
+
+
+def extract_patient_name(patient):
+    """Patient name from an explicit field or the start of the record text"""
+    if patient.get('name'):
+        return patient['name']
+    match = NAME_PREFIX.match(patient.get('content', ''))
+    return match.group(1) if match else None
+
+
+def record_version(patient):
+    """Content hash that changes whenever a patient's record changes"""
+    return hashlib.sha256(patient.get('content', '').encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_text(text):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^a-z0-9_#\s]", " ", text.lower()).split())
+
+
+def iter_patient_file(path, version):
+    """(patient_id, entry) for each line of a file written by PatientFileWriter
+
+    Raises ValueError if the file was written in another version.
+    """
+    with open(path, "r") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("version") != version:
+            raise ValueError(f"{path} has unsupported version {header.get('version')}")
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["patient_id"], record["entry"]
+
+
+class PatientFileWriter:
+    """Per-patient JSONL file written one patient at a time as ingestion streams the records
+
+    The first line is {"version": ...}, followed by one {"patient_id", "entry"}
+    line per patient, so neither ingestion nor the file holds more than one
+    patient in memory at once. Lines go to a temporary file that close()
+    moves into place; with merge=True, the existing file's patients that were
+    not written this run are copied over first.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.written = set()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path + ".tmp", "w")
+        self._file.write(json.dumps({"version": version}) + "\n")
+
+    def add(self, patient_id, entry):
+        self._file.write(json.dumps({"patient_id": patient_id, "entry": entry}, ensure_ascii=False) + "\n")
+        self.written.add(patient_id)
+
+    def close(self, merge=False):
+        if merge and os.path.exists(self.path):
+            try:
+                for patient_id, entry in iter_patient_file(self.path, self.version):
+                    if patient_id not in self.written:
+                        self.add(patient_id, entry)
+            except ValueError as e:
+                logger.warning(f"Not merging {self.path}: {e}")
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class PatientDirectory:
+    """Name -> patient_id lookup and record versions, reloaded when ingestion rewrites the file"""
+
+    def __init__(self, path=DEFAULT_DIRECTORY_PATH, refresh_interval=5.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._patients = {}
+        self._names = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            patients = dict(iter_patient_file(self.path, PATIENT_DIRECTORY_VERSION))
+        except Exception as e:
+            logger.warning(f"Failed to load patient directory {self.path}: {e}")
+            return
+
+        names = {}
+        last_names = {}
+        for patient_id, entry in patients.items():
+            name = entry.get("name")
+            names[normalize_text(patient_id)] = patient_id
+            if name:
+                names[normalize_text(name)] = patient_id
+                last_names.setdefault(normalize_text(name).split()[-1], set()).add(patient_id)
+        # A last name alone identifies a patient only when it is unique
+        for last_name, ids in last_names.items():
+            if len(ids) == 1 and last_name not in names:
+                names[last_name] = next(iter(ids))
+
+        self._patients = patients
+        self._names = names
+        self._mtime = mtime
+        logger.info(f"Loaded patient directory with {len(patients)} patients")
+
+    def find(self, text):
+        """Patient IDs named in a piece of text"""
+        with self._lock:
+            self._maybe_reload()
+            padded = f" {normalize_text(text)} "
+            return {patient_id for name, patient_id in self._names.items() if f" {name} " in padded}
+
+    def name(self, patient_id):
+        with self._lock:
+            self._maybe_reload()
+            return self._patients.get(patient_id, {}).get("name")
+
+    def __contains__(self, patient_id):
+        with self._lock:
+            self._maybe_reload()
+            return patient_id in self._patients
+
+    def versions(self, patient_ids):
+        """Current record versions for the given patients, or of the whole directory if none are given"""
+        with self._lock:
+            self._maybe_reload()
+            if not patient_ids:
+                return {"*": str(self._mtime)}
+            return {patient_id: self._patients.get(patient_id, {}).get("version") for patient_id in patient_ids}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._patients)
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+
+from metrics import span
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_id(patient_id, text, chunk_hash=None):
+    """Same "<patient_id>#<hash>" ID the ingestion script gives each chunk"""
+    return f"{patient_id}#{chunk_hash or hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """Fuse ranked ID lists into one (id, score) list, best first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class HybridRetriever:
+    """Patient-scoped dense + BM25 retrieval with an adaptive number of chunks
+
+    Patients named in the query (via the ingestion-time patient directory)
+    restrict both searches through the patient_id metadata. Dense and keyword
+    rankings are fused with reciprocal rank fusion, and chunks are then taken
+    best-first until the fused score drops well below the best match, k_max is
+    reached, or the token budget is spent. Questions about specific patients get
+    a budget proportional to the number of patients named.
+
+    With embed given, the query is embedded once and searched by vector, so the
+    embedding and vector search stages are timed separately.
+    """
+
+    def __init__(self, vectorstore, directory, keyword_index=None, k_min=2, k_max=8, token_budget=1500,
+                 patient_token_budget=800, min_relative_score=0.5, rrf_k=60, embed=None):
+        self.vectorstore = vectorstore
+        self.embed = embed
+        self.directory = directory
+        self.keyword_index = keyword_index
+        self.k_min = k_min
+        self.k_max = k_max
+        self.token_budget = token_budget
+        self.patient_token_budget = patient_token_budget
+        self.min_relative_score = min_relative_score
+        self.rrf_k = rrf_k
+
+    def _search(self, query, vector, patient_ids):
+        """Dense and keyword candidates as {id: Document} plus the two rankings"""
+        from langchain.docstore.document import Document
+
+        vector_filter = {"patient_id": {"$in": sorted(patient_ids)}} if patient_ids else None
+        with span("vector_search"):
+            if vector is not None:
+                results = self.vectorstore.similarity_search_by_vector(vector, k=self.k_max, filter=vector_filter)
+            else:
+                results = self.vectorstore.similarity_search(query, k=self.k_max, filter=vector_filter)
+        docs = {}
+        dense_ranking = []
+        for doc in results:
+            doc_id = chunk_id(doc.metadata.get("patient_id"), doc.page_content, doc.metadata.get("chunk_hash"))
+            docs.setdefault(doc_id, doc)
+            dense_ranking.append(doc_id)
+
+        keyword_ranking = []
+        if self.keyword_index is not None:
+            with span("keyword_search"):
+                matches = self.keyword_index.search(query, k=self.k_max, patient_ids=patient_ids)
+            for chunk, _ in matches:
+                docs.setdefault(chunk["id"], Document(page_content=chunk["text"], metadata=chunk["metadata"]))
+                keyword_ranking.append(chunk["id"])
+        return docs, dense_ranking, keyword_ranking
+
+    def budget_for(self, patient_ids):
+        if patient_ids:
+            return min(self.token_budget, self.patient_token_budget * len(patient_ids))
+        return self.token_budget
+
+    def retrieve(self, query, patient_ids=None):
+        """Documents for a query, most relevant first
+
+        patient_ids restricts the search to those patients instead of the ones
+        the query names, with no fallback to other patients' records.
+        """
+        explicit = patient_ids is not None
+        if not explicit:
+            patient_ids = self.directory.find(query)
+        vector = self.embed(query) if self.embed is not None else None
+        docs, dense_ranking, keyword_ranking = self._search(query, vector, patient_ids)
+        if not docs and patient_ids and not explicit:
+            # The directory may be ahead of the index; better unscoped context than none
+            logger.warning(f"No chunks found for patients {sorted(patient_ids)}, searching all records")
+            docs, dense_ranking, keyword_ranking = self._search(query, vector, set())
+
+        fused = reciprocal_rank_fusion([dense_ranking, keyword_ranking], self.rrf_k)
+        if not fused:
+            return []
+
+        budget = self.budget_for(patient_ids)
+        top_score = fused[0][1]
+        selected = []
+        used = 0
+        for doc_id, score in fused[:self.k_max]:
+            tokens = count_tokens(docs[doc_id].page_content)
+            if len(selected) >= self.k_min and (score < top_score * self.min_relative_score or used + tokens > budget):
+                break
+            selected.append(docs[doc_id])
+            used += tokens
+
+        logger.info(f"Retrieved {len(selected)} chunks ({used} tokens) for patients {sorted(patient_ids) or 'any'}")
+        return selected
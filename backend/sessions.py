@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+
+from shared_state import LocalState
+from tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Bounded conversation history for one client"""
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.size = 0
+        self.last_access = time.monotonic()
+
+    def add_turn(self, question, answer):
+        """Append an exchange and return the change in stored bytes"""
+        before = self.size
+        if len(self.turns) == self.turns.maxlen:
+            dropped = self.turns[0]
+            self.size -= len(dropped["question"]) + len(dropped["answer"])
+        self.turns.append({"question": question, "answer": answer})
+        self.size += len(question) + len(answer)
+        return self.size - before
+
+
+class SessionStore:
+    """Per-client conversation state with TTL eviction and a global memory cap"""
+
+    def __init__(self, max_turns=10, ttl_seconds=1800, max_sessions=1000, max_bytes=16 * 1024 * 1024):
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get_turns(self, session_id):
+        """Return a copy of a session's turns, oldest first"""
+        if not session_id:
+            return []
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            session = self._sessions.get(session_id)
+            if not session:
+                return []
+            self._touch(session_id, session)
+            return list(session.turns)
+
+    def add_turn(self, session_id, question, answer):
+        """Record an exchange for a session"""
+        if not session_id:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(self.max_turns)
+                self._sessions[session_id] = session
+            self._touch(session_id, session)
+            self._size += session.add_turn(question, answer)
+            self._enforce_limits(keep=session_id)
+
+    def format_history(self, session_id, max_tokens=1000):
+        """Format the most recent exchanges that fit in a token budget, oldest first"""
+        lines = []
+        used = 0
+        for turn in reversed(self.get_turns(session_id)):
+            text = f"Q: {turn['question']}\nA: {turn['answer']}"
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                break
+            lines.append(text)
+            used += tokens
+        return "\n".join(reversed(lines))
+
+    def clear(self, session_id):
+        """Forget a session"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session:
+                self._size -= session.size
+
+    def stats(self):
+        """Session counts and memory use for health reporting"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+    def _touch(self, session_id, session):
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+
+    def _evict_expired(self, now):
+        """Drop idle sessions, oldest first (caller holds the lock)"""
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.ttl_seconds:
+                break
+            self._drop(session_id)
+
+    def _enforce_limits(self, keep):
+        """Drop least recently used sessions until under the caps (caller holds the lock)"""
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._size > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._size -= session.size
+        self._evictions += 1
+
+
+class SharedSessionStore(SessionStore):
+    """Conversation state kept in a shared StateBackend, so any worker can continue a session
+
+    Each session is a list of JSON turns trimmed to max_turns and expiring
+    ttl_seconds after its last turn. The total memory cap is left to the
+    backend (e.g. Redis maxmemory). Turns the backend cannot take are kept in
+    a LocalState of up to max_sessions sessions and moved to the backend with
+    the session's next turn once it is reachable again.
+    """
+
+    def __init__(self, state, max_turns=10, ttl_seconds=1800, max_sessions=1000):
+        super().__init__(max_turns=max_turns, ttl_seconds=ttl_seconds, max_sessions=max_sessions)
+        self.state = state
+        self.local = LocalState(max_keys=max_sessions)
+        self._stats = {"reads": 0, "writes": 0, "local_reads": 0, "local_writes": 0}
+
+    def get_turns(self, session_id):
+        """Return a session's turns, oldest first"""
+        if not session_id:
+            return []
+        key = f"session:{session_id}"
+        items = self.state.items(key)
+        pending = self.local.items(key)
+        with self._lock:
+            self._stats["reads" if items is not None else "local_reads"] += 1
+        turns = []
+        for item in ((items or []) + pending)[-self.max_turns:]:
+            try:
+                turns.append(json.loads(item))
+            except ValueError:
+                logger.warning(f"Skipping unreadable turn in session {session_id}")
+        return turns
+
+    def add_turn(self, session_id, question, answer):
+        """Record an exchange for a session"""
+        if not session_id:
+            return
+        key = f"session:{session_id}"
+        turn = json.dumps({"question": question, "answer": answer}).encode("utf-8")
+        # Turns kept locally during an outage go first, so the backend keeps them in order
+        turns = self.local.items(key) + [turn]
+        self.local.delete(key)
+        for i, item in enumerate(turns):
+            if not self.state.push(key, item, max_len=self.max_turns, ttl=self.ttl_seconds):
+                for item in turns[i:]:
+                    self.local.push(key, item, max_len=self.max_turns, ttl=self.ttl_seconds)
+                with self._lock:
+                    self._stats["local_writes"] += 1
+                return
+        with self._lock:
+            self._stats["writes"] += 1
+
+    def clear(self, session_id):
+        """Forget a session"""
+        self.state.delete(f"session:{session_id}")
+        self.local.delete(f"session:{session_id}")
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "shared": True, "ttl_seconds": self.ttl_seconds,
+                    "local_sessions": self.local.stats()["keys"]}
@@ -0,0 +1,388 @@
+"""
+State shared by every worker process serving the API.
+
+Conversation sessions, the answer/TTS/embedding caches, stored answer audio
+and rate-limit counters can be kept in a StateBackend instead of only inside
+one process. LocalState keeps them in this process (one worker, or tests);
+RedisState speaks the Redis protocol to a server every gunicorn worker and
+node connects to. Values are bytes; keys are namespaced with a prefix so
+several deployments can share one server.
+
+A shared backend that cannot be reached degrades to cache misses rather
+than failing requests: errors are logged and counted in stats(), and the
+server is skipped for a few seconds before one call probes it again.
+"""
+
+import os
+import socket
+import threading
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """Key-value operations the shared stores need
+
+    get/set/delete work on byte values with an optional time to live.
+    incr adds to a counter, starting its ttl when it is created (fixed-window
+    rate limits). push appends to a list keeping only its last max_len items
+    and renews its ttl, returning whether it was stored, and items returns the
+    whole list, or None if it could not be read (sessions).
+    """
+
+    # Whether other processes see the same state
+    shared = False
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        raise NotImplementedError
+
+    def push(self, key, value, max_len=None, ttl=None):
+        raise NotImplementedError
+
+    def items(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LocalState(StateBackend):
+    """In-process state, least recently used keys dropped beyond max_keys"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        """The entry's value if present and not expired (caller holds the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value, ttl, now):
+        self._entries[key] = (value, now + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key, time.monotonic())
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._put(key, bytes(value), ttl, time.monotonic())
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            current = self._live(key, now)
+            if current is None:
+                self._put(key, amount, ttl, now)
+                return amount
+            expires_at = self._entries[key][1]
+            self._entries[key] = (current + amount, expires_at)
+            return current + amount
+
+    def push(self, key, value, max_len=None, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._live(key, now) or ()) + [bytes(value)]
+            self._put(key, tuple(items[-max_len:] if max_len else items), ttl, now)
+        return True
+
+    def items(self, key):
+        with self._lock:
+            return list(self._live(key, time.monotonic()) or ())
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "local", "keys": len(self._entries)}
+
+
+class RedisError(Exception):
+    """An error reply from the server"""
+
+
+class RedisState(StateBackend):
+    """Redis-protocol (RESP2) client with a small pool of connections
+
+    Only the handful of commands the stores need are used, so any server that
+    speaks the protocol works, including the stand-in in stubs.py.
+    """
+
+    shared = True
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, prefix="medical-assistant:",
+                 timeout=1.0, max_idle=8, retry_seconds=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.retry_seconds = retry_seconds
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # While set, calls skip the server until this time instead of each waiting out the timeout
+        self._down_until = None
+        self._stats = {"commands": 0, "errors": 0, "skipped": 0, "connections": 0}
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """redis://[:password@]host[:port][/db]"""
+        parts = urlsplit(url)
+        if parts.scheme != "redis":
+            raise ValueError(f"Unsupported state URL scheme '{parts.scheme}', expected redis://")
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=unquote(parts.password) if parts.password else None,
+            **kwargs
+        )
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        setup = ([["AUTH", self.password]] if self.password else []) + ([["SELECT", self.db]] if self.db else [])
+        try:
+            if setup:
+                self._exchange(connection, setup)
+        except Exception:
+            sock.close()
+            raise
+        with self._lock:
+            self._stats["connections"] += 1
+        return connection
+
+    def _acquire(self):
+        """(connection, whether it was pooled)"""
+        with self._lock:
+            # Connections opened before a fork belong to the parent process
+            if self._pid != os.getpid():
+                self._pid, self._idle = os.getpid(), []
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return
+        connection[0].close()
+
+    @staticmethod
+    def _encode(args):
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, int):
+                arg = str(arg).encode("ascii")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    @classmethod
+    def _read(cls, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            return RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [cls._read(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply {line[:32]!r}")
+
+    def _exchange(self, connection, commands):
+        """Send commands in one write and read one reply per command"""
+        sock, reader = connection
+        sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _allow(self):
+        """Whether a call may reach the server; after a failure only one probe per retry_seconds does"""
+        now = time.monotonic()
+        with self._lock:
+            if self._down_until is None:
+                return True
+            if now < self._down_until:
+                self._stats["skipped"] += 1
+                return False
+            # This call probes the server; the others keep skipping until it answers
+            self._down_until = now + self.retry_seconds
+            return True
+
+    def pipeline(self, *commands, default=None):
+        """Run commands in one round trip; returns their replies, or default if the server is unreachable"""
+        if not self._allow():
+            return default
+        with self._lock:
+            self._stats["commands"] += len(commands)
+        while True:
+            try:
+                connection, pooled = self._acquire()
+            except (OSError, RedisError) as e:
+                return self._failed(e, default)
+            try:
+                replies = self._exchange(connection, commands)
+            except (OSError, RedisError) as e:
+                # The reply stream may be out of step now, so never reuse this connection
+                connection[0].close()
+                if pooled and isinstance(e, OSError):
+                    # An idle connection the server has since closed; retry on a fresh one
+                    continue
+                return self._failed(e, default)
+            self._release(connection)
+            if self._down_until is not None:
+                with self._lock:
+                    self._down_until = None
+                logger.info(f"Shared state at {self.host}:{self.port} reachable again")
+            return replies
+
+    def _failed(self, error, default):
+        with self._lock:
+            self._stats["errors"] += 1
+            errors = self._stats["errors"]
+            self._down_until = time.monotonic() + self.retry_seconds
+        # Log the first failure and then every 100th, so an outage does not flood the log
+        if errors == 1 or errors % 100 == 0:
+            logger.warning(f"Shared state at {self.host}:{self.port} unavailable ({errors} errors): {error}")
+        return default
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def get(self, key):
+        return self.pipeline(["GET", self._key(key)], default=[None])[0]
+
+    def set(self, key, value, ttl=None):
+        command = ["SET", self._key(key), bytes(value)]
+        if ttl:
+            command += ["PX", int(ttl * 1000)]
+        self.pipeline(command)
+
+    def delete(self, key):
+        self.pipeline(["DEL", self._key(key)])
+
+    def incr(self, key, amount=1, ttl=None):
+        key = self._key(key)
+        count = self.pipeline(["INCRBY", key, amount], default=[None])[0]
+        if count == amount and ttl:
+            # First increment of this window; a lost PEXPIRE only makes the window longer
+            self.pipeline(["PEXPIRE", key, int(ttl * 1000)])
+        return count
+
+    def push(self, key, value, max_len=None, ttl=None):
+        key = self._key(key)
+        commands = [["RPUSH", key, bytes(value)]]
+        if max_len:
+            commands.append(["LTRIM", key, -max_len, -1])
+        if ttl:
+            commands.append(["PEXPIRE", key, int(ttl * 1000)])
+        return self.pipeline(*commands) is not None
+
+    def items(self, key):
+        replies = self.pipeline(["LRANGE", self._key(key), 0, -1])
+        return None if replies is None else replies[0] or []
+
+    def ping(self):
+        return self.pipeline(["PING"], default=[None])[0] == "PONG"
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "redis", "server": f"{self.host}:{self.port}/{self.db}", "idle_connections": len(self._idle),
+                    **self._stats}
+
+
+def state_from_env(env=None):
+    """The backend selected by STATE_BACKEND (local or redis) and STATE_URL"""
+    env = os.environ if env is None else env
+    backend = (env.get("STATE_BACKEND") or "local").lower()
+    if backend == "redis":
+        url = env.get("STATE_URL") or "redis://localhost:6379/0"
+        state = RedisState.from_url(
+            url,
+            prefix=env.get("STATE_PREFIX") or "medical-assistant:",
+            timeout=float(env.get("STATE_TIMEOUT_MS") or 1000) / 1000,
+            retry_seconds=float(env.get("STATE_RETRY_SECONDS") or 5)
+        )
+        logger.info(f"Sharing sessions and caches through {state.host}:{state.port}")
+        return state
+    if backend != "local":
+        logger.warning(f"Unknown STATE_BACKEND '{backend}', using local")
+    return LocalState()
+
+
+class RateLimiter:
+    """Fixed-window request limit per client, counted in a (possibly shared) StateBackend"""
+
+    def __init__(self, state, limit=0, window_seconds=60):
+        self.state = state
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "limited": 0}
+
+    def check(self, client):
+        """0 when the client may proceed, otherwise seconds until its window resets"""
+        if self.limit <= 0:
+            return 0
+        now = time.time()
+        window = int(now // self.window_seconds)
+        count = self.state.incr(f"rate:{client}:{window}", ttl=self.window_seconds)
+        # An unreachable backend yields None; fail open rather than turning an outage into 429s
+        allowed = count is None or count <= self.limit
+        with self._lock:
+            self._stats["allowed" if allowed else "limited"] += 1
+        if allowed:
+            return 0
+        return max(1, int((window + 1) * self.window_seconds - now + 0.999))
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "limit": self.limit, "window_seconds": self.window_seconds}
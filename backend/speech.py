@@ -0,0 +1,613 @@
+"""
+Pluggable speech-to-text and text-to-speech backends.
+
+Every backend streams its output: STT backends yield transcript segments and
+TTS backends yield audio chunks. Backends are created by name from a registry,
+so local engines (faster-whisper, Piper) can replace or back up the hosted
+vendors through configuration, and a BackendChain orders them by their recent
+failure rate and latency.
+"""
+
+import io
+import os
+import queue
+import threading
+import time
+import wave
+import logging
+from collections import deque
+
+from audio_preprocess import wav_header
+
+logger = logging.getLogger(__name__)
+
+# Use a professional, clear voice for medical context
+ELEVENLABS_VOICE_ID = "21m00Tcm4TlvDq8ikWAM"  # Rachel - professional female voice
+# ElevenLabs output_format for each audio format we serve ("wav" is raw PCM we add a header to)
+ELEVENLABS_OUTPUT_FORMATS = {
+    "mp3": "mp3_22050_32",
+    "opus": "opus_48000_32",
+    "wav": "pcm_16000",
+}
+ELEVENLABS_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.8,
+    "style": 0.2,
+    "use_speaker_boost": True,
+}
+
+# Formats synthesized answers can be delivered in, and their MIME types
+AUDIO_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg", "wav": "audio/wav"}
+
+AUDIO_EXTENSIONS = {"audio/mpeg": ".mp3", "audio/wav": ".wav", "audio/ogg": ".ogg"}
+
+
+class AudioBuffer(io.BytesIO):
+    """In-memory audio that remembers its MIME type"""
+
+    def __init__(self, data=b"", mimetype="audio/mpeg"):
+        super().__init__(data)
+        self.mimetype = mimetype
+
+    @property
+    def extension(self):
+        return AUDIO_EXTENSIONS.get(self.mimetype, ".bin")
+
+
+class NoBackendAvailable(Exception):
+    """Raised when every backend in a chain failed"""
+
+
+# -- Speech-to-text -----------------------------------------------------------
+
+class STTBackend:
+    """Base class: transcribe_stream() yields transcript segments for an in-memory recording"""
+
+    name = None
+
+    def transcribe_stream(self, data, filename, mimetype):
+        raise NotImplementedError
+
+
+class OpenAIWhisperSTT(STTBackend):
+    name = "openai"
+
+    def __init__(self, client, model="whisper-1"):
+        self.client = client
+        self.model = model
+
+    @classmethod
+    def from_env(cls, env, openai_client=None, http=None, **deps):
+        if openai_client is None:
+            import openai
+            pooled = {"http_client": http.client, "timeout": http.httpx_timeout} if http is not None else {}
+            openai_client = openai.OpenAI(api_key=env.get('OPENAI_API_KEY'), **pooled)
+        return cls(openai_client, env.get('OPENAI_STT_MODEL', 'whisper-1'))
+
+    def transcribe_stream(self, data, filename, mimetype):
+        transcript = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=(filename, data, mimetype)
+        )
+        yield transcript.text
+
+
+class FasterWhisperSTT(STTBackend):
+    """Local CTranslate2 Whisper on CPU; segments are yielded as they are decoded"""
+
+    name = "faster-whisper"
+
+    def __init__(self, model_size="base.en", device="cpu", compute_type="int8", cpu_threads=0, num_workers=1, language="en"):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(
+            model_size,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=cpu_threads,
+            num_workers=num_workers
+        )
+        self.language = language
+        logger.info(f"Loaded faster-whisper model {model_size} on {device} ({compute_type})")
+
+    @classmethod
+    def from_env(cls, env, **deps):
+        return cls(
+            model_size=env.get('FASTER_WHISPER_MODEL', 'base.en'),
+            device=env.get('FASTER_WHISPER_DEVICE', 'cpu'),
+            compute_type=env.get('FASTER_WHISPER_COMPUTE_TYPE', 'int8'),
+            cpu_threads=int(env.get('FASTER_WHISPER_THREADS', '0')),
+            num_workers=int(env.get('FASTER_WHISPER_WORKERS', '1')),
+            language=env.get('FASTER_WHISPER_LANGUAGE') or None
+        )
+
+    def transcribe_stream(self, data, filename, mimetype):
+        segments, _ = self.model.transcribe(io.BytesIO(data), language=self.language, beam_size=1, vad_filter=True)
+        for segment in segments:
+            yield segment.text
+
+
+# -- Text-to-speech -----------------------------------------------------------
+
+class TTSBackend:
+    """Base class: stream() yields audio chunks for a piece of text in one of the formats it produces natively"""
+
+    name = None
+    formats = ("mp3",)
+
+    def output_format(self, audio_format=None):
+        """The requested format if this backend produces it, otherwise its preferred one"""
+        return audio_format if audio_format in self.formats else self.formats[0]
+
+    def cache_params(self, latency="0", audio_format="mp3"):
+        """(voice, output_format, settings) identifying the audio this backend produces"""
+        raise NotImplementedError
+
+    def stream(self, text, latency="0", audio_format="mp3"):
+        raise NotImplementedError
+
+
+class ElevenLabsTTS(TTSBackend):
+    name = "elevenlabs"
+    formats = ("mp3", "opus", "wav")
+
+    def __init__(self, client, voice_id=ELEVENLABS_VOICE_ID, output_formats=ELEVENLABS_OUTPUT_FORMATS, voice_settings=ELEVENLABS_VOICE_SETTINGS):
+        self.client = client
+        self.voice_id = voice_id
+        self.output_formats = output_formats
+        self.voice_settings = voice_settings
+
+    @classmethod
+    def from_env(cls, env, http=None, **deps):
+        if not env.get('ELEVENLABS_API_KEY'):
+            logger.info("No ElevenLabs API key found, skipping ElevenLabs TTS")
+            return None
+        from elevenlabs import ElevenLabs
+        pooled = {"httpx_client": http.client, "timeout": http.timeout} if http is not None else {}
+        return cls(ElevenLabs(api_key=env.get('ELEVENLABS_API_KEY'), **pooled))
+
+    def cache_params(self, latency="0", audio_format="mp3"):
+        return self.voice_id, self.output_formats[audio_format], {**self.voice_settings, "optimize_streaming_latency": latency}
+
+    def _convert(self, text, latency, output_format):
+        from elevenlabs import VoiceSettings
+        # Generate speech with natural settings
+        return self.client.text_to_speech.convert(
+            voice_id=self.voice_id,
+            optimize_streaming_latency=latency,
+            output_format=output_format,
+            text=text,
+            voice_settings=VoiceSettings(**self.voice_settings),
+        )
+
+    def stream(self, text, latency="0", audio_format="mp3"):
+        chunks = self._convert(text, latency, self.output_formats[audio_format])
+        if audio_format != "wav":
+            yield from chunks
+            return
+        # The header goes out with the first PCM chunk: yielding it earlier would count as
+        # first output, committing the chain to a request that may still fail
+        header = wav_header(16000)
+        for chunk in chunks:
+            yield header + chunk if header else chunk
+            header = b""
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def __init__(self, lang="en"):
+        self.lang = lang
+
+    @classmethod
+    def from_env(cls, env, **deps):
+        return cls(env.get('GTTS_LANG', 'en'))
+
+    def cache_params(self, latency="0", audio_format="mp3"):
+        return self.lang, "mp3", {"slow": False}
+
+    def stream(self, text, latency="0", audio_format="mp3"):
+        from gtts import gTTS
+        yield from gTTS(text=text, lang=self.lang, slow=False).stream()
+
+
+class PiperTTS(TTSBackend):
+    """Offline neural TTS on CPU; synthesizes each call to a single WAV chunk"""
+
+    name = "piper"
+    formats = ("wav",)
+
+    def __init__(self, model_path, speaker_id=None):
+        from piper.voice import PiperVoice
+        self.model_path = model_path
+        self.speaker_id = speaker_id
+        self.voice = PiperVoice.load(model_path)
+        logger.info(f"Loaded Piper voice {model_path}")
+
+    @classmethod
+    def from_env(cls, env, **deps):
+        model_path = env.get('PIPER_MODEL')
+        if not model_path:
+            logger.info("PIPER_MODEL not set, skipping Piper TTS")
+            return None
+        speaker_id = env.get('PIPER_SPEAKER_ID')
+        return cls(model_path, int(speaker_id) if speaker_id else None)
+
+    def cache_params(self, latency="0", audio_format="wav"):
+        return os.path.basename(self.model_path), "wav", {"speaker_id": self.speaker_id}
+
+    def stream(self, text, latency="0", audio_format="wav"):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            self.voice.synthesize(text, wav_file, speaker_id=self.speaker_id)
+        yield buffer.getvalue()
+
+
+STT_BACKENDS = {
+    "openai": OpenAIWhisperSTT.from_env,
+    "faster-whisper": FasterWhisperSTT.from_env,
+}
+
+TTS_BACKENDS = {
+    "elevenlabs": ElevenLabsTTS.from_env,
+    "gtts": GTTSBackend.from_env,
+    "piper": PiperTTS.from_env,
+}
+
+
+def build_backends(names, registry, env=None, **deps):
+    """Instantiate the named backends, skipping unknown names and engines that fail to load"""
+    env = os.environ if env is None else env
+    if isinstance(names, str):
+        names = [name.strip().lower() for name in names.split(",") if name.strip()]
+
+    backends = []
+    for name in names:
+        factory = registry.get(name)
+        if factory is None:
+            logger.warning(f"Unknown speech backend '{name}', expected one of {sorted(registry)}")
+            continue
+        try:
+            backend = factory(env, **deps)
+        except Exception as e:
+            logger.warning(f"Speech backend '{name}' unavailable: {e}")
+            continue
+        if backend is not None:
+            backends.append(backend)
+    return backends
+
+
+# -- Dispatch: health ordering, timeouts, circuit breaking and hedging ----------
+
+class BackendStats:
+    """Exponentially weighted latency (time to first output) and failure rate, plus recent latency samples"""
+
+    def __init__(self, alpha=0.2, window=200):
+        self.alpha = alpha
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latency = None
+        self.failure_rate = 0.0
+        self.last_call = None
+        self.recent = deque(maxlen=window)
+
+    def record_success(self, latency):
+        self.calls += 1
+        self.last_call = time.monotonic()
+        self.recent.append(latency)
+        self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+        self.failure_rate -= self.alpha * self.failure_rate
+
+    def record_failure(self, new_call=True):
+        # A stream that fails after its first chunk was already counted as a call
+        self.calls += new_call
+        self.failures += 1
+        self.last_call = time.monotonic()
+        self.failure_rate += self.alpha * (1.0 - self.failure_rate)
+
+    def percentile(self, q):
+        """Latency percentile over the recent window, or None without samples"""
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failure_rate": round(self.failure_rate, 3),
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after reset_timeout a single probe call may close it again"""
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def allow(self, now):
+        """Whether a call may start; moving from open to half-open lets exactly one probe through"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= self.reset_timeout:
+            self.state = "half-open"
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def release_probe(self):
+        """A probe was abandoned without an outcome, so the next call may probe instead"""
+        if self.state == "half-open":
+            self.state = "open"
+
+    def record_failure(self, now):
+        self.consecutive_failures += 1
+        if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = now
+
+
+class _Attempt:
+    """One backend call running on its own thread, feeding a queue shared by all attempts"""
+
+    def __init__(self, backend, call, events, timeout, hedged):
+        self.backend = backend
+        self.timeout = timeout
+        self.hedged = hedged
+        self.started = self.last_activity = time.monotonic()
+        self.emitted = False
+        self.cancelled = threading.Event()
+        self._events = events
+        self._call = call
+        threading.Thread(target=self._run, daemon=True, name=f"speech-{backend.name}").start()
+
+    def _run(self):
+        try:
+            for chunk in self._call(self.backend):
+                if self.cancelled.is_set():
+                    return
+                self._events.put((self, "chunk", chunk))
+            self._events.put((self, "done", None))
+        except Exception as e:
+            self._events.put((self, "error", e))
+
+    def deadline(self):
+        return self.last_activity + self.timeout if self.timeout else None
+
+
+class BackendChain:
+    """Runs a call against the healthiest available backend, with timeouts, circuit breakers and hedging
+
+    Backends keep their configured priority while healthy. One whose recent
+    failure rate or first-output latency is over budget drops behind the healthy
+    ones until its stats go stale (no calls for stale_after seconds). A backend
+    whose circuit breaker is open is skipped entirely until its probe is due.
+
+    Each wait for output from a backend is bounded by its timeout. With hedging
+    on, if the backend in flight has produced nothing after its hedge_percentile
+    first-output latency, the next backend is started as well and whichever
+    produces output first wins; the other is cancelled.
+    """
+
+    def __init__(self, kind, backends, latency_budget=None, max_failure_rate=0.5, stale_after=60.0,
+                 timeouts=None, default_timeout=None, breaker_failures=3, breaker_reset=30.0,
+                 hedge_percentile=None, hedge_min_samples=20, hedge_min_delay=0.05):
+        self.kind = kind
+        self.backends = list(backends)
+        self.latency_budget = latency_budget
+        self.max_failure_rate = max_failure_rate
+        self.stale_after = stale_after
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self._stats = {backend.name: BackendStats() for backend in self.backends}
+        self._breakers = {backend.name: CircuitBreaker(backend.name, breaker_failures, breaker_reset) for backend in self.backends}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, kind, backends, env=None):
+        """Chain configured by <KIND>_* variables, e.g. TTS_TIMEOUT_MS and TTS_TIMEOUT_MS_ELEVENLABS"""
+        env = os.environ if env is None else env
+        prefix = kind.upper()
+
+        def seconds(name, default="0"):
+            return float(env.get(f"{prefix}_{name}") or default) / 1000 or None
+
+        timeouts = {}
+        for backend in backends:
+            timeout = seconds(f"TIMEOUT_MS_{backend.name.upper().replace('-', '_')}")
+            if timeout:
+                timeouts[backend.name] = timeout
+        hedge_percentile = float(env.get(f"{prefix}_HEDGE_PERCENTILE") or 0) or None
+
+        return cls(
+            kind,
+            backends,
+            latency_budget=seconds("LATENCY_BUDGET_MS"),
+            timeouts=timeouts,
+            default_timeout=seconds("TIMEOUT_MS"),
+            breaker_failures=int(env.get(f"{prefix}_BREAKER_FAILURES") or 3),
+            breaker_reset=float(env.get(f"{prefix}_BREAKER_RESET_SECONDS") or 30),
+            hedge_percentile=hedge_percentile
+        )
+
+    def _healthy(self, stats, now):
+        if stats.last_call is None or now - stats.last_call > self.stale_after:
+            return True
+        if stats.failure_rate >= self.max_failure_rate:
+            return False
+        return not self.latency_budget or stats.latency is None or stats.latency <= self.latency_budget
+
+    def ordered(self):
+        """Healthy backends in configured order, then the rest from least to most degraded"""
+        now = time.monotonic()
+        with self._lock:
+            healthy, degraded = [], []
+            for backend in self.backends:
+                stats = self._stats[backend.name]
+                (healthy if self._healthy(stats, now) else degraded).append((backend, stats))
+        degraded.sort(key=lambda item: (item[1].failure_rate, item[1].latency or 0.0))
+        return [backend for backend, _ in healthy + degraded]
+
+    def _hedge_delay(self, backend):
+        """How long to wait for first output before hedging, or None to not hedge yet"""
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            stats = self._stats[backend.name]
+            if len(stats.recent) < self.hedge_min_samples:
+                return None
+            return max(self.hedge_min_delay, stats.percentile(self.hedge_percentile))
+
+    def _record_failure(self, attempt, timed_out=False):
+        with self._lock:
+            stats = self._stats[attempt.backend.name]
+            stats.record_failure(new_call=not attempt.emitted)
+            stats.timeouts += timed_out
+            self._breakers[attempt.backend.name].record_failure(time.monotonic())
+
+    def _abandon(self, attempt):
+        attempt.cancelled.set()
+        with self._lock:
+            self._breakers[attempt.backend.name].release_probe()
+
+    def _record_first_output(self, attempt):
+        with self._lock:
+            stats = self._stats[attempt.backend.name]
+            stats.record_success(time.monotonic() - attempt.started)
+            stats.hedge_wins += attempt.hedged
+            self._breakers[attempt.backend.name].record_success()
+
+    def stream(self, call):
+        """Yield (backend, chunk) from the first backend to produce output
+
+        call(backend) must return an iterator of output chunks. A backend that
+        fails or times out before producing output is replaced by the next one;
+        once output has been yielded the chain is committed to that backend, and
+        its failure is raised since the caller has already consumed part of it.
+        """
+        candidates = iter(self.ordered())
+        events = queue.Queue()
+        running = []
+        errors = []
+        winner = None
+        can_hedge = True
+
+        def launch(hedged=False):
+            for backend in candidates:
+                with self._lock:
+                    allowed = self._breakers[backend.name].allow(time.monotonic())
+                    if allowed and hedged:
+                        self._stats[backend.name].hedges += 1
+                if not allowed:
+                    errors.append(f"{backend.name}: circuit open")
+                    continue
+                timeout = self.timeouts.get(backend.name, self.default_timeout)
+                running.append(_Attempt(backend, call, events, timeout, hedged))
+                return True
+            return False
+
+        def give_up():
+            raise NoBackendAvailable(f"All {self.kind} backends failed: {'; '.join(errors) or 'none configured'}")
+
+        if not launch():
+            give_up()
+
+        try:
+            while True:
+                now = time.monotonic()
+                deadlines = [attempt.deadline() for attempt in running if attempt.deadline()]
+                hedge_at = None
+                if winner is None and can_hedge:
+                    newest = running[-1]
+                    delay = self._hedge_delay(newest.backend)
+                    if delay is not None:
+                        hedge_at = newest.started + delay
+                        deadlines.append(hedge_at)
+                wait = max(0.0, min(deadlines) - now) if deadlines else None
+
+                try:
+                    attempt, kind, payload = events.get(timeout=wait)
+                except queue.Empty:
+                    now = time.monotonic()
+                    for attempt in list(running):
+                        if attempt.deadline() and now >= attempt.deadline():
+                            attempt.cancelled.set()
+                            running.remove(attempt)
+                            self._record_failure(attempt, timed_out=True)
+                            if attempt is winner:
+                                raise TimeoutError(f"{attempt.backend.name} stalled for {attempt.timeout:.1f}s mid-stream")
+                            logger.warning(f"{self.kind.upper()} backend {attempt.backend.name} timed out after {attempt.timeout:.1f}s")
+                            errors.append(f"{attempt.backend.name}: timed out")
+                    if winner is None and not running:
+                        if not launch():
+                            give_up()
+                    elif winner is None and hedge_at is not None and now >= hedge_at:
+                        if launch(hedged=True):
+                            logger.info(f"Hedging slow {self.kind} backend {running[-2].backend.name} with {running[-1].backend.name}")
+                        else:
+                            can_hedge = False
+                    continue
+
+                if attempt not in running:
+                    # Output from an attempt that was already cancelled or timed out
+                    continue
+                attempt.last_activity = time.monotonic()
+
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        attempt.emitted = True
+                        self._record_first_output(attempt)
+                        for other in running:
+                            if other is not attempt:
+                                self._abandon(other)
+                        running[:] = [attempt]
+                    yield attempt.backend, payload
+                elif kind == "done" and attempt is winner:
+                    return
+                else:
+                    running.remove(attempt)
+                    self._record_failure(attempt)
+                    error = payload if kind == "error" else NoBackendAvailable(f"{attempt.backend.name} returned no output")
+                    if attempt is winner:
+                        raise error
+                    logger.warning(f"{self.kind.upper()} backend {attempt.backend.name} failed: {error}")
+                    errors.append(f"{attempt.backend.name}: {error}")
+                    if not running and not launch():
+                        give_up()
+        finally:
+            # The consumer stopped early or we gave up: let abandoned threads exit at their next chunk
+            for attempt in running:
+                self._abandon(attempt)
+
+    def stats(self):
+        """Per-backend stats, in the order the next call would try them"""
+        order = [backend.name for backend in self.ordered()]
+        with self._lock:
+            return {
+                "order": order,
+                "backends": {
+                    name: {**self._stats[name].snapshot(), "circuit": self._breakers[name].state}
+                    for name in order
+                }
+            }
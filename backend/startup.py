@@ -0,0 +1,151 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Initializes named subsystems lazily and concurrently
+
+    Each subsystem is a zero-argument function registered with add(). It runs on
+    a background thread either when start() warms everything up or the first
+    time get() asks for it. A subsystem that needs another simply calls get()
+    for it. A failed initializer is logged and yields None, matching how the
+    assistant already treats unavailable components.
+    """
+
+    def __init__(self, max_workers=8):
+        self._tasks = {}
+        self._futures = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+
+    def add(self, name, initializer):
+        self._tasks[name] = initializer
+
+    def _run(self, name):
+        started = time.monotonic()
+        try:
+            result = self._tasks[name]()
+        except Exception as e:
+            logger.error(f"Failed to initialize {name}: {e}")
+            raise
+        finally:
+            self._timings[name] = time.monotonic() - started
+        logger.info(f"Initialized {name} in {self._timings[name] * 1000:.0f} ms")
+        return result
+
+    def _future(self, name):
+        with self._lock:
+            if name not in self._futures:
+                self._futures[name] = self._executor.submit(self._run, name)
+            return self._futures[name]
+
+    def start(self):
+        """Begin initializing every subsystem in the background"""
+        for name in self._tasks:
+            self._future(name)
+
+    def preload(self, names):
+        """Initialize subsystems one after another on the calling thread
+
+        Meant for a pre-fork master process: no executor threads are started
+        (they would not survive the fork), so each subsystem may only get()
+        subsystems preloaded before it.
+        """
+        for name in names:
+            future = Future()
+            try:
+                future.set_result(self._run(name))
+            except Exception as e:
+                future.set_exception(e)
+            with self._lock:
+                self._futures[name] = future
+
+    def get(self, name, timeout=None):
+        """Wait for a subsystem, starting it if needed; None if it failed"""
+        try:
+            return self._future(name).result(timeout)
+        except Exception:
+            return None
+
+    def peek(self, name):
+        """A subsystem if it is already initialized, without waiting or starting it"""
+        future = self._futures.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def status(self):
+        """pending / ready / failed for every subsystem, with init times once finished"""
+        status = {}
+        for name in self._tasks:
+            future = self._futures.get(name)
+            if future is None or not future.done():
+                state = "pending"
+            elif future.exception() is not None:
+                state = "failed"
+            else:
+                state = "ready"
+            status[name] = {"state": state}
+            if name in self._timings:
+                status[name]["init_ms"] = round(self._timings[name] * 1000)
+        return status
+
+
+class RefreshingValue:
+    """Caches the result of a slow (network) call and refreshes it in the background
+
+    get() blocks only for the very first load. peek() never blocks: it returns the
+    last known value and, when that value is older than refresh_interval, kicks
+    off a single background refresh.
+    """
+
+    def __init__(self, loader, refresh_interval=300.0):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self.value = None
+        self.loaded_at = None
+        self.error = None
+        self._attempted_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self._attempted_at = time.monotonic()
+        try:
+            value = self.loader()
+            with self._lock:
+                self.value, self.loaded_at, self.error = value, time.monotonic(), None
+        except Exception as e:
+            logger.warning(f"Refresh failed: {e}")
+            with self._lock:
+                self.error = str(e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self.value
+
+    def get(self):
+        if self.loaded_at is None:
+            return self._load()
+        return self.peek()
+
+    def peek(self):
+        with self._lock:
+            # Failed loads are retried on the same schedule, so an outage is not hammered
+            stale = self._attempted_at is None or time.monotonic() - self._attempted_at > self.refresh_interval
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._load, daemon=True).start()
+            return self.value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "age_seconds": round(time.monotonic() - self.loaded_at) if self.loaded_at is not None else None,
+                "error": self.error,
+            }
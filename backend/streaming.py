@@ -0,0 +1,95 @@
+import queue
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Whitespace that follows sentence-ending punctuation
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])["\')\]]*\s+')
+
+# Abbreviations that end in a period but do not end a sentence
+ABBREVIATIONS = {"dr.", "mr.", "mrs.", "ms.", "vs.", "e.g.", "i.e.", "approx.", "no.", "st."}
+
+_DONE = object()
+
+
+def iter_sentences(tokens, min_chars=20):
+    """Group a stream of LLM tokens into sentences as soon as each one is complete"""
+    buffer = ""
+    for token in tokens:
+        if not token:
+            continue
+        buffer += token
+
+        search_from = 0
+        while True:
+            match = SENTENCE_BOUNDARY.search(buffer, search_from)
+            if not match:
+                break
+            sentence = buffer[:match.start()].strip()
+            last_word = sentence.rsplit(None, 1)[-1].lower() if sentence else ""
+            # Keep very short fragments and abbreviations attached to the next sentence
+            if len(sentence) < min_chars or last_word in ABBREVIATIONS:
+                search_from = match.end()
+                continue
+            yield sentence
+            buffer = buffer[match.end():]
+            search_from = 0
+
+    remainder = buffer.strip()
+    if remainder:
+        yield remainder
+
+
+def stream_speech(sentences, synthesize, max_pending=4):
+    """Synthesize each sentence while the following ones are still being generated
+
+    Sentences are pulled on a background thread so LLM generation keeps going while
+    TTS runs for the current sentence. Yields event dicts:
+    {"type": "sentence", "index", "text"} followed by {"type": "audio", "index", "data"}
+    for each audio chunk of that sentence.
+    """
+    pending = queue.Queue(maxsize=max_pending)
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up if the consumer went away (e.g. the client disconnected)
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for sentence in sentences:
+                if not put(sentence):
+                    return
+        except Exception as e:
+            logger.error(f"Error generating streamed response: {e}")
+            put(e)
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name="sentence-producer", daemon=True)
+    producer.start()
+
+    try:
+        index = 0
+        while True:
+            item = pending.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            yield {"type": "sentence", "index": index, "text": item}
+            for chunk in synthesize(item):
+                if chunk:
+                    yield {"type": "audio", "index": index, "data": chunk}
+            index += 1
+    finally:
+        stopped.set()
@@ -0,0 +1,508 @@
+"""
+Offline stand-ins for the LLM, speech, embedding and vector store vendors that
+emit output on a timer or replay recorded latencies, used to measure pipeline
+latency without network access
+"""
+
+import io
+import json
+import re
+import random
+import socket
+import socketserver
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+
+from keyword_index import tokenize
+from metrics import span
+from shared_state import LocalState
+from speech import ElevenLabsTTS
+from streaming import iter_sentences, stream_speech
+
+SAMPLE_ANSWER = (
+    "Emily Rivera is a 29 year old female seen on June 10, 2025. "
+    "She reports persistent fatigue, dizziness and weight loss over the past three weeks. "
+    "Her blood pressure was 100/65 mmHg with a pulse of 108 bpm. "
+    "The assessment is possible hyperthyroidism or another endocrine disorder. "
+    "A thyroid panel was ordered and follow-up is scheduled for June 17, 2025."
+)
+
+
+class StubLLM:
+    """Chat model stand-in whose stream() yields word tokens with fixed delays"""
+
+    def __init__(self, answer=SAMPLE_ANSWER, first_token_delay=0.4, token_delay=0.03):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    def stream(self, prompt):
+        time.sleep(self.first_token_delay)
+        for i, word in enumerate(self.answer.split(" ")):
+            if i:
+                time.sleep(self.token_delay)
+            yield SimpleNamespace(content=word if i == 0 else " " + word)
+
+    def invoke(self, prompt):
+        return SimpleNamespace(content="".join(chunk.content for chunk in self.stream(prompt)))
+
+
+class StubTTS:
+    """TTS stand-in that yields fake audio bytes proportional to the text length"""
+
+    def __init__(self, first_byte_delay=0.3, seconds_per_char=0.002, chunk_size=1024, bytes_per_char=200):
+        self.first_byte_delay = first_byte_delay
+        self.seconds_per_char = seconds_per_char
+        self.chunk_size = chunk_size
+        self.bytes_per_char = bytes_per_char
+
+    def __call__(self, text):
+        time.sleep(self.first_byte_delay)
+        total = len(text) * self.bytes_per_char
+        chunks = max(1, total // self.chunk_size)
+        delay = len(text) * self.seconds_per_char / chunks
+        for _ in range(chunks):
+            time.sleep(delay)
+            yield b"\0" * self.chunk_size
+
+
+class FakeSpeechBackend:
+    """Scripted STT/TTS backend: each call follows the next (delay, outcome) step, cycling through the script
+
+    An outcome is "ok", "error" (raise before output), "empty" (no output),
+    "stall" (sleep past any timeout before output) or "mid-error" (fail after
+    the first chunk).
+    """
+
+    formats = ("mp3",)
+
+    def __init__(self, name, script=((0.0, "ok"),), chunks=3, chunk_delay=0.0, stall_seconds=5.0):
+        self.name = name
+        self.script = list(script)
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.stall_seconds = stall_seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def output_format(self, audio_format=None):
+        return audio_format if audio_format in self.formats else self.formats[0]
+
+    def cache_params(self, latency="0", audio_format="mp3"):
+        return self.name, "fake", {}
+
+    def stream(self, text, latency="0", audio_format="mp3"):
+        with self._lock:
+            delay, outcome = self.script[self.calls % len(self.script)]
+            self.calls += 1
+        time.sleep(delay)
+        if outcome == "error":
+            raise RuntimeError(f"{self.name} unavailable")
+        if outcome == "empty":
+            return
+        if outcome == "stall":
+            time.sleep(self.stall_seconds)
+        for i in range(self.chunks):
+            if i:
+                time.sleep(self.chunk_delay)
+            if outcome == "mid-error" and i == 1:
+                raise RuntimeError(f"{self.name} dropped the stream")
+            yield f"{self.name}:{i};".encode()
+
+    def transcribe_stream(self, data, filename, mimetype):
+        for chunk in self.stream(data):
+            yield chunk.decode()
+
+
+class FakeElevenLabsTTS(ElevenLabsTTS):
+    """ElevenLabsTTS whose vendor calls follow a FakeSpeechBackend script, so its own stream() framing is exercised"""
+
+    def __init__(self, script=((0.0, "ok"),)):
+        super().__init__(client=None)
+        self.vendor = FakeSpeechBackend(self.name, script)
+
+    @property
+    def calls(self):
+        return self.vendor.calls
+
+    def _convert(self, text, latency, output_format):
+        return self.vendor.stream(text)
+
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Per-call latencies in milliseconds, as measured against the hosted services;
+# replace with recorded samples via LatencyProfile.load()
+DEFAULT_LATENCY_PROFILE = {
+    "stt": [620, 680, 710, 760, 820, 900, 1050, 1400, 2300],
+    "embedding": [70, 85, 95, 110, 130, 160, 240, 420],
+    "vector_search": [25, 30, 35, 40, 48, 60, 90, 180],
+    "llm_first_token": [320, 380, 420, 480, 560, 700, 950, 1600],
+    "llm_token": [12, 15, 18, 22, 30],
+    "tts_first_byte": [240, 280, 320, 360, 420, 520, 800],
+    "tts_chunk": [8, 12, 20],
+}
+
+
+class LatencyProfile:
+    """Replays recorded service latencies: each call sleeps for a sample drawn from that service's recordings"""
+
+    def __init__(self, samples=None, scale=1.0, seed=0):
+        self.samples = {**DEFAULT_LATENCY_PROFILE, **(samples or {})}
+        self.scale = scale
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Read {service: [milliseconds, ...]} recordings from a JSON file"""
+        with open(path, "r") as f:
+            return cls(json.load(f), **kwargs)
+
+    def sample(self, service):
+        with self._lock:
+            return self._random.choice(self.samples[service]) / 1000 * self.scale
+
+    def wait(self, service):
+        time.sleep(self.sample(service))
+
+
+class ReplaySTT:
+    """Whisper stand-in: the uploaded "audio" carries its transcript as UTF-8, padded with NUL bytes"""
+
+    def __init__(self, profile, name="openai"):
+        self.profile = profile
+        self.name = name
+
+    def transcribe_stream(self, data, filename, mimetype):
+        self.profile.wait("stt")
+        yield data.split(b"\0", 1)[0].decode("utf-8")
+
+
+def dictate(text, word_ms=350, gap_ms=80, sample_rate=16000):
+    """16 kHz mono 16-bit PCM standing in for a recording of text, one loud burst per word
+
+    Each burst starts with the word's characters as sample values, so
+    DictationSTT can read back whatever words a prefix of the recording holds.
+    """
+    word_samples = sample_rate * word_ms // 1000
+    gap = np.zeros(sample_rate * gap_ms // 1000, dtype="<i2")
+    parts = []
+    for word in text.split():
+        burst = np.full(word_samples, 8000, dtype="<i2")
+        codes = [1000 + ord(char) * 100 for char in word[:word_samples - 1]]
+        burst[:len(codes)] = codes
+        burst[len(codes)] = 0
+        parts += [burst, gap]
+    return b"".join(part.tobytes() for part in parts)
+
+
+class DictationSTT:
+    """Whisper stand-in for dictate() recordings (WAV): transcribes every word that has been spoken in full"""
+
+    def __init__(self, profile, word_ms=350, gap_ms=80, sample_rate=16000, name="openai"):
+        self.profile = profile
+        self.word_samples = sample_rate * word_ms // 1000
+        self.step = self.word_samples + sample_rate * gap_ms // 1000
+        self.name = name
+
+    def transcribe_stream(self, data, filename, mimetype):
+        self.profile.wait("stt")
+        samples = np.frombuffer(data[44:len(data) - len(data) % 2], dtype="<i2")
+        words = []
+        for start in range(0, len(samples) - self.word_samples + 1, self.step):
+            burst = samples[start:start + self.word_samples]
+            end = int(np.argmax(burst == 0)) if (burst == 0).any() else 0
+            words.append("".join(chr((int(value) - 1000) // 100) for value in burst[:end]))
+        yield " ".join(word for word in words if word)
+
+
+class ReplayTTS:
+    """ElevenLabs stand-in that streams fake MP3 bytes proportional to the text length"""
+
+    formats = ("mp3", "opus", "wav")
+
+    def __init__(self, profile, name="elevenlabs", chunk_size=4096, bytes_per_char=200):
+        self.profile = profile
+        self.name = name
+        self.chunk_size = chunk_size
+        self.bytes_per_char = bytes_per_char
+
+    def output_format(self, audio_format=None):
+        return audio_format if audio_format in self.formats else self.formats[0]
+
+    def cache_params(self, latency="0", audio_format="mp3"):
+        return self.name, audio_format, {"latency": latency}
+
+    def stream(self, text, latency="0", audio_format="mp3"):
+        self.profile.wait("tts_first_byte")
+        remaining = len(text) * self.bytes_per_char
+        while remaining > 0:
+            yield b"\0" * min(self.chunk_size, remaining)
+            remaining -= self.chunk_size
+            if remaining > 0:
+                self.profile.wait("tts_chunk")
+
+
+class ReplayEmbeddings:
+    """OpenAI embeddings stand-in: hashed bag-of-words vectors, so retrieval still favours matching terms"""
+
+    model = "replay-embedding"
+
+    def __init__(self, profile, dimension=256):
+        self.profile = profile
+        self.dimension = dimension
+
+    def _vector(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for term in tokenize(text):
+            vector[zlib.crc32(term.encode("utf-8")) % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.profile.wait("embedding")
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class ReplayVectorStore:
+    """Adds Pinecone query latency in front of a local vector store"""
+
+    def __init__(self, store, profile):
+        self.store = store
+        self.profile = profile
+
+    def similarity_search(self, query, k=4, filter=None):
+        self.profile.wait("vector_search")
+        return self.store.similarity_search(query, k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        self.profile.wait("vector_search")
+        return self.store.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+
+class ReplayChatModel:
+    """Chat model stand-in that answers with the first sentences of the records in its prompt"""
+
+    model_name = "replay-chat"
+
+    def __init__(self, profile, sentences=3):
+        self.profile = profile
+        self.sentences = sentences
+
+    def _answer(self, prompt):
+        records = prompt.split("Medical Records:", 1)[-1].split("Current Question:", 1)[0].strip()
+        if not records:
+            return SAMPLE_ANSWER
+        return " ".join(SENTENCE_END.split(" ".join(records.split()))[:self.sentences])
+
+    def stream(self, prompt):
+        self.profile.wait("llm_first_token")
+        for i, word in enumerate(self._answer(prompt).split(" ")):
+            if i:
+                self.profile.wait("llm_token")
+            yield SimpleNamespace(content=word if i == 0 else " " + word, usage_metadata=None)
+
+    def invoke(self, prompt):
+        return SimpleNamespace(content="".join(chunk.content for chunk in self.stream(prompt)), usage_metadata=None)
+
+
+class FakeRedisServer:
+    """In-memory Redis-protocol server implementing the commands RedisState uses
+
+    Serves on a background thread; stop() and start() again on the same port
+    simulate an outage.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.commands = 0
+        self._data = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._clients = set()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
+    def start(self):
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake._clients.add(self.connection)
+
+            def handle(self):
+                while True:
+                    command = fake._read_command(self.rfile)
+                    if command is None:
+                        return
+                    self.wfile.write(fake._encode(fake.execute(command)))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            clients, self._clients = self._clients, set()
+        for connection in clients:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _read_command(reader):
+        try:
+            line = reader.readline()
+        except OSError:
+            return None
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(reader.readline()[1:-2])
+            args.append(reader.read(length + 2)[:-2])
+        return args
+
+    @classmethod
+    def _encode(cls, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return b"-ERR %s\r\n" % str(reply).encode()
+        if isinstance(reply, str):
+            return b"+%s\r\n" % reply.encode()
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(cls._encode(item) for item in reply)
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def execute(self, args):
+        name, args = args[0].decode().upper(), args[1:]
+        with self._lock:
+            self.commands += 1
+            if name == "PING":
+                return "PONG"
+            if name in ("AUTH", "SELECT", "FLUSHDB"):
+                if name == "FLUSHDB":
+                    self._data.clear()
+                return "OK"
+            if name == "DBSIZE":
+                return len(self._data)
+            key = args[0]
+            entry = self._live(key)
+            if name == "GET":
+                return entry[0] if entry else None
+            if name == "SET":
+                expires_at = time.monotonic() + int(args[3]) / 1000 if len(args) > 3 and args[2].upper() == b"PX" else None
+                self._data[key] = (args[1], expires_at)
+                return "OK"
+            if name == "DEL":
+                return int(self._data.pop(key, None) is not None)
+            if name == "INCRBY":
+                value = int(entry[0]) + int(args[1]) if entry else int(args[1])
+                self._data[key] = (str(value).encode(), entry[1] if entry else None)
+                return value
+            if name == "PEXPIRE":
+                if entry is None:
+                    return 0
+                self._data[key] = (entry[0], time.monotonic() + int(args[1]) / 1000)
+                return 1
+            if name == "RPUSH":
+                items = (entry[0] if entry else []) + list(args[1:])
+                self._data[key] = (items, entry[1] if entry else None)
+                return len(items)
+            if name in ("LTRIM", "LRANGE"):
+                items = entry[0] if entry else []
+                start, stop = int(args[1]), int(args[2])
+                start = max(0, start + len(items) if start < 0 else start)
+                stop = stop + len(items) if stop < 0 else stop
+                selected = items[start:stop + 1]
+                if name == "LRANGE":
+                    return selected
+                if entry:
+                    self._data[key] = (selected, entry[1])
+                return "OK"
+            return Exception(f"unknown command '{name}'")
+
+
+class StubMedicalAssistant:
+    """MedicalAssistant stand-in with timer-driven stages, for load testing the Flask app offline"""
+
+    def __init__(self, transcribe_delay=0.3, answer_delay=1.0, tts_delay=0.5):
+        self.transcribe_delay = transcribe_delay
+        self.answer_delay = answer_delay
+        self.tts_delay = tts_delay
+        self.llm = StubLLM(first_token_delay=answer_delay / 2, token_delay=answer_delay / 200)
+        self.tts = StubTTS(first_byte_delay=tts_delay / 2, seconds_per_char=tts_delay / 1000)
+        self.state = LocalState()
+
+    def transcribe_audio(self, audio_file):
+        with span("upload_read"):
+            audio_file.read()
+        with span("transcription", "stub"):
+            time.sleep(self.transcribe_delay)
+        return "What medications is Jacob Reed on?"
+
+    def get_medical_response(self, question, session_id=None, usage=None):
+        with span("llm", "stub"):
+            time.sleep(self.answer_delay)
+        return SAMPLE_ANSWER
+
+    def text_to_speech(self, text, audio_format=None):
+        with span("tts_total", "stub"):
+            time.sleep(self.tts_delay)
+        return io.BytesIO(b"\0" * (len(text) * self.tts.bytes_per_char))
+
+    def test_tts(self, text):
+        return self.text_to_speech(text)
+
+    def open_speech_stream(self, text, audio_format=None):
+        return "audio/mpeg", self.tts(text)
+
+    def process_audio_query(self, audio_file, session_id=None, usage=None, audio_format=None):
+        transcribed_text = self.transcribe_audio(audio_file)
+        medical_response = self.get_medical_response(transcribed_text, session_id, usage)
+        return transcribed_text, medical_response, self.text_to_speech(medical_response, audio_format)
+
+    def process_audio_query_stream(self, transcribed_text, session_id=None, usage=None, audio_format=None):
+        tokens = (chunk.content for chunk in self.llm.stream(transcribed_text))
+        return stream_speech(iter_sentences(tokens), self.tts)
+
+    def start(self):
+        pass
+
+    def preload(self):
+        pass
+
+    def readiness(self):
+        return True, {}
+
+    def get_health_status(self):
+        return {"stub": True}
@@ -0,0 +1,42 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+_encoding = None
+
+
+def get_encoding():
+    """Return the shared tiktoken encoding, or None if tiktoken is unavailable"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable, estimating token counts: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Count prompt tokens in text"""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        # Roughly four characters per token for English text
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text down to at most max_tokens tokens"""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def tts_cache_key(text, voice_id, output_format, voice_settings, backend):
+    """Hash everything that changes the synthesized audio into a cache key"""
+    payload = json.dumps({
+        "text": text,
+        "voice_id": voice_id,
+        "output_format": output_format,
+        "voice_settings": voice_settings,
+        "backend": backend,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Tiered audio cache: an in-memory LRU bounded in bytes, then an optional
+    shared StateBackend (entries kept for shared_ttl seconds) and disk store"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, disk_dir=None, shared=None, shared_ttl=24 * 3600):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        # max_bytes=0 turns the cache off, the shared tier included
+        self.shared = shared if max_bytes > 0 else None
+        self.shared_ttl = shared_ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """Return cached audio bytes for a key, or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return data
+
+        if self.shared is not None:
+            data = self.shared.get(f"tts:{key}")
+            if data is not None:
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                    self._remember(key, data)
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """Store audio bytes under a key in both tiers"""
+        if not data:
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, data)
+        if self.shared is not None:
+            self.shared.set(f"tts:{key}", data, ttl=self.shared_ttl)
+        self._write_disk(key, data)
+
+    def stats(self):
+        """Counters and sizes for health reporting"""
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "disk_enabled": bool(self.disk_dir),
+                "shared": self.shared is not None,
+            }
+
+    def _remember(self, key, data):
+        """Insert into the memory tier and evict least recently used entries (caller holds the lock)"""
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = data
+        self._size += len(data)
+
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Failed to read TTS cache entry: {e}")
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so concurrent readers never see partial audio
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write TTS cache entry: {e}")
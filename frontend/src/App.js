@@ -2,6 +2,13 @@ import React, { useState, useRef, useEffect, useCallback } from 'react';
 import axios from 'axios';
 import './App.css';
 
+// Identifies this browser's conversation so the backend keeps its history separate
+const createSessionId = () => (
+  window.crypto && window.crypto.randomUUID
+    ? window.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+);
+
 const App = () => {
   const [isConversationActive, setIsConversationActive] = useState(false);
   const [hasUserInteracted, setHasUserInteracted] = useState(false);
@@ -23,6 +30,7 @@ const App = () => {
   const microphone = useRef(null);
   const dataArray = useRef(null);
   const animationFrame = useRef(null);
+  const sessionId = useRef(createSessionId());
   
   const thinkingPhrases = [
     "Processing...",
@@ -115,6 +123,7 @@ const App = () => {
     try {
       setError('');
       setConversationHistory([]);
+      sessionId.current = createSessionId();
       setIsConversationActive(true);
       
       // Generate and play welcome message
@@ -396,6 +405,7 @@ const App = () => {
       const response = await axios.post('/api/ask', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          'X-Session-ID': sessionId.current,
         },
         responseType: 'json',
         timeout: 30000
@@ -405,7 +415,7 @@ const App = () => {
       setIsThinking(false);
       
       // Extract the response data
-      const { transcribed_text, medical_response } = response.data;
+      const { transcribed_text, medical_response, audio_url } = response.data;
       
       // Add user message to conversation history with transcribed text
       setConversationHistory(prev => [...prev, 
@@ -417,14 +427,12 @@ const App = () => {
         { type: 'assistant', content: medical_response, timestamp: new Date() }
       ]);
       
-      // Convert medical response to speech
-      const audioResponse = await textToSpeechLocally(medical_response);
-      if (audioResponse && responseAudioRef.current) {
+      // Play the audio the backend already synthesized for this answer
+      if (audio_url && responseAudioRef.current) {
         console.log('Playing audio response');
         setIsSpeaking(true);
         setResponse('Speaking...');
-        const audioUrl = URL.createObjectURL(audioResponse);
-        responseAudioRef.current.src = audioUrl;
+        responseAudioRef.current.src = audio_url;
         responseAudioRef.current.play();
       } else {
         console.log('No audio response, continuing conversation');
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Compare answer latency of the direct RAG engine and the ReAct agent engine
+using stub LLM and retriever backends with fixed delays (no API keys needed)
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from langchain.agents import initialize_agent, AgentType
+from langchain.llms.fake import FakeListLLM
+from langchain.tools import Tool
+
+from answer_engine import AgentEngine, DirectRAGEngine
+from context import ContextAssembler
+from stubs import SAMPLE_ANSWER, StubLLM
+
+QUESTIONS = [
+    "What medications is Jacob Reed on?",
+    "What was Emily Rivera's blood pressure?",
+    "Who has diabetes?",
+]
+
+RAG_PROMPT = "Records:\n{context}\n\nHistory:\n{conversation_history}\n\nQuestion: {input}"
+
+# One tool call followed by the final answer, as a well-behaved ReAct run
+AGENT_RESPONSES = [
+    "I should search the records.\nAction: medical_records_search\nAction Input: patient",
+    f"I now know the final answer\nFinal Answer: {SAMPLE_ANSWER}",
+]
+
+
+class SlowFakeListLLM(FakeListLLM):
+    """FakeListLLM that takes a fixed time per call"""
+
+    delay: float = 0.5
+    calls: int = 0
+
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return super()._call(*args, **kwargs)
+
+
+def make_retriever(delay):
+    def retrieve(query):
+        time.sleep(delay)
+        return [SimpleNamespace(
+            page_content="Jacob Reed, 61 years old male. Current medications: Metformin, Lisinopril, Atorvastatin.",
+            metadata={"patient_id": "patient_007"}
+        )]
+    return retrieve
+
+
+def run(engine, rounds):
+    latencies = []
+    for _ in range(rounds):
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            engine.answer(question)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--llm-delay", type=float, default=0.5, help="seconds per LLM call")
+    parser.add_argument("--retrieval-delay", type=float, default=0.15, help="seconds per records search")
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+
+    retrieve = make_retriever(args.retrieval_delay)
+
+    direct_llm = StubLLM(first_token_delay=args.llm_delay, token_delay=0)
+    direct = DirectRAGEngine(direct_llm, retrieve, RAG_PROMPT, ContextAssembler())
+
+    agent_llm = SlowFakeListLLM(responses=AGENT_RESPONSES, delay=args.llm_delay)
+    tool = Tool(
+        name="medical_records_search",
+        description="Search medical records",
+        func=lambda query: "\n\n".join(doc.page_content for doc in retrieve(query))
+    )
+    agent = AgentEngine(initialize_agent(
+        tools=[tool],
+        llm=agent_llm,
+        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        verbose=False,
+        handle_parsing_errors=True
+    ))
+
+    for name, engine, calls in [("direct", direct, None), ("agent", agent, agent_llm)]:
+        latencies = run(engine, args.rounds)
+        llm_calls = f"{calls.calls / len(latencies):.1f}" if calls else "1.0"
+        print(f"{name:>6}: mean {statistics.mean(latencies) * 1000:6.0f} ms, "
+              f"p50 {statistics.median(latencies) * 1000:6.0f} ms, "
+              f"max {max(latencies) * 1000:6.0f} ms, LLM calls/question {llm_calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the full voice pipeline: the real MedicalAssistant and
+Flask app, with OpenAI, Pinecone and ElevenLabs replaced by stand-ins that
+replay recorded latencies (no API keys needed).
+
+For each corpus size, synthetic patients are generated from the
+sample_patients.json schema and ingested into a local index. Then, for each
+concurrency level, requests go through MedicalAssistant.process_audio_query
+and/or POST /api/ask. Throughput, end-to-end and per-stage latency percentiles
+and memory use are written as JSON. Pass --compare with an earlier result file
+to see what changed between commits.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from werkzeug.datastructures import FileStorage
+
+from ingestion import Ingestor, LocalTarget
+from keyword_index import KEYWORD_INDEX_VERSION
+from load_test import multipart_body, percentile
+from metrics import METRICS
+from patient_facts import PATIENT_FACTS_VERSION, extract_facts
+from patients import PATIENT_DIRECTORY_VERSION, PatientFileWriter, extract_patient_name, record_version
+from stubs import LatencyProfile, ReplayChatModel, ReplayEmbeddings, ReplaySTT, ReplayTTS, ReplayVectorStore
+
+FIRST_NAMES = [
+    "Emily", "Jacob", "Maria", "David", "Aisha", "Robert", "Linda", "Kenji", "Sofia", "Marcus",
+    "Grace", "Omar", "Hannah", "Luis", "Priya", "Thomas", "Nora", "Samuel", "Chloe", "Daniel",
+]
+LAST_NAMES = [
+    "Rivera", "Reed", "Okafor", "Nguyen", "Schmidt", "Patel", "Johnson", "Moreau", "Tanaka", "Silva",
+    "Kowalski", "Haddad", "Bennett", "Larsen", "Castillo", "Fischer", "Murphy", "Abara", "Lindqvist", "Romero",
+]
+
+QUESTIONS = [
+    "What medications is {name} on?",
+    "What was {name}'s blood pressure at the last visit?",
+    "What is the plan for {name}?",
+    "What is the chief complaint for {name}?",
+    "Which patients have diabetes?",
+]
+
+# "Label: value." fields after the "<Name>, <age> years old <sex>." opening
+FIELD = re.compile(r"(?:^|(?<=\. ))([A-Z][A-Za-z ]+): ")
+
+
+def load_schema(path):
+    """Field label -> values seen in the sample records"""
+    with open(path, "r") as f:
+        samples = json.load(f)
+    fields = {}
+    for patient in samples:
+        parts = FIELD.split(patient["content"])
+        for label, value in zip(parts[1::2], parts[2::2]):
+            fields.setdefault(label, []).append(value.strip().rstrip("."))
+    return fields
+
+
+def patient_name(i):
+    """Unique name for the i-th synthetic patient (up to 160,000), in the form the directory recognizes"""
+    words = [FIRST_NAMES[i % len(FIRST_NAMES)]]
+    n = i // len(FIRST_NAMES)
+    words.append(LAST_NAMES[n % len(LAST_NAMES)])
+    n //= len(LAST_NAMES)
+    while n:
+        words.append(LAST_NAMES[n % len(LAST_NAMES)])
+        n //= len(LAST_NAMES)
+    return " ".join(words)
+
+
+def synthesize_patients(count, schema, seed=0):
+    """Patient records in the sample_patients.json format, with field values mixed across the samples"""
+    rng = random.Random(seed)
+    for i in range(count):
+        fields = " ".join(f"{label}: {rng.choice(values)}." for label, values in schema.items())
+        yield {
+            "id": f"synthetic_{i:06d}",
+            "content": f"{patient_name(i)}, {rng.randint(18, 90)} years old {rng.choice(['male', 'female'])}. {fields}"
+        }
+
+
+def build_corpus(directory, count, schema, chunk_size, chunk_overlap, seed):
+    """Ingest synthetic patients into a local index, patient directory and keyword index under directory"""
+    corpus = {
+        "index_dir": os.path.join(directory, "vector_index"),
+        "directory_path": os.path.join(directory, "patient_directory.jsonl"),
+        "keyword_index_path": os.path.join(directory, "keyword_index.jsonl"),
+        "facts_path": os.path.join(directory, "patient_facts.jsonl"),
+        "names": [],
+    }
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    # Ingestion is not what is being measured, so its embeddings take no time
+    ingestor = Ingestor(LocalTarget(corpus["index_dir"]), ReplayEmbeddings(LatencyProfile(scale=0)), {})
+    directory = PatientFileWriter(corpus["directory_path"], PATIENT_DIRECTORY_VERSION)
+    keyword_index = PatientFileWriter(corpus["keyword_index_path"], KEYWORD_INDEX_VERSION)
+    facts = PatientFileWriter(corpus["facts_path"], PATIENT_FACTS_VERSION)
+
+    def track_patient(patient, chunks):
+        name = extract_patient_name(patient)
+        corpus["names"].append(name)
+        directory.add(patient["id"], {"name": name, "version": record_version(patient)})
+        keyword_index.add(patient["id"], [
+            {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata} for doc_id, doc in chunks
+        ])
+        facts.add(patient["id"], extract_facts(patient))
+
+    started = time.perf_counter()
+    stats = ingestor.ingest(synthesize_patients(count, schema, seed), splitter, on_chunks=track_patient)
+    for writer in (directory, keyword_index, facts):
+        writer.close()
+    corpus.update(
+        patients=stats["patients"],
+        chunks=stats["chunks"],
+        ingest_seconds=round(time.perf_counter() - started, 3)
+    )
+    return corpus
+
+
+def build_assistant(corpus, profile, stt=None, start=True):
+    """A real MedicalAssistant whose vendor clients are replaced by replaying stand-ins
+
+    With start=False nothing is initialized yet, e.g. to preload() it instead.
+    """
+    os.environ.update(
+        VECTOR_STORE="local",
+        ANSWER_MODE="direct",
+        LOCAL_INDEX_DIR=corpus["index_dir"],
+        PATIENT_DIRECTORY_PATH=corpus["directory_path"],
+        KEYWORD_INDEX_PATH=corpus["keyword_index_path"],
+        PATIENT_FACTS_PATH=corpus["facts_path"],
+    )
+    from agent import MedicalAssistant
+    from embedding_cache import CachedEmbeddings
+    from local_index import LocalVectorStore
+    from speech import BackendChain
+
+    assistant = MedicalAssistant()
+    assistant.startup.add("http_warmup", lambda: {})
+    assistant.startup.add("openai_client", lambda: None)
+    assistant.startup.add("stt", lambda: BackendChain.from_env("stt", [stt or ReplaySTT(profile)]))
+    assistant.startup.add("tts", lambda: BackendChain.from_env("tts", [ReplayTTS(profile)]))
+    assistant.startup.add("embeddings", lambda: CachedEmbeddings(ReplayEmbeddings(profile)))
+    assistant.startup.add("vectorstore", lambda: ReplayVectorStore(
+        LocalVectorStore.load(corpus["index_dir"], assistant.embeddings), profile
+    ))
+    assistant.startup.add("llm", lambda: ReplayChatModel(profile))
+    if not start:
+        return assistant
+    assistant.start()
+    if assistant.answer_engine is None:
+        raise RuntimeError("Answer engine failed to initialize; see the log above")
+    return assistant
+
+
+def question_payloads(names, count, audio_bytes, seed):
+    """Uploads for count questions about random patients; each carries its transcript for the fake STT"""
+    rng = random.Random(seed)
+    payloads = []
+    for _ in range(count):
+        question = rng.choice(QUESTIONS).format(name=rng.choice(names))
+        data = question.encode("utf-8")
+        payloads.append(data + b"\0" * max(0, audio_bytes - len(data)))
+    return payloads
+
+
+def ask_assistant(assistant):
+    def call(payload):
+        audio = FileStorage(io.BytesIO(payload), filename="question.webm", content_type="audio/webm")
+        _, _, audio_response = assistant.process_audio_query(audio, uuid.uuid4().hex, {})
+        return "ok" if isinstance(audio_response, io.BytesIO) else "failed"
+    return call
+
+
+def ask_http(url):
+    def call(payload):
+        body, content_type = multipart_body(payload)
+        request = urllib.request.Request(url, data=body, headers={
+            "Content-Type": content_type,
+            "X-Session-ID": uuid.uuid4().hex,
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return call
+
+
+class MemorySampler:
+    """Resident set size at the start, peak and end of a run, sampled in the background"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start = self.peak = self.end = 0
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            import resource
+            # ru_maxrss is the process-wide high-water mark, in KB on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, self.rss())
+
+    def __enter__(self):
+        self.start = self.peak = self.rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.end = self.rss()
+        self.peak = max(self.peak, self.end)
+
+    def result(self):
+        mb = 1024 * 1024
+        return {
+            "rss_start_mb": round(self.start / mb, 1),
+            "rss_peak_mb": round(self.peak / mb, 1),
+            "rss_end_mb": round(self.end / mb, 1),
+        }
+
+
+def run(target, call, payloads, concurrency, corpus, warmup):
+    """Drive one (target, corpus, concurrency) combination and summarize it"""
+    for payload in payloads[:warmup]:
+        call(payload)
+    METRICS.reset()
+
+    def timed(payload):
+        started = time.perf_counter()
+        try:
+            status = call(payload)
+        except Exception:
+            status = "error"
+        return status, time.perf_counter() - started
+
+    with MemorySampler() as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, payloads[warmup:]))
+        wall = time.perf_counter() - started
+
+    ok = [elapsed for status, elapsed in results if status in ("ok", 200)]
+    return {
+        "target": target,
+        "patients": corpus["patients"],
+        "chunks": corpus["chunks"],
+        "concurrency": concurrency,
+        "requests": len(results),
+        "statuses": dict(Counter(str(status) for status, _ in results)),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2),
+        "latency_ms": {
+            "mean": round(sum(ok) / len(ok) * 1000, 1) if ok else 0.0,
+            **{f"p{pct}": round(percentile(ok, pct) * 1000, 1) for pct in (50, 95, 99)},
+            "max": round(max(ok) * 1000, 1) if ok else 0.0,
+        },
+        "stages": METRICS.snapshot(),
+        "memory": memory.result(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(baseline, current):
+    """Print throughput and p95 changes for runs present in both result files"""
+    def key(run):
+        return run["target"], run["patients"], run["concurrency"]
+
+    previous = {key(run): run for run in baseline["runs"]}
+    print(f"Compared with {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for run in current["runs"]:
+        before = previous.get(key(run))
+        if before is None:
+            continue
+        changes = []
+        for label, old, new in [
+            ("throughput", before["throughput_rps"], run["throughput_rps"]),
+            ("p95", before["latency_ms"]["p95"], run["latency_ms"]["p95"]),
+        ]:
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            changes.append(f"{label} {old} -> {new} ({change})")
+        print(f"  {run['target']:>9} patients={run['patients']:<6} concurrency={run['concurrency']:<3} "
+              + ", ".join(changes), file=sys.stderr)
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=parse_list, default=[10, 1000], help="comma-separated corpus sizes")
+    parser.add_argument("--concurrency", type=parse_list, default=[1, 8], help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=40, help="requests per run")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each run")
+    parser.add_argument("--targets", default="assistant,http", help="assistant and/or http")
+    parser.add_argument("--profile", help="JSON file of recorded {service: [milliseconds, ...]} latencies")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every replayed latency")
+    parser.add_argument("--audio-bytes", type=int, default=32000, help="size of each uploaded recording")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--warm-caches", action="store_true", help="keep the answer and TTS caches enabled")
+    parser.add_argument("--no-fast-path", action="store_true", help="send field lookups through the LLM as well")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results here instead of stdout")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    # Questions repeat across requests, so by default measure the uncached pipeline
+    if not args.warm_caches:
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["TTS_CACHE_MAX_BYTES"] = "0"
+        os.environ["FAST_PATH_PRESYNTHESIZE_MAX"] = "0"
+    if args.no_fast_path:
+        os.environ["FAST_PATH"] = "false"
+    os.environ["EAGER_STARTUP"] = "false"
+    os.environ.pop("TTS_CACHE_DIR", None)
+
+    if args.profile:
+        profile = LatencyProfile.load(args.profile, scale=args.latency_scale, seed=args.seed)
+    else:
+        profile = LatencyProfile(scale=args.latency_scale, seed=args.seed)
+    schema = load_schema(BACKEND_DIR / "data" / "sample_patients.json")
+    targets = [target.strip() for target in args.targets.split(",") if target.strip()]
+
+    results = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "config": {**{k: v for k, v in vars(args).items() if k not in ("output", "compare")}, "latency_profile": profile.samples},
+        "runs": [],
+    }
+
+    app_module = None
+    server = None
+    with tempfile.TemporaryDirectory(prefix="voice-benchmark-") as workdir:
+        for count in args.patients:
+            corpus = build_corpus(
+                os.path.join(workdir, str(count)), count, schema, args.chunk_size, args.chunk_overlap, args.seed
+            )
+            print(f"Corpus: {corpus['patients']} patients, {corpus['chunks']} chunks "
+                  f"(ingested in {corpus['ingest_seconds']}s)", file=sys.stderr)
+            assistant = build_assistant(corpus, profile)
+            logging.getLogger().setLevel(logging.WARNING)
+            payloads = question_payloads(corpus["names"], args.warmup + args.requests, args.audio_bytes, args.seed)
+
+            if "http" in targets and app_module is None:
+                import agent
+                from werkzeug.serving import make_server
+
+                agent.MedicalAssistant = lambda: assistant
+                import app as app_module
+                logging.getLogger().setLevel(logging.WARNING)
+                server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+            if app_module is not None:
+                app_module.medical_assistant = assistant
+
+            for concurrency in args.concurrency:
+                for target in targets:
+                    if target == "assistant":
+                        call = ask_assistant(assistant)
+                    else:
+                        call = ask_http(f"http://127.0.0.1:{server.server_port}/api/ask")
+                    result = run(target, call, payloads, concurrency, corpus, args.warmup)
+                    result["ingest_seconds"] = corpus["ingest_seconds"]
+                    results["runs"].append(result)
+                    print(f"  {target:>9} concurrency={concurrency:<3} {result['throughput_rps']:7.2f} req/s  "
+                          f"p50 {result['latency_ms']['p50']:7.1f} ms  p95 {result['latency_ms']['p95']:7.1f} ms  "
+                          f"peak RSS {result['memory']['rss_peak_mb']} MB  {result['statuses']}", file=sys.stderr)
+
+    if server is not None:
+        server.shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Incremental ingestion of patient records into a vector store.
+
+Records are streamed from JSON/JSONL exports, split into chunks with stable
+IDs (patient_id + chunk hash), and compared against a manifest of what was
+uploaded last time, so only new or changed chunks are embedded and upserted
+and chunks that disappeared are deleted.
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.docstore.document import Document
+
+from local_index import LocalVectorIndex, LocalVectorStore
+
+MANIFEST_VERSION = 1
+
+
+def iter_json_array(f, chunk_size=65536):
+    """Yield the elements of a top-level JSON array without reading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    while True:
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        pos = 0
+
+        while True:
+            # Skip whitespace and separators between elements
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array of patient records")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # The element continues in the next chunk
+                break
+            yield record
+
+        buffer = buffer[pos:]
+        if eof:
+            if buffer.strip():
+                raise ValueError("Unexpected end of JSON array")
+            return
+
+
+def iter_patient_records(data_file):
+    """Stream patient records from a .json array or a .jsonl export"""
+    with open(data_file, "r") as f:
+        if str(data_file).endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def vector_id(patient_id, text):
+    """Stable vector ID for a chunk, so re-ingesting unchanged text is a no-op"""
+    return f"{patient_id}#{chunk_hash(text)}"
+
+
+def chunk_patient(patient, splitter):
+    """Split one patient record into (vector_id, Document) pairs"""
+    chunks = {}
+    for text in splitter.split_text(patient['content']):
+        doc_id = vector_id(patient['id'], text)
+        if doc_id not in chunks:
+            chunks[doc_id] = Document(
+                page_content=text,
+                metadata={
+                    'patient_id': patient['id'],
+                    'source': 'medical_records',
+                    'chunk_hash': chunk_hash(text)
+                }
+            )
+    return list(chunks.items())
+
+
+def load_manifest(path):
+    """Load the patient_id -> vector IDs map recorded by the previous run"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return {patient_id: set(ids) for patient_id, ids in manifest["patients"].items()}
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({
+            "version": MANIFEST_VERSION,
+            "patients": {patient_id: sorted(ids) for patient_id, ids in manifest.items() if ids}
+        }, f)
+    os.replace(path + ".tmp", path)
+
+
+def with_retry(fn, description, attempts=4, base_delay=1.0):
+    """Call fn, retrying with jittered exponential backoff"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+            print(f"  {description} failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+
+class PineconeTarget:
+    """Writes chunks to a Pinecone index in the layout PineconeVectorStore reads"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, ids, vectors, documents):
+        self.index.upsert(vectors=[
+            {"id": doc_id, "values": vector, "metadata": {**doc.metadata, "text": doc.page_content}}
+            for doc_id, vector, doc in zip(ids, vectors, documents)
+        ])
+
+    def delete(self, ids):
+        self.index.delete(ids=list(ids))
+
+    def clear(self):
+        self.index.delete(delete_all=True)
+
+    def finalize(self):
+        pass
+
+    def vectorstore(self, embeddings):
+        from langchain_pinecone import PineconeVectorStore
+        return PineconeVectorStore(index=self.index, embedding=embeddings)
+
+
+class LocalTarget:
+    """Collects changes for a LocalVectorIndex and saves it once at the end"""
+
+    def __init__(self, index_dir, ann=None):
+        self.index_dir = index_dir
+        self.ann = ann
+        try:
+            self.index = LocalVectorIndex.load(index_dir, mmap=False)
+        except FileNotFoundError:
+            self.index = LocalVectorIndex.empty()
+        self._vectors = []
+        self._documents = []
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def upsert(self, ids, vectors, documents):
+        with self._lock:
+            self._vectors.extend(vectors)
+            self._documents.extend(
+                {"id": doc_id, "text": doc.page_content, "metadata": dict(doc.metadata)}
+                for doc_id, doc in zip(ids, documents)
+            )
+
+    def delete(self, ids):
+        with self._lock:
+            self._deleted.update(ids)
+
+    def clear(self):
+        self.index = LocalVectorIndex.empty()
+
+    def finalize(self):
+        self.index.delete(self._deleted)
+        if self._documents:
+            self.index.upsert(self._vectors, self._documents)
+        if self.ann == "ivf":
+            self.index.train_ivf(max(1, int(len(self.index) ** 0.5)))
+        self.index.save(self.index_dir)
+
+    def vectorstore(self, embeddings):
+        return LocalVectorStore(self.index, embeddings)
+
+
+class Ingestor:
+    """Embeds and upserts changed chunks in parallel batches, then deletes stale ones"""
+
+    def __init__(self, target, embeddings, manifest, batch_size=100, max_workers=4, attempts=4):
+        self.target = target
+        self.embeddings = embeddings
+        self.previous = manifest
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.attempts = attempts
+        self.manifest = {}
+        self.stats = {"patients": 0, "chunks": 0, "unchanged": 0, "upserted": 0, "deleted": 0, "failed": 0}
+        self.failed_patients = set()
+        self._lock = threading.Lock()
+
+    def _upload_batch(self, batch):
+        """Embed and upsert one batch; record its IDs in the manifest only on success
+
+        On failure the batch's patients are recorded in failed_patients instead.
+        """
+        ids = [doc_id for _, doc_id, _ in batch]
+        docs = [doc for _, _, doc in batch]
+        try:
+            vectors = with_retry(
+                lambda: self.embeddings.embed_documents([doc.page_content for doc in docs]),
+                "Embedding batch", self.attempts
+            )
+            with_retry(lambda: self.target.upsert(ids, vectors, docs), "Upsert batch", self.attempts)
+        except Exception as e:
+            print(f"  Giving up on batch of {len(batch)} chunks: {e}")
+            with self._lock:
+                self.stats["failed"] += len(batch)
+                self.failed_patients.update(patient_id for patient_id, _, _ in batch)
+            return
+
+        with self._lock:
+            for patient_id, doc_id, _ in batch:
+                self.manifest.setdefault(patient_id, set()).add(doc_id)
+            self.stats["upserted"] += len(batch)
+
+    def ingest(self, patients, splitter, partial=False, on_chunks=None):
+        """Sync the target with a stream of patient records
+
+        With partial=True, patients missing from the stream are left untouched
+        instead of being deleted. on_chunks, if given, is called with each
+        patient and its (vector_id, Document) chunks as the patient is split.
+        """
+        stale = {}
+        in_flight = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def submit(executor, batch):
+            in_flight.acquire()
+            future = executor.submit(self._upload_batch, batch)
+            future.add_done_callback(lambda _: in_flight.release())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            batch = []
+            for patient in patients:
+                patient_id = patient['id']
+                previous_ids = self.previous.get(patient_id, set())
+                chunks = chunk_patient(patient, splitter)
+                if on_chunks is not None:
+                    on_chunks(patient, chunks)
+                current_ids = {doc_id for doc_id, _ in chunks}
+
+                with self._lock:
+                    self.stats["patients"] += 1
+                    self.stats["chunks"] += len(chunks)
+                    unchanged = current_ids & previous_ids
+                    self.stats["unchanged"] += len(unchanged)
+                    self.manifest.setdefault(patient_id, set()).update(unchanged)
+                stale[patient_id] = previous_ids - current_ids
+
+                for doc_id, doc in chunks:
+                    if doc_id in previous_ids:
+                        continue
+                    batch.append((patient_id, doc_id, doc))
+                    if len(batch) >= self.batch_size:
+                        submit(executor, batch)
+                        batch = []
+            if batch:
+                submit(executor, batch)
+
+        # Only now are replacements in place, so deleting stale chunks never leaves a patient empty.
+        # A patient whose replacements failed keeps its previous chunks until a later run succeeds.
+        for patient_id in self.failed_patients:
+            stale.pop(patient_id, None)
+            self.manifest.setdefault(patient_id, set()).update(self.previous.get(patient_id, ()))
+        for patient_id, ids in self.previous.items():
+            if patient_id in self.manifest:
+                continue
+            if partial:
+                self.manifest[patient_id] = set(ids)
+            else:
+                stale[patient_id] = set(ids)
+
+        stale = sorted(doc_id for ids in stale.values() for doc_id in ids)
+        for start in range(0, len(stale), self.batch_size):
+            ids = stale[start:start + self.batch_size]
+            try:
+                with_retry(lambda: self.target.delete(ids), "Delete batch", self.attempts)
+                self.stats["deleted"] += len(ids)
+            except Exception as e:
+                print(f"  Failed to delete {len(ids)} stale chunks: {e}")
+                # Keep them in the manifest so the next run retries the delete
+                for doc_id in ids:
+                    self.manifest.setdefault(doc_id.rsplit("#", 1)[0], set()).add(doc_id)
+
+        self.target.finalize()
+        return self.stats
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Load test for the Flask API using a stub MedicalAssistant (no API keys needed).
+
+Starts the app on a threaded local server and fires concurrent /api/ask
+requests, then reports status codes and latency percentiles.
+"""
+
+import argparse
+import statistics
+import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from stubs import StubMedicalAssistant
+
+
+def load_app(transcribe_delay, answer_delay, tts_delay):
+    """Import app.py with the real MedicalAssistant swapped for the stub"""
+    stub_agent = types.ModuleType("agent")
+    stub_agent.MedicalAssistant = lambda: StubMedicalAssistant(transcribe_delay, answer_delay, tts_delay)
+    sys.modules["agent"] = stub_agent
+
+    import app as app_module
+    return app_module.app
+
+
+def multipart_body(audio_bytes):
+    """Encode a minimal multipart form with an audio file"""
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="audio"; filename="recording.webm"\r\n'
+        "Content-Type: audio/webm\r\n\r\n"
+    ).encode() + audio_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def send_request(url, results, lock):
+    body, content_type = multipart_body(b"\0" * 16000)
+    request = urllib.request.Request(url, data=body, headers={
+        "Content-Type": content_type,
+        "X-Session-ID": uuid.uuid4().hex,
+    })
+
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = "error"
+    elapsed = time.perf_counter() - start
+
+    with lock:
+        results.append((status, elapsed))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64, help="total requests to send")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight at once")
+    parser.add_argument("--transcribe-delay", type=float, default=0.3)
+    parser.add_argument("--answer-delay", type=float, default=1.0)
+    parser.add_argument("--tts-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    app = load_app(args.transcribe_delay, args.answer_delay, args.tts_delay)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/ask"
+
+    results = []
+    lock = threading.Lock()
+    slots = threading.Semaphore(args.concurrency)
+
+    def worker():
+        try:
+            send_request(url, results, lock)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    threads = []
+    for _ in range(args.requests):
+        slots.acquire()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    server.shutdown()
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    ok = [elapsed for status, elapsed in results if status == 200]
+
+    print(f"Requests: {len(results)} in {wall:.2f}s ({len(results) / wall:.1f} req/s)")
+    print(f"Status codes: {statuses}")
+    if ok:
+        print(f"Latency (200s): mean {statistics.mean(ok) * 1000:.0f} ms, "
+              f"p50 {percentile(ok, 50) * 1000:.0f} ms, "
+              f"p95 {percentile(ok, 95) * 1000:.0f} ms, "
+              f"p99 {percentile(ok, 99) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
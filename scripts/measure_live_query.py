@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Compare the latency after end of speech of /api/ask-style uploads and live
+queries whose frames are transcribed and searched while the question is still
+being spoken. Uses the benchmark's synthetic corpus and replayed vendor
+latencies, with dictated stand-in audio (no API keys needed).
+"""
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from werkzeug.datastructures import FileStorage
+
+from audio_preprocess import finalize_wav, wav_header
+from benchmark_pipeline import BACKEND_DIR, QUESTIONS, build_assistant, build_corpus, load_schema
+from load_test import percentile
+from stubs import DictationSTT, LatencyProfile, dictate
+
+FRAME_MS = 100
+BYTES_PER_MS = 32
+
+
+def ask_upload(assistant, pcm):
+    """Whole recording uploaded once the client has heard the trailing silence"""
+    audio = FileStorage(io.BytesIO(finalize_wav(wav_header() + pcm)), filename="question.wav", content_type="audio/wav")
+    started = time.perf_counter()
+    _, _, audio_response = assistant.process_audio_query(audio, uuid.uuid4().hex, {})
+    return time.perf_counter() - started, isinstance(audio_response, io.BytesIO)
+
+
+def ask_live(assistant, pcm):
+    """Frames sent in real time; latency counts from the frame in which end of speech was detected"""
+    live = assistant.open_live_query("audio/pcm")
+    frame_bytes = FRAME_MS * BYTES_PER_MS
+    for offset in range(0, len(pcm), frame_bytes):
+        time.sleep(FRAME_MS / 1000)
+        started = time.perf_counter()
+        if live.append(pcm[offset:offset + frame_bytes]):
+            break
+    else:
+        started = time.perf_counter()
+    _, _, audio_response = assistant.process_live_query(live, uuid.uuid4().hex, {})
+    return time.perf_counter() - started, isinstance(audio_response, io.BytesIO)
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=200, help="synthetic corpus size")
+    parser.add_argument("--questions", type=int, default=8, help="questions per mode")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiply every replayed latency")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Every question is about a different patient, but keep caches out of the comparison anyway;
+    # the questions are field lookups, which would otherwise be answered without retrieval
+    os.environ.update(ANSWER_CACHE_MAX_ENTRIES="0", TTS_CACHE_MAX_BYTES="0", EAGER_STARTUP="false",
+                      FAST_PATH="false")
+    os.environ.pop("TTS_CACHE_DIR", None)
+    end_silence_ms = int(os.getenv("LIVE_VAD_END_SILENCE_MS", "700"))
+
+    profile = LatencyProfile(scale=args.latency_scale, seed=args.seed)
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="live-query-") as workdir:
+        corpus = build_corpus(workdir, args.patients, load_schema(BACKEND_DIR / "data" / "sample_patients.json"),
+                              1000, 100, args.seed)
+        assistant = build_assistant(corpus, profile, stt=DictationSTT(profile))
+        logging.getLogger().setLevel(logging.WARNING)
+
+        names = rng.sample(corpus["names"], 2 * args.questions)
+        templates = [template for template in QUESTIONS if "{name}" in template]
+        results = {}
+        for mode, ask, batch in [("upload", ask_upload, names[::2]), ("live", ask_live, names[1::2])]:
+            latencies = []
+            failures = 0
+            for name in batch:
+                question = rng.choice(templates).format(name=name)
+                # The spoken question followed by the silence that ends it
+                pcm = dictate(question) + b"\0" * ((end_silence_ms + 2 * FRAME_MS) * BYTES_PER_MS)
+                seconds, ok = ask(assistant, pcm)
+                latencies.append(seconds * 1000)
+                failures += not ok
+            results[mode] = latencies
+            print(f"{mode:>7}: after end of speech p50 {percentile(latencies, 50):7.1f} ms  "
+                  f"p95 {percentile(latencies, 95):7.1f} ms  failed {failures}")
+
+        stats = assistant.live_queries.stats()
+        print(f"   live: {stats['partials']} partial transcripts, {stats['reused_partials']} reused as final, "
+              f"speculative retrieval hits {stats['speculation_hits']} / misses {stats['speculation_misses']}")
+
+
+if __name__ == "__main__":
+    main()
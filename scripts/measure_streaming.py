@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Compare time-to-first-audio of the sequential and streamed voice pipelines
+using timer-driven stub LLM and TTS backends (no API keys needed)
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from streaming import iter_sentences, stream_speech
+from stubs import StubLLM, StubTTS
+
+
+def measure_sequential(llm, tts):
+    """Wait for the whole answer, then synthesize it in one go"""
+    start = time.perf_counter()
+    answer = "".join(chunk.content for chunk in llm.stream(""))
+    first_audio = None
+    for _ in tts(answer):
+        if first_audio is None:
+            first_audio = time.perf_counter() - start
+    return first_audio, time.perf_counter() - start
+
+
+def measure_streamed(llm, tts):
+    """Synthesize each sentence while the next is still being generated"""
+    start = time.perf_counter()
+    tokens = (chunk.content for chunk in llm.stream(""))
+    first_audio = None
+    for event in stream_speech(iter_sentences(tokens), tts):
+        if event["type"] == "audio" and first_audio is None:
+            first_audio = time.perf_counter() - start
+    return first_audio, time.perf_counter() - start
+
+
+def main():
+    """Main function"""
+    llm = StubLLM()
+    tts = StubTTS()
+
+    for name, measure in [("sequential", measure_sequential), ("streamed", measure_streamed)]:
+        first_audio, total = measure(llm, tts)
+        print(f"{name:>10}: first audio {first_audio * 1000:7.1f} ms, total {total * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
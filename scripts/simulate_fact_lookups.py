@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Check which questions the fact fast path answers from the pre-rendered answers
+extracted at ingestion, and that negated, status-change and narrowed questions
+("not taking", "stopped", "the plan for her diabetes") are left to the LLM.
+Uses the sample patient records (no API keys needed).
+"""
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from patient_facts import PATIENT_FACTS_VERSION, FactStore, extract_facts
+from patients import PatientFileWriter
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+
+# (question, intent whose answer it gets, or None for the LLM); {name} is the sample patient
+CASES = [
+    ("What medications is {name} on?", "medications"),
+    ("What is {name} taking?", "medications"),
+    ("What was {name}'s blood pressure at the last visit?", "blood_pressure"),
+    ("What's {name}'s pulse?", "pulse"),
+    ("How much does {name} weigh?", "weight"),
+    ("Show me {name}'s vital signs", "vitals"),
+    ("What is the plan for {name}?", "plan"),
+    ("What is the chief complaint for {name}?", "chief_complaint"),
+    ("When was {name} last seen?", "last_visit"),
+    ("How old is {name}?", "age"),
+    ("What medications is {name} not taking?", None),
+    ("Which medications has {name} stopped?", None),
+    ("Which medications were discontinued for {name}?", None),
+    ("{name}'s medications not working?", None),
+    ("What was the plan for {name}'s diabetes?", None),
+    ("What's {name}'s ejection fraction plan?", None),
+    ("What is the plan without surgery for {name}?", None),
+    ("Why is {name}'s blood pressure low?", None),
+    ("Has {name}'s weight changed?", None),
+    ("What medications and labs does {name} have?", None),
+]
+
+
+def main():
+    """Main function"""
+    with open(BACKEND_DIR / "data" / "sample_patients.json", "r") as f:
+        patients = json.load(f)
+    # A record with every field the cases look up
+    patient = next(p for p in patients if {"medications", "pulse", "weight"} <= set(extract_facts(p)["answers"]))
+    facts = extract_facts(patient)
+
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="fact-lookups-") as workdir:
+        path = str(Path(workdir) / "patient_facts.jsonl")
+        writer = PatientFileWriter(path, PATIENT_FACTS_VERSION)
+        writer.add(patient["id"], facts)
+        writer.close()
+        store = FactStore(path)
+        for template, intent in CASES:
+            question = template.format(name=facts["name"])
+            answer = store.answer(question, {patient["id"]})
+            expected = facts["answers"][intent] if intent else None
+            if answer == expected:
+                print(f"PASS {question} -> {intent or 'LLM'}")
+            else:
+                failed += 1
+                print(f"FAIL {question} -> expected {intent or 'LLM'}, got {answer!r}")
+
+    print(f"\n{store.stats()}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Check that several workers share sessions, caches, answer audio and rate
+limits through the Redis-protocol state backend, that a worker keeps
+answering and continues sessions while the backend is down, and that a
+worker forked after preload() answers from the indexes its master loaded.
+Two MedicalAssistants in one process stand in for two gunicorn workers, with
+the benchmark's synthetic corpus, replayed vendor latencies and an in-memory
+Redis stand-in (no API keys or Redis server needed).
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from audio_store import AudioStore
+from benchmark_pipeline import BACKEND_DIR, build_assistant, build_corpus, load_schema
+from shared_state import RateLimiter, RedisState
+from stubs import FakeRedisServer, LatencyProfile
+
+
+def scenario_session_continues_on_other_worker(ctx):
+    (first, second), corpus = ctx.workers, ctx.corpus
+    session_id = uuid.uuid4().hex
+    name = corpus["names"][0]
+    first.get_medical_response(f"What medications is {name} on?", session_id, {})
+    # "her" can only be resolved from the turn the other worker recorded
+    usage = {}
+    answer = second.get_medical_response("What is her blood pressure?", session_id, usage)
+    assert usage.get("fast_path") and answer.startswith(name), (answer, usage)
+
+
+def scenario_answer_cached_by_other_worker(ctx):
+    (first, second), corpus = ctx.workers, ctx.corpus
+    question = f"Summarize the assessment and plan for {corpus['names'][1]}"
+    first.get_medical_response(question, uuid.uuid4().hex, {})
+    usage = {}
+    second.get_medical_response(question, uuid.uuid4().hex, usage)
+    assert usage.get("cached"), usage
+    assert second.answer_cache.stats()["shared_hits"] == 1, second.answer_cache.stats()
+
+
+def scenario_speech_cached_by_other_worker(ctx):
+    (first, second), corpus = ctx.workers, ctx.corpus
+    text = f"{corpus['names'][2]} has an appointment tomorrow."
+    audio = first.text_to_speech(text)
+    assert audio is not None
+    assert second.text_to_speech(text).getvalue() == audio.getvalue()
+    assert second.tts_cache.stats()["shared_hits"] == 1, second.tts_cache.stats()
+
+
+def scenario_audio_fetched_from_other_worker(ctx):
+    server = ctx.server
+    stored = AudioStore(shared=RedisState.from_url(server.url))
+    fetched = AudioStore(shared=RedisState.from_url(server.url))
+    audio_id = stored.put(io.BytesIO(b"ID3 answer audio"), "audio/mpeg")
+    assert fetched.get(audio_id) == (b"ID3 answer audio", "audio/mpeg"), fetched.get(audio_id)
+
+
+def scenario_rate_limit_counts_all_workers(ctx):
+    server = ctx.server
+    limiters = [RateLimiter(RedisState.from_url(server.url), limit=3) for _ in range(2)]
+    client = uuid.uuid4().hex
+    results = [limiters[i % 2].check(client) for i in range(4)]
+    assert results[:3] == [0, 0, 0] and results[3] > 0, results
+
+
+def scenario_outage_degrades_to_local(ctx):
+    (first, second), corpus, server = ctx.workers, ctx.corpus, ctx.server
+    session_id = uuid.uuid4().hex
+    name = corpus["names"][3]
+    server.stop()
+    try:
+        answer = second.get_medical_response(f"What medications is {name} on?", session_id, {})
+        assert answer.startswith(name), answer
+        # The follow-up still resolves "her" from the turn kept in this worker during the outage
+        usage = {}
+        answer = second.get_medical_response("What is her blood pressure?", session_id, usage)
+        assert usage.get("fast_path") and answer.startswith(name), (answer, usage)
+        stats = second.state.stats()
+        assert stats["errors"] > 0 and stats["skipped"] > 0, stats
+        assert second.sessions.stats()["local_writes"] == 2, second.sessions.stats()
+    finally:
+        server.start()
+    time.sleep(second.state.retry_seconds)
+    assert second.state.ping()
+    # The next turn moves the session to the server, where the other worker sees all of it
+    second.get_medical_response(f"What is {name}'s weight?", session_id, {})
+    turns = first.sessions.get_turns(session_id)
+    assert len(turns) == 3 and second.sessions.stats()["local_sessions"] == 0, turns
+
+
+def scenario_forked_worker_uses_preloaded_index(ctx):
+    corpus = ctx.corpus
+    master = build_assistant(corpus, ctx.profile, start=False)
+    master.preload()
+    vectorstore = master.startup.peek("vectorstore")
+    assert vectorstore is not None, master.startup.status()
+    pid = os.fork()
+    if pid == 0:
+        # Worker: everything not preloaded starts here, the index is the master's copy
+        code = 1
+        try:
+            master.start()
+            answer = master.get_medical_response(f"Summarize the history of {corpus['names'][4]}", uuid.uuid4().hex, {})
+            code = 0 if master.vectorstore is vectorstore and corpus["names"][4] in answer else 2
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0, os.waitstatus_to_exitcode(status)
+
+
+SCENARIOS = [
+    scenario_session_continues_on_other_worker,
+    scenario_answer_cached_by_other_worker,
+    scenario_speech_cached_by_other_worker,
+    scenario_audio_fetched_from_other_worker,
+    scenario_rate_limit_counts_all_workers,
+    scenario_outage_degrades_to_local,
+    scenario_forked_worker_uses_preloaded_index,
+]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--patients", type=int, default=50, help="synthetic corpus size")
+    parser.add_argument("--latency-scale", type=float, default=0.05, help="multiply every replayed latency")
+    args = parser.parse_args()
+
+    server = FakeRedisServer().start()
+    os.environ.update(STATE_BACKEND="redis", STATE_URL=server.url, STATE_RETRY_SECONDS="0.2", EAGER_STARTUP="false",
+                      FAST_PATH_PRESYNTHESIZE_MAX="0", ANSWER_CACHE_MAX_ENTRIES="1000")
+    os.environ.pop("TTS_CACHE_DIR", None)
+    os.environ.pop("TTS_CACHE_MAX_BYTES", None)
+
+    profile = LatencyProfile(scale=args.latency_scale)
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix="shared-state-") as workdir:
+        corpus = build_corpus(workdir, args.patients, load_schema(BACKEND_DIR / "data" / "sample_patients.json"),
+                              1000, 100, 0)
+        workers = [build_assistant(corpus, profile) for _ in range(2)]
+        logging.getLogger().setLevel(logging.WARNING)
+
+        ctx = SimpleNamespace(workers=workers, corpus=corpus, server=server, profile=profile)
+        for scenario in SCENARIOS:
+            try:
+                scenario(ctx)
+                print(f"PASS {scenario.__name__}")
+            except Exception as e:
+                failed += 1
+                print(f"FAIL {scenario.__name__}: {e!r}")
+
+    print(f"\n{server.commands} commands served by the state backend stand-in")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Exercise the speech BackendChain (timeouts, circuit breaking, hedging) against
+scripted fake backends with injected delays and errors, then compare tail
+latency with and without hedging (no API keys needed)
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from speech import BackendChain, NoBackendAvailable
+from stubs import FakeElevenLabsTTS, FakeSpeechBackend
+
+
+def run(chain, text="hello", audio_format="mp3"):
+    """Synthesize through the chain; return (backend names that produced output, audio, seconds)"""
+    start = time.perf_counter()
+    names, audio = [], b""
+    for backend, chunk in chain.stream(lambda backend: backend.stream(text, audio_format=audio_format)):
+        if backend.name not in names:
+            names.append(backend.name)
+        audio += chunk
+    return names, audio, time.perf_counter() - start
+
+
+def scenario_error_falls_back():
+    primary = FakeSpeechBackend("primary", [(0.0, "error")])
+    chain = BackendChain("tts", [primary, FakeSpeechBackend("fallback")])
+    names, audio, elapsed = run(chain)
+    assert names == ["fallback"], names
+    assert audio.startswith(b"fallback:0;"), audio
+    assert elapsed < 0.2, elapsed
+
+
+def scenario_wav_error_falls_back():
+    # The WAV header must not count as output before the vendor has produced any audio
+    primary = FakeElevenLabsTTS([(0.0, "error")])
+    chain = BackendChain("tts", [primary, FakeSpeechBackend("fallback")], breaker_failures=2, breaker_reset=60)
+    for _ in range(2):
+        names, audio, _ = run(chain, audio_format="wav")
+        assert names == ["fallback"], names
+        assert audio.startswith(b"fallback:0;"), audio
+    assert chain.stats()["backends"]["elevenlabs"]["circuit"] == "open"
+    run(chain, audio_format="wav")
+    assert primary.calls == 2, primary.calls
+
+
+def scenario_wav_first_output_is_audio():
+    primary = FakeElevenLabsTTS([(0.1, "ok")])
+    chain = BackendChain("tts", [primary])
+    names, audio, _ = run(chain, audio_format="wav")
+    assert names == ["elevenlabs"] and audio.startswith(b"RIFF"), audio
+    assert audio.count(b"RIFF") == 1, audio
+    # Time to first output includes the vendor's delay, not just the header
+    assert chain.stats()["backends"]["elevenlabs"]["latency_ms"] >= 100, chain.stats()
+
+
+def scenario_timeout_falls_back():
+    primary = FakeSpeechBackend("primary", [(0.0, "stall")])
+    chain = BackendChain("tts", [primary, FakeSpeechBackend("fallback")], timeouts={"primary": 0.2})
+    names, _, elapsed = run(chain)
+    assert names == ["fallback"], names
+    assert 0.2 <= elapsed < 0.5, elapsed
+    assert chain.stats()["backends"]["primary"]["timeouts"] == 1
+
+
+def scenario_breaker_opens_and_probes():
+    primary = FakeSpeechBackend("primary", [(0.0, "error")] * 3 + [(0.0, "ok")])
+    chain = BackendChain("tts", [primary, FakeSpeechBackend("fallback")], breaker_failures=3, breaker_reset=0.3)
+    for _ in range(3):
+        assert run(chain)[0] == ["fallback"]
+    assert chain.stats()["backends"]["primary"]["circuit"] == "open"
+
+    # While open, the primary is not called at all
+    run(chain)
+    assert primary.calls == 3, primary.calls
+
+    # After the reset timeout a single probe goes through and closes the circuit
+    time.sleep(0.35)
+    chain.stale_after = 0
+    assert run(chain)[0] == ["primary"]
+    assert primary.calls == 4, primary.calls
+    assert chain.stats()["backends"]["primary"]["circuit"] == "closed"
+
+
+def scenario_failed_probe_reopens():
+    primary = FakeSpeechBackend("primary", [(0.0, "error")])
+    chain = BackendChain("tts", [primary, FakeSpeechBackend("fallback")], breaker_failures=1, breaker_reset=0.1)
+    run(chain)
+    time.sleep(0.15)
+    assert run(chain)[0] == ["fallback"]
+    assert primary.calls == 2, primary.calls
+    assert chain.stats()["backends"]["primary"]["circuit"] == "open"
+
+
+def scenario_hedge_beats_slow_primary():
+    primary = FakeSpeechBackend("primary", [(0.02, "ok")] * 20 + [(1.0, "ok")])
+    fallback = FakeSpeechBackend("fallback", [(0.05, "ok")])
+    chain = BackendChain("tts", [primary, fallback], hedge_percentile=95, hedge_min_samples=20)
+    for _ in range(20):
+        assert run(chain)[0] == ["primary"]
+    names, _, elapsed = run(chain)
+    assert names == ["fallback"], names
+    assert elapsed < 0.3, elapsed
+    stats = chain.stats()["backends"]["fallback"]
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1, stats
+
+
+def scenario_no_hedge_without_samples():
+    primary = FakeSpeechBackend("primary", [(0.2, "ok")])
+    fallback = FakeSpeechBackend("fallback", [(0.0, "ok")])
+    chain = BackendChain("tts", [primary, fallback], hedge_percentile=95, hedge_min_samples=20)
+    assert run(chain)[0] == ["primary"]
+    assert fallback.calls == 0
+
+
+def scenario_mid_stream_failure_raises():
+    primary = FakeSpeechBackend("primary", [(0.0, "mid-error")])
+    fallback = FakeSpeechBackend("fallback")
+    chain = BackendChain("tts", [primary, fallback])
+    try:
+        run(chain)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("expected the mid-stream failure to be raised")
+    assert fallback.calls == 0
+
+
+def scenario_early_stop_releases_probe():
+    primary = FakeSpeechBackend("primary", [(0.0, "error"), (0.0, "ok")], chunks=5, chunk_delay=0.05)
+    chain = BackendChain("tts", [primary], breaker_failures=1, breaker_reset=0.05)
+    try:
+        run(chain)
+    except NoBackendAvailable:
+        pass
+    time.sleep(0.1)
+    # The consumer abandons the probe after one chunk; the breaker must not stay half-open
+    stream = chain.stream(lambda backend: backend.stream("hello"))
+    next(stream)
+    stream.close()
+    assert chain.stats()["backends"]["primary"]["circuit"] == "closed"
+
+
+def scenario_all_failed():
+    chain = BackendChain("tts", [FakeSpeechBackend("a", [(0.0, "error")]), FakeSpeechBackend("b", [(0.0, "empty")])])
+    try:
+        run(chain)
+    except NoBackendAvailable as e:
+        assert "a:" in str(e) and "b:" in str(e), e
+    else:
+        raise AssertionError("expected NoBackendAvailable")
+
+
+def tail_latency(hedge_percentile, requests):
+    """Primary is fast but stalls on 1 in 10 calls; the fallback is slower but steady"""
+    primary = FakeSpeechBackend("primary", [(0.02, "ok")] * 9 + [(0.5, "ok")])
+    fallback = FakeSpeechBackend("fallback", [(0.06, "ok")])
+    chain = BackendChain("tts", [primary, fallback], hedge_percentile=hedge_percentile, hedge_min_samples=10)
+    latencies = sorted(run(chain)[2] for _ in range(requests))
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)], latencies[-1]
+
+
+SCENARIOS = [
+    scenario_error_falls_back,
+    scenario_wav_error_falls_back,
+    scenario_wav_first_output_is_audio,
+    scenario_timeout_falls_back,
+    scenario_breaker_opens_and_probes,
+    scenario_failed_probe_reopens,
+    scenario_hedge_beats_slow_primary,
+    scenario_no_hedge_without_samples,
+    scenario_mid_stream_failure_raises,
+    scenario_early_stop_releases_probe,
+    scenario_all_failed,
+]
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Check speech failover behaviour with fake backends")
+    parser.add_argument("--requests", type=int, default=60, help="Requests per tail latency run")
+    args = parser.parse_args()
+
+    failed = 0
+    for scenario in SCENARIOS:
+        try:
+            scenario()
+            print(f"PASS {scenario.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {scenario.__name__}: {e!r}")
+
+    print(f"\nTail latency over {args.requests} requests (primary stalls on 10% of calls)")
+    for label, percentile in (("sequential", None), ("hedged p90", 90)):
+        p50, p95, worst = tail_latency(percentile, args.requests)
+        print(f"  {label:<12} p50 {p50 * 1000:6.0f} ms   p95 {p95 * 1000:6.0f} ms   max {worst * 1000:6.0f} ms")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,54 @@
 #!/usr/bin/env python3
 """
-Script to upload sample patient data to Pinecone vector database
+Script to upload patient data to the vector database (Pinecone or a local index).
+
+Uploads are incremental: unchanged chunks are skipped, changed ones are
+upserted under stable IDs and removed ones are deleted.
 """
 
 import os
-import json
 import sys
+import argparse
 from pathlib import Path
 from pinecone import Pinecone, ServerlessSpec
 from langchain_openai import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.docstore.document import Document
 from dotenv import load_dotenv
 import time
 
-def load_environment():
-    """Load environment variables"""
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from embedding_cache import CachedEmbeddings
+from http_clients import HTTPClients
+from patients import PATIENT_DIRECTORY_VERSION, PatientFileWriter, extract_patient_name, record_version
+from keyword_index import KEYWORD_INDEX_VERSION
+from patient_facts import PATIENT_FACTS_VERSION, extract_facts
+from ingestion import (
+    Ingestor,
+    LocalTarget,
+    PineconeTarget,
+    iter_patient_records,
+    load_manifest,
+    save_manifest,
+)
+
+def load_env_file():
+    """Load the .env file into the environment"""
     # Try to load from backend directory first
     backend_env = Path(__file__).parent.parent / "backend" / ".env"
     if backend_env.exists():
         load_dotenv(backend_env)
     else:
         load_dotenv()
+
+def load_environment(vector_store='pinecone'):
+    """Load environment variables"""
+    load_env_file()
     
-    required_vars = ['OPENAI_API_KEY', 'PINECONE_API_KEY']
+    required_vars = ['OPENAI_API_KEY']
+    if vector_store == 'pinecone':
+        required_vars.append('PINECONE_API_KEY')
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
     if missing_vars:
@@ -66,55 +90,33 @@ def initialize_pinecone():
     
     return pc, index_name
 
-def load_patient_data():
-    """Load patient data from JSON file"""
-    data_file = Path(__file__).parent.parent / "backend" / "data" / "sample_patients.json"
+def get_data_file(path=None):
+    """Resolve the patient export to ingest"""
+    data_file = Path(path) if path else Path(__file__).parent.parent / "backend" / "data" / "sample_patients.json"
     
     if not data_file.exists():
         print(f"Error: Patient data file not found at {data_file}")
         sys.exit(1)
     
-    with open(data_file, 'r') as f:
-        patients = json.load(f)
-    
-    print(f"Loaded {len(patients)} patient records")
-    return patients
+    return data_file
 
-def create_documents(patients):
-    """Convert patient data to LangChain Document objects"""
-    documents = []
-    
-    for patient in patients:
-        doc = Document(
-            page_content=patient['content'],
-            metadata={
-                'patient_id': patient['id'],
-                'source': 'medical_records'
-            }
-        )
-        documents.append(doc)
-    
-    return documents
+def create_embeddings(http):
+    """OpenAI embeddings behind the shared on-disk cache, so unchanged records are not re-embedded"""
+    cache_dir = os.getenv('EMBEDDING_CACHE_DIR') or str(BACKEND_DIR / "data" / "embedding_cache")
+    # Parallel batches reuse the pooled keep-alive connections instead of each opening its own
+    embeddings = OpenAIEmbeddings(http_client=http.client, request_timeout=http.httpx_timeout)
+    return CachedEmbeddings(embeddings, cache_dir=cache_dir)
 
-def upload_to_pinecone(documents, pc, index_name):
-    """Upload documents to Pinecone vector store"""
-    print("Initializing OpenAI embeddings...")
-    embeddings = OpenAIEmbeddings()
+def create_target(args):
+    """Build the ingestion target and the path of its manifest"""
+    manifest_dir = BACKEND_DIR / "data" / "ingest_manifests"
+    if args.vector_store == 'local':
+        print(f"Updating local vector index in {args.index_dir}...")
+        return LocalTarget(args.index_dir, args.ann), str(manifest_dir / "local.json")
     
-    print("Creating vector store and uploading documents...")
-    try:
-        # Create vector store from documents with index name
-        vectorstore = PineconeVectorStore.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            index_name=index_name,
-            pinecone_api_key=os.getenv('PINECONE_API_KEY')
-        )
-        print(f"Successfully uploaded {len(documents)} documents to Pinecone!")
-        return vectorstore
-    except Exception as e:
-        print(f"Error uploading to Pinecone: {e}")
-        sys.exit(1)
+    # Initialize Pinecone
+    pc, index_name = initialize_pinecone()
+    return PineconeTarget(pc.Index(index_name)), str(manifest_dir / f"pinecone-{index_name}.json")
 
 def test_retrieval(vectorstore):
     """Test the retrieval functionality"""
@@ -138,31 +140,149 @@ def test_retrieval(vectorstore):
         except Exception as e:
             print(f"  Error during retrieval: {e}")
 
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Upload patient records to the vector store")
+    parser.add_argument(
+        "--vector-store",
+        choices=["pinecone", "local"],
+        default=os.getenv('VECTOR_STORE', 'pinecone').lower(),
+        help="where to index the records (default: $VECTOR_STORE or pinecone)"
+    )
+    parser.add_argument(
+        "--index-dir",
+        default=os.getenv('LOCAL_INDEX_DIR') or str(BACKEND_DIR / "data" / "vector_index"),
+        help="output directory for the local index"
+    )
+    parser.add_argument("--data-file", help="JSON array or JSONL export of patient records")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="max characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=100, help="characters shared by adjacent chunks")
+    parser.add_argument("--batch-size", type=int, default=100, help="chunks per embedding/upsert batch")
+    parser.add_argument("--workers", type=int, default=4, help="batches processed in parallel")
+    parser.add_argument(
+        "--partial",
+        action="store_true",
+        help="the export only contains some patients; don't delete the others"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="ignore the manifest, clear the vector store and re-upload everything"
+    )
+    parser.add_argument(
+        "--ann",
+        choices=["ivf"],
+        default=os.getenv('LOCAL_INDEX_ANN') or None,
+        help="also train an approximate (IVF) index for large corpora"
+    )
+    return parser.parse_args()
+
 def main():
     """Main function"""
-    print("Starting Pinecone upload process...")
+    # Read .env first so it can supply defaults for the command line options
+    load_env_file()
+    args = parse_args()
+    print(f"Starting {args.vector_store} upload process...")
     
     # Load environment variables
     
-    load_environment()
+    load_environment(args.vector_store)
     
-    # Initialize Pinecone
-    pc, index_name = initialize_pinecone()
+    # Stream patient records and split them into chunks
+    data_file = get_data_file(args.data_file)
+    print(f"Streaming patient records from {data_file}")
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap
+    )
+    
+    print("Initializing OpenAI embeddings...")
+    http = HTTPClients.from_env()
+    embeddings = create_embeddings(http)
+    
+    target, manifest_path = create_target(args)
+    manifest = {} if args.full else load_manifest(manifest_path)
+    if args.full:
+        print("Full re-index requested, clearing existing vectors...")
+        target.clear()
+    
+    # Upload only what changed since the last run
+    ingestor = Ingestor(
+        target,
+        embeddings,
+        manifest,
+        batch_size=args.batch_size,
+        max_workers=args.workers
+    )
+    # Record each patient's name and record version; the backend uses these to
+    # resolve names in questions and to invalidate cached answers
+    directory_path = os.getenv('PATIENT_DIRECTORY_PATH') or str(BACKEND_DIR / "data" / "patient_directory.jsonl")
+    # Chunk texts for the backend's BM25 keyword index, kept for every patient (changed or not)
+    keyword_index_path = os.getenv('KEYWORD_INDEX_PATH') or str(BACKEND_DIR / "data" / "keyword_index.jsonl")
+    # Vitals, medications, plan etc. per patient, which the backend serves for simple lookups without the LLM
+    facts_path = os.getenv('PATIENT_FACTS_PATH') or str(BACKEND_DIR / "data" / "patient_facts.jsonl")
+    # Each is written one patient at a time, so memory stays flat however large the export is
+    writers = [
+        PatientFileWriter(directory_path, PATIENT_DIRECTORY_VERSION),
+        PatientFileWriter(keyword_index_path, KEYWORD_INDEX_VERSION),
+        PatientFileWriter(facts_path, PATIENT_FACTS_VERSION),
+    ]
+    directory, keyword_index, facts = writers
+    fact_answers = 0
+    
+    def track_patient(patient, chunks):
+        nonlocal fact_answers
+        directory.add(patient['id'], {
+            "name": extract_patient_name(patient),
+            "version": record_version(patient)
+        })
+        keyword_index.add(patient['id'], [
+            {"id": doc_id, "text": doc.page_content, "metadata": doc.metadata}
+            for doc_id, doc in chunks
+        ])
+        patient_facts = extract_facts(patient)
+        facts.add(patient['id'], patient_facts)
+        fact_answers += len(patient_facts['answers'])
     
-    # Load patient data
-    patients = load_patient_data()
+    try:
+        stats = ingestor.ingest(iter_patient_records(data_file), splitter, partial=args.partial, on_chunks=track_patient)
+    except Exception as e:
+        print(f"Error during ingestion: {e}")
+        for writer in writers:
+            writer.close(merge=True)
+        # Keep both old and new IDs so the next run still cleans up anything this run left behind
+        merged = {patient_id: set(ids) for patient_id, ids in manifest.items()}
+        for patient_id, ids in ingestor.manifest.items():
+            merged.setdefault(patient_id, set()).update(ids)
+        save_manifest(manifest_path, merged)
+        sys.exit(1)
+    
+    save_manifest(manifest_path, ingestor.manifest)
+    for writer in writers:
+        writer.close(merge=args.partial)
     
-    # Create documents
-    documents = create_documents(patients)
+    print(f"Extracted {fact_answers} fact answers for {stats['patients']} patients")
     
-    # Upload to Pinecone
-    vectorstore = upload_to_pinecone(documents, pc, index_name)
+    print(f"Processed {stats['patients']} patients ({stats['chunks']} chunks): "
+          f"{stats['upserted']} upserted, {stats['unchanged']} unchanged, "
+          f"{stats['deleted']} deleted, {stats['failed']} failed")
+    
+    vectorstore = target.vectorstore(embeddings)
     
     # Test retrieval
     test_retrieval(vectorstore)
     
+    cache_stats = embeddings.stats()
+    print(f"\nEmbedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} texts embedded in {cache_stats['api_calls']} API calls")
+    for host, counts in http.stats()['hosts'].items():
+        print(f"HTTP {host}: {counts['requests']} requests over {counts['connections']} connections")
+    
+    if stats['failed']:
+        print(f"\n⚠️  {stats['failed']} chunks failed to upload; re-run the script to retry them.")
+        sys.exit(1)
+    
     print("\n✅ Upload completed successfully!")
-    print(f"Your medical assistant is now ready with {len(patients)} patient records.")
+    print(f"Your medical assistant is now ready with {stats['patients']} patient records.")
     print(f"You can now start the backend server and test the voice assistant.")
 
 if __name__ == "__main__":